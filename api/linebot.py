@@ -1,618 +1,3396 @@
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage,
-    TemplateSendMessage, ButtonsTemplate, MessageAction, FlexSendMessage, ConfirmTemplate, ImageCarouselTemplate, ImageCarouselColumn
+import time
+
+_module_started = time.perf_counter()
+
+from datetime import datetime, date, timedelta, timezone
+
+import os
+import json
+import sys
+import logging
+import re
+import importlib
+import unicodedata
+import threading
+import itertools
+import functools
+from contextlib import contextmanager
+import bisect
+import heapq
+from array import array
+import queue
+import atexit
+import zlib
+import csv
+import socket
+import sqlite3
+import tempfile
+import subprocess
+import random
+import hmac
+import hashlib
+import base64
+from collections import OrderedDict, deque
+from urllib.parse import urlparse, unquote
+
+# 冷啟動時只載入 Flask；linebot、gspread、oauth2client 等到真的用到時才 import
+IMPORT_TIMINGS = {}
+_started = time.perf_counter()
+from flask import Flask, request, abort, Response
+IMPORT_TIMINGS["flask"] = round((time.perf_counter() - _started) * 1000, 2)
+
+
+def timed_import(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMINGS.setdefault(name, round((time.perf_counter() - started) * 1000, 2))
+    return module
+
+
+class LazyModule:
+    # 第一次存取屬性時才 import 模組
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = timed_import(self._name)
+        return getattr(module, attr)
+
+
+models = LazyModule("linebot.models")
+
+try:
+    # 有安裝 orjson 時用它解析 webhook body（直接吃 bytes，比 json.loads 快數倍）
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+app = Flask(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# 壓力測試用的本地替身：
+#   SHEETS_BACKEND=fake 從 SHEETS_FIXTURES_DIR 的 <工作表名稱>.json / .csv 讀資料，不連 Google Sheets
+#   LINE_BACKEND=fake   回覆只記錄在記憶體（GET /admin/fake-line/replies 查看），不呼叫 LINE API
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "gspread")
+SHEETS_FIXTURES_DIR = os.getenv(
+    "SHEETS_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fixtures", "sheets")
+)
+FAKE_SHEETS_LATENCY_MS = float(os.getenv("FAKE_SHEETS_LATENCY_MS", "0"))
+LINE_BACKEND = os.getenv("LINE_BACKEND", "line")
+FAKE_LINE_LATENCY_MS = float(os.getenv("FAKE_LINE_LATENCY_MS", "0"))
+FAKE_LINE_MAX_RECORDS = int(os.getenv("FAKE_LINE_MAX_RECORDS", "1000"))
+
+
+class FakeSpreadsheet:
+    # 只實作 SpreadsheetLoader 用到的 values_get / values_batch_get，回傳格式與 Sheets API 相同
+    def __init__(self, fixtures_dir=SHEETS_FIXTURES_DIR, latency_ms=FAKE_SHEETS_LATENCY_MS):
+        self.latency = latency_ms / 1000
+        self.sheets = {}
+        for filename in sorted(os.listdir(fixtures_dir)):
+            name, ext = os.path.splitext(filename)
+            path = os.path.join(fixtures_dir, filename)
+            if ext == ".json":
+                with open(path, encoding="utf-8") as f:
+                    self.sheets[name] = self._to_values(json.load(f))
+            elif ext == ".csv":
+                with open(path, encoding="utf-8-sig", newline="") as f:
+                    self.sheets[name] = [row for row in csv.reader(f)]
+        logger.info(f"使用本地試算表資料：{fixtures_dir}（{', '.join(self.sheets)}）")
+
+    @staticmethod
+    def _to_values(data):
+        # JSON 可以是二維陣列（第一列為標題），或物件陣列
+        if data and isinstance(data[0], dict):
+            header = list(data[0])
+            return [header] + [[str(row.get(key, "")) for key in header] for row in data]
+        return [[str(value) for value in row] for row in data]
+
+    def _read(self, a1_range):
+        match = re.match(r"^'((?:[^']|'')*)'(?:!\$?[A-Z]*\$?(\d*)(?::\$?[A-Z]*\$?(\d*))?)?$", a1_range)
+        if not match:
+            raise ValueError(f"無法解析的範圍：{a1_range}")
+        name = match.group(1).replace("''", "'")
+        if name not in self.sheets:
+            raise KeyError(f"找不到工作表：{name}")
+        rows = self.sheets[name]
+        start = int(match.group(2)) if match.group(2) else 1
+        end = int(match.group(3)) if match.group(3) else len(rows)
+        result = {"range": a1_range, "majorDimension": "ROWS"}
+        values = rows[start - 1:end]
+        if values:
+            result["values"] = values
+        return result
+
+    def values_get(self, a1_range, params=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._read(a1_range)
+
+    def values_batch_get(self, ranges, params=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return {"valueRanges": [self._read(a1_range) for a1_range in ranges]}
+
+
+class FakeLineBotApi:
+    # 取代 LineBotApi：記錄每次送出的內容，並可模擬 API 延遲
+    def __init__(self, latency_ms=FAKE_LINE_LATENCY_MS, max_records=FAKE_LINE_MAX_RECORDS):
+        self.latency = latency_ms / 1000
+        self.records = deque(maxlen=max_records)
+        self.calls = 0
+
+    def _post(self, path, endpoint=None, data=None, timeout=None):
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.loads(data) if data else None
+        self.calls += 1
+        self.records.append({"path": path, "body": payload, "at": time.time()})
+
+    def reply_message(self, reply_token, messages, notification_disabled=False, timeout=None):
+        self._send("/v2/bot/message/reply", {"replyToken": reply_token}, messages)
+
+    def push_message(self, to, messages, notification_disabled=False, timeout=None):
+        self._send("/v2/bot/message/push", {"to": to}, messages)
+
+    def multicast(self, to, messages, notification_disabled=False, timeout=None):
+        self._send("/v2/bot/message/multicast", {"to": to}, messages)
+
+    def _send(self, path, data, messages):
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        data["messages"] = [message.as_json_dict() for message in messages]
+        self._post(path, data=json.dumps(data))
+
+
+_line_bot_api = None
+_channel_secret = None
+
+
+def get_line_bot_api():
+    # 第一次回覆時才建立 LineBotApi（連帶 import linebot 與 requests）
+    global _line_bot_api
+    if _line_bot_api is None:
+        if LINE_BACKEND == "fake":
+            _line_bot_api = FakeLineBotApi()
+        else:
+            _line_bot_api = timed_import("linebot").LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+    return _line_bot_api
+
+
+def get_channel_secret():
+    global _channel_secret
+    if _channel_secret is None:
+        _channel_secret = (os.getenv("LINE_CHANNEL_SECRET") or "").encode("utf-8")
+    return _channel_secret
+
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    # Prometheus 格式的延遲分布，labels 組合各自累計
+    def __init__(self, name, help_text, labelnames=(), buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, key))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket{%sle="%s"} %d' % (self.name, prefix, bound, cumulative))
+            lines.append('%s_bucket{%sle="+Inf"} %d' % (self.name, prefix, count))
+            suffix = "{%s}" % labels if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class Gauge:
+    # 讀取時才呼叫 callback 取值（例如佇列長度）
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help_text, labelnames=()):
+        metric = Histogram(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, callback):
+        metric = Gauge(name, help_text, callback)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+WEBHOOK_SECONDS = metrics.histogram("linebot_webhook_seconds", "webhook request 處理時間")
+SIGNATURE_SECONDS = metrics.histogram("linebot_signature_seconds", "簽章驗證與事件解析時間")
+DISPATCH_SECONDS = metrics.histogram("linebot_dispatch_seconds", "單一訊息從路由到回覆完成的時間", ("command",))
+SHEETS_SECONDS = metrics.histogram("linebot_sheets_seconds", "Google Sheets API 呼叫時間", ("operation", "worksheet"))
+PAYLOAD_SECONDS = metrics.histogram("linebot_payload_build_seconds", "建立並序列化回覆訊息的時間", ("template",))
+REPLY_SECONDS = metrics.histogram("linebot_reply_seconds", "LINE reply API 呼叫時間")
+PUSH_SECONDS = metrics.histogram("linebot_push_seconds", "LINE push API 呼叫時間（超過 5 則的回覆）")
+MULTICAST_SECONDS = metrics.histogram("linebot_multicast_seconds", "LINE multicast API 呼叫時間（會員提醒）")
+
+
+GOOGLE_SCOPES = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive"
+]
+# token 到期前多少秒就先在背景更新
+GSPREAD_TOKEN_REFRESH_MARGIN = int(os.getenv("GSPREAD_TOKEN_REFRESH_MARGIN", "300"))
+# 每個 Google API HTTP request 的逾時秒數；沒有逾時的話一個卡住的連線會讓同一個工作表的下載永遠不會結束
+SHEETS_HTTP_TIMEOUT = float(os.getenv("SHEETS_HTTP_TIMEOUT", "20"))
+
+
+class GspreadClientManager:
+    # 每個 process 只授權一次：直接從環境變數建立憑證（不寫暫存檔），
+    # 重複使用同一個 gspread client 與其 HTTP 連線池，並在 token 過期前於背景更新
+    def __init__(self, refresh_margin=GSPREAD_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._client = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get_client(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._authorize()
+                client = self._client
+        remaining = self._seconds_to_expiry(client)
+        if remaining is not None and remaining < self.refresh_margin:
+            self._refresh_in_background(client)
+        return client
+
+    def reset(self):
+        # API 回 401（token 被撤銷或更新失敗）時由 sheets_guard 呼叫，下次 get_client 重新授權
+        with self._lock:
+            self._client = None
+        logger.warning("Google Sheets 授權失效，下次呼叫時重新授權")
+
+    def _authorize(self):
+        credentials_content = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_CONTENT")
+        if not credentials_content:
+            logger.error("缺少 GOOGLE_APPLICATION_CREDENTIALS_CONTENT 環境變數")
+            raise ValueError("環境變數未設定")
+        service_account = timed_import("oauth2client.service_account")
+        creds = service_account.ServiceAccountCredentials.from_json_keyfile_dict(json.loads(credentials_content), GOOGLE_SCOPES)
+        client = timed_import("gspread").authorize(creds)
+        # gspread 6 的 set_timeout 在 http_client 上，gspread 5 直接在 client 上
+        set_timeout = getattr(client, "set_timeout", None) or getattr(getattr(client, "http_client", None), "set_timeout", None)
+        if set_timeout is not None:
+            set_timeout(SHEETS_HTTP_TIMEOUT)
+        else:
+            logger.warning("這個版本的 gspread 無法設定 HTTP 逾時，Google Sheets 卡住時只能等待 SingleFlight 換手")
+        # 先取得一次 token，之後才知道到期時間
+        self._refresh_token(client)
+        logger.info("Google Sheets 授權完成，已快取 client")
+        return client
+
+    @staticmethod
+    def _credentials(client):
+        # gspread 6 把憑證放在 http_client，舊版直接放在 client.auth
+        http_client = getattr(client, "http_client", None)
+        return getattr(http_client, "auth", None) or getattr(client, "auth", None)
+
+    def _seconds_to_expiry(self, client):
+        creds = self._credentials(client)
+        expiry = getattr(creds, "expiry", None) or getattr(creds, "token_expiry", None)
+        if expiry is None:
+            return None
+        return (expiry - datetime.utcnow()).total_seconds()
+
+    def _refresh_token(self, client):
+        creds = self._credentials(client)
+        if creds is None:
+            return
+        if hasattr(creds, "expiry"):
+            # google-auth 憑證
+            from google.auth.transport.requests import Request
+            creds.refresh(functools.partial(Request(), timeout=SHEETS_HTTP_TIMEOUT))
+        else:
+            # oauth2client 憑證（舊版 gspread）
+            import httplib2
+            creds.refresh(httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT))
+
+    def _refresh_in_background(self, client):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh_token(client)
+                logger.info("Google Sheets token 已於背景更新")
+            except Exception as e:
+                logger.error(f"Google Sheets token 更新失敗：{e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="gspread-token-refresh", daemon=True).start()
+
+
+gspread_clients = GspreadClientManager()
+
+
+def get_gspread_client():
+    # 授權失敗只讓這次請求失敗，不結束整個 process；下次呼叫會重新授權
+    try:
+        return gspread_clients.get_client()
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.error(f"Google Sheets 授權錯誤：{e}", exc_info=True)
+        raise SheetsUnavailable("Google Sheets 授權失敗，請稍後再試") from e
+
+
+# 所有 Google Sheets 呼叫都經過 sheets_guard：
+#   SHEETS_RATE_PER_MINUTE / SHEETS_RATE_BURST    token bucket，對應 Sheets API 每分鐘讀取配額
+#   SHEETS_RETRY_ATTEMPTS / SHEETS_RETRY_BASE / SHEETS_RETRY_MAX  429 / 5xx / 網路錯誤的指數退避（full jitter）
+#   SHEETS_BREAKER_FAILURES / SHEETS_BREAKER_COOLDOWN  連續失敗幾次後熔斷幾秒，期間直接使用快取中的舊資料
+SHEETS_RATE_PER_MINUTE = float(os.getenv("SHEETS_RATE_PER_MINUTE", "60"))
+SHEETS_RATE_BURST = int(os.getenv("SHEETS_RATE_BURST", "10"))
+SHEETS_RATE_WAIT = float(os.getenv("SHEETS_RATE_WAIT", "10"))
+SHEETS_RETRY_ATTEMPTS = int(os.getenv("SHEETS_RETRY_ATTEMPTS", "4"))
+SHEETS_RETRY_BASE = float(os.getenv("SHEETS_RETRY_BASE", "0.5"))
+SHEETS_RETRY_MAX = float(os.getenv("SHEETS_RETRY_MAX", "8"))
+SHEETS_BREAKER_FAILURES = int(os.getenv("SHEETS_BREAKER_FAILURES", "5"))
+SHEETS_BREAKER_COOLDOWN = float(os.getenv("SHEETS_BREAKER_COOLDOWN", "30"))
+RETRIABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class SheetsUnavailable(Exception):
+    # 熔斷中、配額等不到或授權失敗；訊息可以直接顯示給使用者
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute=SHEETS_RATE_PER_MINUTE, burst=SHEETS_RATE_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=SHEETS_RATE_WAIT):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate if self.rate > 0 else timeout
+            if now + wait > deadline:
+                raise SheetsUnavailable("Google Sheets 查詢量過大，請稍後再試")
+            time.sleep(wait)
+
+    def available(self):
+        with self._lock:
+            return round(min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate), 2)
+
+
+class CircuitBreaker:
+    # closed → 連續失敗達門檻 → open（cooldown 秒內直接拒絕）→ half_open（只放一個請求試探）
+    # 試探的請求超過 cooldown 秒都沒有結果（例如連線卡住）時視為失敗，再放下一個請求試探
+    def __init__(self, failures=SHEETS_BREAKER_FAILURES, cooldown=SHEETS_BREAKER_COOLDOWN):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self.probe_started = now
+                return True
+            if self.state == "half_open" and now - self.probe_started >= self.cooldown:
+                logger.warning(f"Google Sheets 試探請求超過 {self.cooldown} 秒沒有結果，改放行新的試探請求")
+                self.probe_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.max_failures:
+                if self.state != "open":
+                    logger.warning(f"Google Sheets 連續失敗 {self.failures} 次，暫停呼叫 {self.cooldown} 秒")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+def error_status(error):
+    # gspread.exceptions.APIError 帶有 requests 的 response
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retriable(error):
+    status = error_status(error)
+    if status is not None:
+        return status in RETRIABLE_STATUS
+    # requests 的連線錯誤、逾時都是 OSError 的子類別
+    return isinstance(error, OSError)
+
+
+class SheetsGuard:
+    def __init__(self, limiter=None, breaker=None, attempts=SHEETS_RETRY_ATTEMPTS,
+                 base_delay=SHEETS_RETRY_BASE, max_delay=SHEETS_RETRY_MAX, on_unauthorized=None):
+        self.limiter = limiter or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+        self.on_unauthorized = on_unauthorized
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.counts = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0}
+
+    def call(self, fn):
+        self.counts["calls"] += 1
+        for attempt in range(self.attempts):
+            if not self.breaker.allow():
+                self.counts["rejected"] += 1
+                raise SheetsUnavailable("Google Sheets 暫時無法使用，請稍後再試")
+            self.limiter.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                retriable = is_retriable(e)
+                if error_status(e) == 401 and self.on_unauthorized is not None:
+                    self.on_unauthorized()
+                if retriable:
+                    self.breaker.record_failure()
+                else:
+                    # 400 / 404 之類的錯誤代表 API 本身正常
+                    self.breaker.record_success()
+                if not retriable or attempt == self.attempts - 1:
+                    self.counts["failures"] += 1
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                self.counts["retries"] += 1
+                logger.warning(f"Google Sheets 呼叫失敗（{error_status(e) or type(e).__name__}），{delay:.2f} 秒後重試")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        return {
+            **self.counts,
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "tokens": self.limiter.available(),
+        }
+
+
+sheets_guard = SheetsGuard(on_unauthorized=gspread_clients.reset)
+metrics.gauge("linebot_sheets_circuit_open", "Google Sheets 熔斷中為 1",
+              lambda: int(sheets_guard.breaker.state != "closed"))
+
+SPREADSHEET_ID = "1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg"
+
+# 各工作表快取秒數：會員相關資料較常變動，常見問題 / 場地 / 教練 / 課程幾乎是靜態的
+# 可用 SHEET_CACHE_TTL 環境變數（JSON，例如 {"常見問題": 1800}）覆寫
+SHEET_CACHE_TTL = {
+    "會員資料": 60,
+    "會員健身紀錄": 30,
+    "常見問題": 900,
+    "場地資料": 900,
+    "教練資料": 900,
+    "課程資料": 300,
+}
+SHEET_CACHE_TTL.update(json.loads(os.getenv("SHEET_CACHE_TTL", "{}")))
+SHEET_CACHE_DEFAULT_TTL = int(os.getenv("SHEET_CACHE_DEFAULT_TTL", "300"))
+# 超過這個時間的舊資料不再先回傳，改為同步重新下載
+SHEET_CACHE_MAX_STALE = int(os.getenv("SHEET_CACHE_MAX_STALE", "3600"))
+# 等待其他請求正在進行的下載最多幾秒，逾時拋出 TimeoutError
+SHEET_FETCH_TIMEOUT = float(os.getenv("SHEET_FETCH_TIMEOUT", "30"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+class SheetSnapshot:
+    # 某個工作表在某個時間點的完整內容；version 每次重新下載都會遞增
+    __slots__ = ("records", "version", "fetched_at")
+
+    def __init__(self, records, version, fetched_at):
+        self.records = records
+        self.version = version
+        self.fetched_at = fetched_at
+
+
+SHEET_NAMES = ("會員資料", "會員健身紀錄", "常見問題", "場地資料", "教練資料", "課程資料")
+
+# 載入時就解析好的欄位：date 存成日期序數（0 表示無法解析）、int 存成 array('q')、phone 存成正規化後的電話
+SHEET_COLUMN_TYPES = {
+    "會員資料": {"電話": "phone", "會員點數": "int", "會員到期日": "date"},
+    "會員健身紀錄": {"日期": "date", "紀錄電話": "phone", "時長": "int"},
+    "課程資料": {"開始日期": "date"},
+}
+INT_MIN, INT_MAX = -(2 ** 63), 2 ** 63 - 1
+INT_MISSING = INT_MIN
+
+
+def parse_date_ordinal(value):
+    parsed = parse_sheet_date(value)
+    return parsed.toordinal() if parsed else 0
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError, OverflowError):
+            return INT_MISSING
+
+
+# kind: (建立欄位容器, 解析原始值, 轉回 Python 值)
+TYPED_COLUMNS = {
+    "date": (lambda: array("l"), parse_date_ordinal, lambda v: date.fromordinal(v) if v else None),
+    "int": (lambda: array("q"), parse_int, lambda v: None if v == INT_MISSING else v),
+    "phone": (list, lambda v: sys.intern(normalize_phone(v)), lambda v: v),
+}
+
+
+def memoized(parse):
+    # 同一欄常有大量重複的值（日期、電話），每個不同的值只解析一次
+    cache = {}
+
+    def run(value):
+        try:
+            return cache[value]
+        except KeyError:
+            result = cache[value] = parse(value)
+            return result
+    return run
+
+
+def is_int_column(values):
+    return all(type(v) is int and INT_MIN < v <= INT_MAX for v in values)
+
+
+def compact_column(values):
+    # 全部是整數的欄位存成 array('q')，其他欄位的字串 intern 後共用同一個物件
+    if values and is_int_column(values):
+        return array("q", values)
+    return [sys.intern(v) if type(v) is str else v for v in values]
+
+
+def encode_column(column):
+    # array 存成 typecode + base64 的原始 bytes，載入時不必逐一轉換
+    if isinstance(column, array):
+        return {"array": column.typecode, "data": base64.b64encode(column.tobytes()).decode("ascii")}
+    return column
+
+
+def decode_column(value):
+    if isinstance(value, dict):
+        if value.get("array") not in ("l", "q"):
+            raise ValueError(f"不支援的 array 型別：{value.get('array')}")
+        column = array(value["array"])
+        column.frombytes(base64.b64decode(value["data"]))
+        return column
+    if not isinstance(value, list):
+        raise ValueError("快照檔欄位格式不符")
+    return [sys.intern(v) if type(v) is str else v for v in value]
+
+
+def extend_column(column, length, values):
+    # 欄位可能與其他 SheetTable 共用；只有尾端剛好在 length 時才直接延長，否則先複製
+    if len(column) != length:
+        column = column[:length]
+    if isinstance(column, array):
+        if is_int_column(values):
+            column.extend(values)
+            return column
+        column = list(column)
+    column.extend(sys.intern(v) if type(v) is str else v for v in values)
+    return column
+
+
+class SheetTable:
+    # 以欄為單位儲存的工作表：標題只存一次，每一欄是一個 list 或 array，
+    # table[i] 回傳 RowView（用法與 dict 相同），既有的 row.get("欄位") 寫法不用改。
+    # appended() 會共用既有欄位，尾端新增資料列不用複製整張表
+    __slots__ = ("header", "columns", "length", "typed", "_positions")
+
+    def __init__(self, header, columns, length, typed=None):
+        self.header = tuple(sys.intern(str(name)) for name in header)
+        self.columns = columns
+        self.length = length
+        # {欄位名稱: (kind, 解析後的欄位)}
+        self.typed = typed or {}
+        self._positions = {name: i for i, name in enumerate(self.header)}
+
+    @classmethod
+    def from_rows(cls, header, rows, column_types=None):
+        # rows 的每一列長度都要等於 len(header)
+        columns = [compact_column([row[i] for row in rows]) for i in range(len(header))]
+        table = cls(header, columns, len(rows))
+        for name, kind in (column_types or {}).items():
+            position = table._positions.get(name)
+            if position is not None:
+                factory, parse, _ = TYPED_COLUMNS[kind]
+                values = factory()
+                values.extend(map(memoized(parse), columns[position]))
+                table.typed[name] = (kind, values)
+        return table
+
+    @classmethod
+    def from_records(cls, records, column_types=None):
+        if isinstance(records, SheetTable):
+            return records
+        header = list(records[0]) if records else []
+        return cls.from_rows(header, [[row.get(name, "") for name in header] for row in records], column_types)
+
+    def appended(self, rows):
+        if not rows:
+            return self
+        columns = [
+            extend_column(column, self.length, [row[i] for row in rows])
+            for i, column in enumerate(self.columns)
+        ]
+        typed = {}
+        for name, (kind, values) in self.typed.items():
+            if len(values) != self.length:
+                values = values[:self.length]
+            position = self._positions[name]
+            values.extend(map(memoized(TYPED_COLUMNS[kind][1]), [row[position] for row in rows]))
+            typed[name] = (kind, values)
+        return SheetTable(self.header, columns, self.length + len(rows), typed)
+
+    def startswith(self, other):
+        # other 的所有資料列是否為本表的前幾列（用來判斷只是尾端新增資料）
+        if not isinstance(other, SheetTable) or other.header != self.header or other.length > self.length:
+            return False
+        n = other.length
+        return all(a is b or a[:n] == b[:n] for a, b in zip(self.columns, other.columns))
+
+    def column(self, name, kind=None, start=0):
+        # 第 start 列之後的整欄資料；指定 kind 時回傳解析後的值（date 為日期序數）
+        if kind is not None:
+            typed = self.typed.get(name)
+            if typed is not None and typed[0] == kind:
+                return typed[1][start:self.length]
+            return [TYPED_COLUMNS[kind][1](v) for v in self.column(name, None, start)]
+        position = self._positions.get(name)
+        if position is None:
+            return [""] * (self.length - start)
+        return self.columns[position][start:self.length]
+
+    def value(self, position, name, kind):
+        typed = self.typed.get(name)
+        _, parse, decode = TYPED_COLUMNS[kind]
+        if typed is not None and typed[0] == kind:
+            return decode(typed[1][position])
+        return decode(parse(RowView(self, position).get(name, "")))
+
+    def to_state(self):
+        # 寫入快照檔用：只包含可以轉成 JSON 的 dict / list / 字串 / 數字
+        return {
+            "header": list(self.header),
+            "length": self.length,
+            "columns": [encode_column(column[:self.length]) for column in self.columns],
+            "typed": {name: [kind, encode_column(values[:self.length])] for name, (kind, values) in self.typed.items()},
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        # 快照檔內容不可信任：格式不符時丟出 ValueError
+        length = state["length"]
+        header = state["header"]
+        columns = [decode_column(column) for column in state["columns"]]
+        typed = {}
+        for name, (kind, values) in state["typed"].items():
+            if kind not in TYPED_COLUMNS:
+                raise ValueError(f"不支援的欄位型別：{kind}")
+            typed[name] = (kind, decode_column(values))
+        if len(columns) != len(header) or any(len(c) != length for c in columns + [v for _, v in typed.values()]):
+            raise ValueError("快照檔欄位長度不符")
+        return cls(header, columns, length, typed)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield RowView(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RowView(self, i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("SheetTable index out of range")
+        return RowView(self, index)
+
+
+class RowView:
+    # SheetTable 的一列，只存（table, 位置），取值時才到欄位中讀取
+    __slots__ = ("table", "position")
+
+    def __init__(self, table, position):
+        self.table = table
+        self.position = position
+
+    def __getitem__(self, name):
+        return self.table.columns[self.table._positions[name]][self.position]
+
+    def get(self, name, default=None):
+        i = self.table._positions.get(name)
+        return default if i is None else self.table.columns[i][self.position]
+
+    def keys(self):
+        return list(self.table.header)
+
+    def values(self):
+        return [self[name] for name in self.table.header]
+
+    def items(self):
+        return [(name, self[name]) for name in self.table.header]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def date(self, name):
+        return self.table.value(self.position, name, "date")
+
+    def int(self, name):
+        return self.table.value(self.position, name, "int")
+
+    def phone(self, name):
+        return self.table.value(self.position, name, "phone")
+
+    def __iter__(self):
+        return iter(self.table.header)
+
+    def __len__(self):
+        return len(self.table.header)
+
+    def __contains__(self, name):
+        return name in self.table._positions
+
+    def __eq__(self, other):
+        if isinstance(other, RowView):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"RowView({self.to_dict()!r})"
+
+
+def sheet_range(sheet_name, cells=None):
+    # A1 表示法：工作表名稱加上單引號，避免特殊字元被誤判
+    quoted = "'%s'" % sheet_name.replace("'", "''")
+    return f"{quoted}!{cells}" if cells else quoted
+
+
+def values_to_records(values, sheet_name=None):
+    # 與 worksheet.get_all_records() 相同的轉換：第一列為標題，數字字串轉成數字，空白為 ""
+    if not values:
+        return SheetTable((), [], 0)
+    return rows_to_records(values[0], values[1:], sheet_name)
+
+
+def rows_to_records(header, rows, sheet_name=None):
+    return SheetTable.from_rows(header, numericise_rows(header, rows), SHEET_COLUMN_TYPES.get(sheet_name))
+
+
+def numericise_rows(header, rows):
+    numericise_all = timed_import("gspread.utils").numericise_all
+    width = len(header)
+    return [
+        numericise_all(list(row[:width]) + [""] * (width - len(row)), empty2zero=False, default_blank="")
+        for row in rows
+    ]
+
+
+def column_letter(index):
+    # 1 → A、27 → AA
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def trim_row(row):
+    # Sheets API 不回傳列尾的空白儲存格，比對前先去掉
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+# 只會在尾端新增資料列的工作表（LIFF 健身紀錄頁面寫入），更新時只下載新增的列：
+#   SHEETS_APPEND_ONLY            逗號分隔的工作表名稱，設為空字串停用
+#   SHEETS_DELTA_FULL_INTERVAL    每隔幾秒仍完整下載一次，補捉中間列被修改的情況
+SHEETS_APPEND_ONLY = tuple(name for name in os.getenv("SHEETS_APPEND_ONLY", "會員健身紀錄").split(",") if name)
+SHEETS_DELTA_FULL_INTERVAL = int(os.getenv("SHEETS_DELTA_FULL_INTERVAL", "3600"))
+
+
+class AppendState:
+    # 上次同步到的位置：rows 為試算表最後一列的列號（含標題列），last 為該列的原始值
+    __slots__ = ("header", "rows", "last", "records", "full_at")
+
+    def __init__(self, values, records):
+        self.header = list(values[0]) if values else []
+        self.rows = len(values)
+        self.last = trim_row(values[-1]) if values else []
+        self.records = records
+        self.full_at = time.time()
+
+
+class SpreadsheetLoader:
+    # 試算表只 open 一次（metadata 只查一次），之後每個工作表的讀取都是一次 values API 呼叫；
+    # load_all 以 values:batchGet 一次取回所有工作表
+    def __init__(self, spreadsheet_id, sheet_names=SHEET_NAMES, append_only=SHEETS_APPEND_ONLY):
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_names = tuple(sheet_names)
+        self.append_only = set(append_only)
+        self.delta_counts = {"full": 0, "delta": 0, "delta_rows": 0, "mismatch": 0}
+        self._append_states = {}
+        self._spreadsheet = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def spreadsheet(self):
+        if SHEETS_BACKEND == "fake":
+            if self._spreadsheet is None:
+                with self._lock:
+                    if self._spreadsheet is None:
+                        self._spreadsheet = FakeSpreadsheet()
+            return self._spreadsheet
+        client = get_gspread_client()
+        if self._spreadsheet is None or self._client is not client:
+            with self._lock:
+                if self._spreadsheet is None or self._client is not client:
+                    with SHEETS_SECONDS.time(operation="open_by_key", worksheet=""):
+                        self._spreadsheet = sheets_guard.call(lambda: client.open_by_key(self.spreadsheet_id))
+                    self._client = client
+        return self._spreadsheet
+
+    def fetch(self, sheet_name):
+        state = self._append_states.get(sheet_name)
+        # 上次載入時是空表（沒有標題列）就沒有可以比對的位置，直接完整下載
+        if state is not None and state.rows and state.header and time.time() - state.full_at < SHEETS_DELTA_FULL_INTERVAL:
+            records = self.fetch_delta(sheet_name, state)
+            if records is not None:
+                return records
+        spreadsheet = self.spreadsheet()
+        with SHEETS_SECONDS.time(operation="values_get", worksheet=sheet_name):
+            response = sheets_guard.call(lambda: spreadsheet.values_get(sheet_range(sheet_name)))
+        return self._load(sheet_name, response.get("values", []))
+
+    def fetch_delta(self, sheet_name, state):
+        # 一次 batchGet 取標題列與「上次最後一列」之後的所有列；
+        # 標題或上次最後一列對不上（有人修改或刪除資料）時回傳 None，由呼叫端完整重新下載
+        spreadsheet = self.spreadsheet()
+        cells = f"A{state.rows}:{column_letter(len(state.header))}"
+        ranges = [sheet_range(sheet_name, "1:1"), sheet_range(sheet_name, cells)]
+        try:
+            with SHEETS_SECONDS.time(operation="values_batch_get_delta", worksheet=sheet_name):
+                response = sheets_guard.call(lambda: spreadsheet.values_batch_get(ranges))
+        except Exception as e:
+            # 範圍不合法（例如工作表被縮小）時 API 回 400，改為完整重新下載
+            if error_status(e) != 400:
+                raise
+            self.delta_counts["mismatch"] += 1
+            logger.warning(f"工作表 {sheet_name} 增量讀取範圍錯誤，改為完整重新下載：{e}")
+            return None
+        header_range, tail_range = (response.get("valueRanges", []) + [{}, {}])[:2]
+        header = (header_range.get("values") or [[]])[0]
+        tail = tail_range.get("values", [])
+        if header != state.header or not tail or trim_row(tail[0]) != state.last:
+            self.delta_counts["mismatch"] += 1
+            logger.info(f"工作表 {sheet_name} 的既有資料已變動，改為完整重新下載")
+            return None
+        self.delta_counts["delta"] += 1
+        new_rows = tail[1:]
+        if not new_rows:
+            return state.records
+        records = state.records.appended(numericise_rows(state.header, new_rows))
+        state.rows += len(new_rows)
+        state.last = trim_row(new_rows[-1])
+        state.records = records
+        self.delta_counts["delta_rows"] += len(new_rows)
+        return records
+
+    def _load(self, sheet_name, values):
+        records = values_to_records(values, sheet_name)
+        if sheet_name in self.append_only:
+            self._append_states[sheet_name] = AppendState(values, records)
+            self.delta_counts["full"] += 1
+        return records
+
+    def fetch_all(self, sheet_names=None):
+        names = tuple(sheet_names or self.sheet_names)
+        spreadsheet = self.spreadsheet()
+        with SHEETS_SECONDS.time(operation="values_batch_get", worksheet="*"):
+            response = sheets_guard.call(lambda: spreadsheet.values_batch_get([sheet_range(name) for name in names]))
+        value_ranges = response.get("valueRanges", [])
+        return {
+            name: self._load(name, value_range.get("values", []))
+            for name, value_range in zip(names, value_ranges)
+        }
+
+    def invalidate(self, sheet_name=None):
+        # 清除增量同步的位置，下次讀取改為完整下載；工作人員修改中間的列後必須呼叫
+        with self._lock:
+            if sheet_name is None:
+                self._append_states.clear()
+            else:
+                self._append_states.pop(sheet_name, None)
+
+    def stats(self):
+        return {
+            **self.delta_counts,
+            "sheets": {
+                name: {"rows": state.rows, "age": round(time.time() - state.full_at, 1)}
+                for name, state in list(self._append_states.items())
+            },
+        }
+
+
+spreadsheet_loader = SpreadsheetLoader(SPREADSHEET_ID)
+
+
+def fetch_sheet_records(spreadsheet_id, sheet_name):
+    if spreadsheet_id == spreadsheet_loader.spreadsheet_id:
+        return spreadsheet_loader.fetch(sheet_name)
+    client = get_gspread_client()
+    with SHEETS_SECONDS.time(operation="open_by_key", worksheet=""):
+        spreadsheet = sheets_guard.call(lambda: client.open_by_key(spreadsheet_id))
+    with SHEETS_SECONDS.time(operation="worksheet", worksheet=sheet_name):
+        sheet = sheets_guard.call(lambda: spreadsheet.worksheet(sheet_name))
+    with SHEETS_SECONDS.time(operation="get_all_records", worksheet=sheet_name):
+        records = sheets_guard.call(sheet.get_all_records)
+    return SheetTable.from_records(records, SHEET_COLUMN_TYPES.get(sheet_name))
+
+
+def fetch_all_sheets(spreadsheet_id):
+    return spreadsheet_loader.fetch_all()
+
+
+class SingleFlight:
+    # 同一個 key 同時只執行一次 fn，其他呼叫者等待並共用同一個結果（或同一個例外）
+    # 執行超過 leader_timeout 秒的 fn 視為卡住：之後的呼叫者不再等它，改由新的呼叫者重新執行
+    class _Call:
+        __slots__ = ("done", "result", "error", "waiters", "started")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+            self.started = time.monotonic()
+
+    def __init__(self, timeout=SHEET_FETCH_TIMEOUT, leader_timeout=None):
+        self.timeout = timeout
+        self.leader_timeout = leader_timeout or timeout
+        self.counts = {"calls": 0, "shared": 0, "errors": 0, "timeouts": 0, "takeovers": 0}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and time.monotonic() - call.started > self.leader_timeout:
+                self.counts["takeovers"] += 1
+                logger.warning(f"{key} 的下載已執行超過 {self.leader_timeout} 秒，改由新的請求重新下載")
+                call = None
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+                self.counts["calls"] += 1
+            else:
+                call.waiters += 1
+                self.counts["shared"] += 1
+        if not leader:
+            if not call.done.wait(timeout or self.timeout):
+                with self._lock:
+                    self.counts["timeouts"] += 1
+                raise TimeoutError(f"等待 {key} 下載逾時")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.counts["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                # 已被新的 leader 取代時不能移除新的 call
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "in_flight": len(self._calls)}
+
+
+class WorksheetCache:
+    # 以 (spreadsheet id, 工作表名稱) 為 key 的記憶體快取：
+    # 過期後先回傳舊資料，同時只啟動一個背景執行緒重新下載（stale-while-revalidate）
+    def __init__(self, fetcher, ttls=None, default_ttl=SHEET_CACHE_DEFAULT_TTL, max_stale=SHEET_CACHE_MAX_STALE,
+                 bulk_fetcher=None):
+        self.fetcher = fetcher
+        # bulk_fetcher(spreadsheet_id) 一次回傳所有工作表 {名稱: records}，冷啟動時用來一次暖好快取
+        self.bulk_fetcher = bulk_fetcher
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.max_stale = max_stale
+        self._entries = {}
+        self._refreshing = set()
+        # 同一個工作表同時只有一個下載，其他請求等待並共用結果
+        self.flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._versions = itertools.count(1)
+        # listener(spreadsheet_id) 在有新資料時被呼叫（例如寫入本地快照檔）
+        self.listeners = []
+
+    def ttl_for(self, sheet_name):
+        return self.ttls.get(sheet_name, self.default_ttl)
+
+    def get(self, spreadsheet_id, sheet_name):
+        key = (spreadsheet_id, sheet_name)
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            ttl = self.ttl_for(sheet_name)
+            if age <= ttl:
+                return entry
+            if age <= ttl + self.max_stale:
+                self._refresh_in_background(key)
+                return entry
+        # 這份試算表完全沒有快取（冷啟動）：一次取回所有工作表
+        if entry is None and self.bulk_fetcher is not None and not self._has_spreadsheet(spreadsheet_id):
+            try:
+                self.warm(spreadsheet_id)
+            except Exception as e:
+                logger.error(f"批次載入試算表失敗，改為單獨讀取 {sheet_name}：{e}", exc_info=True)
+            current = self._entries.get(key)
+            if current is not None:
+                return current
+        # 沒有快取或資料太舊：同步下載，同一個 key 同時只下載一次
+        def load():
+            current = self._entries.get(key)
+            if current is not None and current is not entry:
+                return current
+            return self._fetch(key)
+
+        try:
+            return self.flight.do(key, load)
+        except Exception as e:
+            if entry is None:
+                raise
+            # Google Sheets 異常（熔斷、配額、逾時）時繼續提供最後一次成功下載的資料
+            logger.warning(f"重新下載工作表 {sheet_name} 失敗，改用 {round(time.time() - entry.fetched_at)} 秒前的資料：{e}")
+            return entry
+
+    def warm(self, spreadsheet_id):
+        # 同一時間只跑一次批次載入；其他等待者直接使用載入結果
+        def load():
+            if not self._has_spreadsheet(spreadsheet_id):
+                self.publish_many(spreadsheet_id, self.bulk_fetcher(spreadsheet_id))
+
+        self.flight.do((spreadsheet_id, None), load)
+
+    def publish_many(self, spreadsheet_id, tables, fetched_at=None, notify=True):
+        # 所有工作表共用同一個版本號，一次替換，讀取端不會看到新舊混雜的資料
+        # fetched_at 可以是 {工作表名稱: 下載時間}（從快照檔載入時保留各自原本的下載時間）
+        version = next(self._versions)
+        now = time.time()
+        if not isinstance(fetched_at, dict):
+            fetched_at = dict.fromkeys(tables, fetched_at or now)
+        entries = {
+            (spreadsheet_id, name): SheetSnapshot(records, version, fetched_at.get(name) or now)
+            for name, records in tables.items()
+        }
+        with self._lock:
+            self._entries.update(entries)
+        logger.info(f"已批次載入 {len(entries)} 個工作表（版本 {version}）")
+        if notify:
+            self._notify(spreadsheet_id)
+        return version
+
+    def export(self, spreadsheet_id):
+        # {工作表名稱: (records, fetched_at)}
+        return {
+            key[1]: (entry.records, entry.fetched_at)
+            for key, entry in list(self._entries.items())
+            if key[0] == spreadsheet_id
+        }
+
+    def _notify(self, spreadsheet_id):
+        for listener in self.listeners:
+            try:
+                listener(spreadsheet_id)
+            except Exception as e:
+                logger.error(f"工作表快取 listener 失敗：{e}", exc_info=True)
+
+    def _has_spreadsheet(self, spreadsheet_id):
+        return any(key[0] == spreadsheet_id for key in list(self._entries))
+
+    def invalidate(self, spreadsheet_id=None, sheet_name=None):
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (spreadsheet_id is None or key[0] == spreadsheet_id)
+                and (sheet_name is None or key[1] == sheet_name)
+            ]
+            for key in keys:
+                del self._entries[key]
+        logger.info(f"已清除工作表快取：{[key[1] for key in keys]}")
+        return [key[1] for key in keys]
+
+    def stats(self):
+        now = time.time()
+        return [
+            {
+                "sheet": key[1],
+                "version": entry.version,
+                "rows": len(entry.records),
+                "age": round(now - entry.fetched_at, 1),
+                "ttl": self.ttl_for(key[1]),
+                "refreshing": key in self._refreshing,
+            }
+            for key, entry in list(self._entries.items())
+        ]
+
+    def _fetch(self, key):
+        records = self.fetcher(*key)
+        entry = SheetSnapshot(records, next(self._versions), time.time())
+        with self._lock:
+            self._entries[key] = entry
+        self._notify(key[0])
+        return entry
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.flight.do(key, lambda: self._fetch(key))
+            except Exception as e:
+                logger.error(f"背景更新工作表 {key[1]} 失敗：{e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f"sheet-refresh-{key[1]}", daemon=True).start()
+
+
+sheet_cache = WorksheetCache(fetch_sheet_records, ttls=SHEET_CACHE_TTL, bulk_fetcher=fetch_all_sheets)
+
+
+# 把工作表快取存成本地檔案（JSON，不用 pickle，讀到被竄改的檔案也不會執行任何程式碼），
+# 新的行程啟動時先載入舊資料立即提供服務，再於背景用一次 batchGet 更新，
+# 部署或擴充時不會同時向 Google Sheets 下載所有工作表
+#   SHEETS_SNAPSHOT_PATH      快照檔路徑，設為空字串停用（SHEETS_BACKEND=fake 時預設停用，避免混到正式資料）；
+#                             所在目錄必須屬於目前的使用者且其他人不可寫入，預設放在暫存目錄下的私人子目錄
+#   SHEETS_SNAPSHOT_INTERVAL  快取更新後延遲幾秒寫檔，期間的多次更新只寫一次
+SHEETS_SNAPSHOT_PATH = os.getenv(
+    "SHEETS_SNAPSHOT_PATH",
+    "" if SHEETS_BACKEND == "fake" else os.path.join(tempfile.gettempdir(), f"l16-{os.getuid()}", "sheets.snapshot")
 )
-from datetime import datetime
+SHEETS_SNAPSHOT_INTERVAL = float(os.getenv("SHEETS_SNAPSHOT_INTERVAL", "10"))
+SNAPSHOT_MAGIC = b"L16SNAP3"
+
+
+def check_private(path):
+    # 檔案或目錄必須屬於目前的使用者，且 group / other 不可寫入，避免其他使用者放入偽造的快照
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise PermissionError(f"{path} 不是目前使用者私有的（owner {st.st_uid}，mode {oct(st.st_mode & 0o777)}）")
+
+
+def ensure_private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    check_private(path)
+
+
+def atomic_write(path, write):
+    # 先寫到同目錄的暫存檔再 os.replace，讀取端不會讀到寫到一半的檔案
+    fd, tmp_path = tempfile.mkstemp(prefix=".l16_", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SnapshotFile:
+    def __init__(self, path, cache, spreadsheet_id, interval=SHEETS_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.cache = cache
+        self.spreadsheet_id = spreadsheet_id
+        self.interval = interval
+        self.restored = None
+        self.last_saved = None
+        self._pending = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def save(self):
+        tables = {
+            name: (SheetTable.from_records(records).to_state(), fetched_at)
+            for name, (records, fetched_at) in self.cache.export(self.spreadsheet_id).items()
+        }
+        if not tables:
+            return False
+        started = time.perf_counter()
+        payload = {"spreadsheet_id": self.spreadsheet_id, "saved_at": time.time(), "sheets": tables}
+        data = SNAPSHOT_MAGIC + json_dumps(payload)
+
+        with self._write_lock:
+            ensure_private_dir(os.path.dirname(os.path.abspath(self.path)))
+            atomic_write(self.path, lambda f: f.write(data))
+        self.last_saved = {
+            "saved_at": payload["saved_at"],
+            "sheets": len(tables),
+            "bytes": os.path.getsize(self.path),
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        return True
+
+    def load(self):
+        check_private(os.path.dirname(os.path.abspath(self.path)))
+        check_private(self.path)
+        with open(self.path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError("快照檔格式不符")
+            payload = json_loads(f.read())
+        if payload.get("spreadsheet_id") != self.spreadsheet_id:
+            raise ValueError("快照檔屬於其他試算表")
+        return payload
+
+    def restore(self):
+        # 回傳是否載入成功；保留各工作表原本的下載時間，TTL 與 SHEET_CACHE_MAX_STALE 照常計算，
+        # 呼叫端負責在背景重新驗證
+        if not os.path.exists(self.path):
+            return False
+        started = time.perf_counter()
+        try:
+            payload = self.load()
+            saved_at = float(payload["saved_at"])
+            tables = {}
+            fetched_at = {}
+            for name, (state, saved_fetched_at) in payload["sheets"].items():
+                tables[name] = SheetTable.from_state(state)
+                fetched_at[name] = float(saved_fetched_at)
+        except PermissionError as e:
+            # 不是自己的檔案就不動它，直接改走線上讀取
+            logger.error(f"略過工作表快照檔：{e}")
+            return False
+        except Exception as e:
+            # 截斷、舊版或欄位長度不符的快照檔：刪掉讓下次存檔重寫，改走線上讀取
+            logger.error(f"讀取工作表快照檔失敗，改為線上讀取：{e}", exc_info=True)
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            return False
+        version = self.cache.publish_many(self.spreadsheet_id, tables, fetched_at=fetched_at, notify=False)
+        self.restored = {
+            "version": version,
+            "saved_at": saved_at,
+            "age": round(time.time() - saved_at, 1),
+            "sheets": len(tables),
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        logger.info(f"已從 {self.path} 載入 {len(tables)} 個工作表（{self.restored['ms']} ms）")
+        return True
+
+    def schedule(self, spreadsheet_id):
+        # WorksheetCache listener：延遲 interval 秒後寫檔
+        if spreadsheet_id != self.spreadsheet_id:
+            return
+        with self._lock:
+            if self._pending:
+                return
+            self._pending = True
+        timer = threading.Timer(self.interval, self.flush)
+        timer.daemon = True
+        timer.start()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            self._pending = False
+        try:
+            self.save()
+        except Exception as e:
+            logger.error(f"寫入工作表快照檔失敗：{e}", exc_info=True)
+
+    def stats(self):
+        return {"path": self.path, "restored": self.restored, "last_saved": self.last_saved, "pending": self._pending}
+
+
+snapshot_file = None
+if SHEETS_SNAPSHOT_PATH:
+    snapshot_file = SnapshotFile(SHEETS_SNAPSHOT_PATH, sheet_cache, SPREADSHEET_ID)
+    sheet_cache.listeners.append(snapshot_file.schedule)
+    # 行程結束前把還沒寫入的更新寫進去
+    atexit.register(snapshot_file.flush)
+
+
+def get_sheet_snapshot(sheet_name):
+    return sheet_cache.get(SPREADSHEET_ID, sheet_name)
+
+
+def get_sheet_records(sheet_name):
+    return get_sheet_snapshot(sheet_name).records
+
+
+class SnapshotIndex:
+    # 由工作表快照建立的記憶體索引，快照版本改變時才同步；
+    # 若新快照只是在尾端新增資料列（既有列完全相同），只處理新增的列，否則整個重建
+    sheet_name = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._records = None
+
+    def current(self):
+        snapshot = get_sheet_snapshot(self.sheet_name)
+        if snapshot.version != self._version:
+            with self._lock:
+                if snapshot.version != self._version:
+                    self._sync(snapshot.records)
+                    self._version = snapshot.version
+        return self
+
+    def _sync(self, records):
+        old = self._records
+        if old is not None and records.startswith(old):
+            self.extend(records, len(old))
+        else:
+            self.rebuild(records)
+        self._records = records
+
+    def rebuild(self, records):
+        raise NotImplementedError
+
+    def extend(self, records, start):
+        raise NotImplementedError
+
+
+def normalize_member_id(value):
+    return str(value).strip().upper()
+
+
+def normalize_name(value):
+    return str(value).replace(" ", "").replace("\u3000", "")
+
+
+def normalize_phone(value):
+    # 試算表會把 0912345678 轉成數字 912345678，兩邊都統一成去掉開頭 0 的純數字
+    digits = re.sub(r"\D", "", str(value))
+    return digits[1:] if digits.startswith("0") else digits
+
+
+class MemberIndex(SnapshotIndex):
+    # 會員資料索引：會員編號與（姓名, 電話）都是 O(1) 查詢，正規化只在建立索引時做一次
+    # 新的索引先建在區域變數，完成後一次替換 _state，查詢端不會讀到建到一半的索引
+    sheet_name = "會員資料"
+
+    def rebuild(self, records):
+        self._state = self._add({}, {}, records, 0)
+
+    def extend(self, records, start):
+        by_id, by_name_phone = self._state
+        self._state = self._add(dict(by_id), dict(by_name_phone), records, start)
+
+    @staticmethod
+    def _add(by_id, by_name_phone, records, start):
+        for row in records[start:]:
+            # 有重複資料時以第一筆為準
+            by_id.setdefault(normalize_member_id(row.get("會員編號", "")), row)
+            by_name_phone.setdefault((normalize_name(row.get("姓名", "")), row.phone("電話")), row)
+        return by_id, by_name_phone
+
+    def find_by_id(self, member_id):
+        return self._state[0].get(normalize_member_id(member_id))
+
+    def find_by_name_phone(self, name, phone):
+        return self._state[1].get((normalize_name(name), normalize_phone(phone)))
+
+
+member_index = MemberIndex()
+
+
+FITNESS_PAGE_SIZE = int(os.getenv("FITNESS_PAGE_SIZE", "5"))
+FITNESS_MORE_PREFIX = "更多健身紀錄"
+
+
+def parse_sheet_date(value):
+    # 支援 2025-05-01、2025/5/1、2025-05-01 08:00 等格式，無法解析時回傳 None
+    if isinstance(value, date):
+        return value
+    match = re.match(r"\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})", str(value))
+    if not match:
+        return None
+    try:
+        return date(*map(int, match.groups()))
+    except ValueError:
+        return None
+
+
+class FitnessLogIndex(SnapshotIndex):
+    # 會員健身紀錄依（姓名, 電話）分組，每組依日期排序，查詢時由新到舊分頁取出
+    sheet_name = "會員健身紀錄"
+
+    # 每組只存排序鍵 array('q')：日期序數 << 32 | 資料列位置，查詢時才從 SheetTable 取出該列；
+    # (records, groups) 放在同一個屬性，查詢端不會拿到不一致的組合
+    def rebuild(self, records):
+        groups = {}
+        self._add(groups, records, 0)
+        self._state = (records, groups)
+
+    def extend(self, records, start):
+        # 查詢端可能還拿著舊的 (records, groups)：複製 dict 與有變動的分組，不修改舊的
+        groups = dict(self._state[1])
+        self._add(groups, records, start, copy_on_write=True)
+        self._state = (records, groups)
+
+    @staticmethod
+    def _add(groups, records, start, copy_on_write=False):
+        names = records.column("紀錄姓名", start=start)
+        phones = records.column("紀錄電話", "phone", start)
+        ordinals = records.column("日期", "date", start)
+        copied = set()
+        for position, name, phone, ordinal in zip(itertools.count(start), names, phones, ordinals):
+            sort_key = ordinal << 32 | position
+            key = (normalize_name(name), phone)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = array("q")
+                copied.add(key)
+            elif copy_on_write and key not in copied:
+                group = groups[key] = array("q", group)
+                copied.add(key)
+            if not group or group[-1] <= sort_key:
+                group.append(sort_key)
+            else:
+                bisect.insort(group, sort_key)
+
+    def count(self, name, phone):
+        return len(self._state[1].get((normalize_name(name), normalize_phone(phone)), ()))
+
+    def page(self, name, phone, page=1, page_size=FITNESS_PAGE_SIZE):
+        # 回傳（該頁紀錄, 是否還有下一頁），第 1 頁是最新的紀錄
+        records, groups = self._state
+        group = groups.get((normalize_name(name), normalize_phone(phone)), ())
+        end = len(group) - (page - 1) * page_size
+        if end <= 0:
+            return [], False
+        start = max(0, end - page_size)
+        return [records[sort_key & 0xFFFFFFFF] for sort_key in reversed(group[start:end])], start > 0
+
+
+fitness_log_index = FitnessLogIndex()
+
+
+def build_fitness_reply(name, phone, page=1):
+    records, has_more = fitness_log_index.current().page(name, phone, page)
+    if not records:
+        if page == 1:
+            return models.TextSendMessage(text="❌ 查無此姓名與電話號碼的健身紀錄，請確認輸入是否正確。")
+        return models.TextSendMessage(text="✅ 已經沒有更早的健身紀錄了。")
+
+    lines = ["📋 查詢到以下健身紀錄：" if page == 1 else f"📋 健身紀錄（第 {page} 頁）："]
+    for record in records:
+        lines.append(
+            f"📅 日期：{record.get('日期', '無資料')}\n"
+            f"🏋️ 運動項目：{record.get('運動項目', '無資料')}\n"
+            f"⏱️ 時長：{record.get('時長', '無資料')} 分鐘\n"
+            f"📝 備註：{record.get('備註', '無資料')}\n"
+            f"---"
+        )
+    message = models.TextSendMessage(text="\n".join(lines))
+    if has_more:
+        # 下一頁的查詢條件直接放在按鈕文字中，不需要保存對話狀態
+        more_text = f"{FITNESS_MORE_PREFIX}:{normalize_name(name)}0{normalize_phone(phone)}:{page + 1}"
+        message.quick_reply = models.QuickReply(items=[
+            models.QuickReplyButton(action=models.MessageAction(label="看更早的紀錄", text=more_text))
+        ])
+    return message
+
+
+# 課表以台灣時間計算「今天」與「本週」
+LOCAL_TZ = timezone(timedelta(hours=8))
+COURSE_WEEKDAY_WEEKS = int(os.getenv("COURSE_WEEKDAY_WEEKS", "4"))
+WEEKDAY_NAMES = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+
+
+def local_today():
+    return datetime.now(LOCAL_TZ).date()
+
+
+class CourseScheduleIndex(SnapshotIndex):
+    # 依「開始日期」排序的課表，日期區間與星期查詢都用二分搜尋
+    # keys 與 rows 必須一一對應：建好新的 list 後一次替換 _state，查詢端不會拿到新舊混雜的組合
+    sheet_name = "課程資料"
+
+    def rebuild(self, records):
+        # 整張表重建時收集後一次排序（O(n log n)），不逐列 insert
+        entries = sorted(self._entries(records, 0), key=lambda entry: entry[0])
+        by_weekday = [[] for _ in range(7)]
+        for entry in entries:
+            by_weekday[entry[2]].append(entry)
+        self._state = (
+            [key for key, _, _ in entries],
+            [row for _, row, _ in entries],
+            [[key for key, _, _ in day] for day in by_weekday],
+            [[row for _, row, _ in day] for day in by_weekday],
+        )
+
+    def extend(self, records, start):
+        # 增量新增的列通常不多，複製後逐列插入
+        keys, rows, weekday_keys, weekday_rows = self._state
+        keys, rows = list(keys), list(rows)
+        weekday_keys, weekday_rows = [list(k) for k in weekday_keys], [list(r) for r in weekday_rows]
+        for key, row, weekday in self._entries(records, start):
+            self._insert(keys, rows, key, row)
+            self._insert(weekday_keys[weekday], weekday_rows[weekday], key, row)
+        self._state = keys, rows, weekday_keys, weekday_rows
+
+    @staticmethod
+    def _entries(records, start):
+        # (排序 key, 列, 星期)；key 含列號，同一天的課程維持試算表順序
+        ordinals = records.column("開始日期", "date", start)
+        for position, ordinal in zip(itertools.count(start), ordinals):
+            if ordinal:
+                # date.fromordinal(1) 是星期一
+                yield (ordinal, position), records[position], (ordinal - 1) % 7
+
+    @staticmethod
+    def _insert(keys, rows, key, row):
+        i = bisect.bisect(keys, key)
+        keys.insert(i, key)
+        rows.insert(i, row)
+
+    @staticmethod
+    def _slice(keys, rows, start, end):
+        lo = bisect.bisect_left(keys, (start.toordinal(),))
+        hi = bisect.bisect_left(keys, (end.toordinal() + 1,))
+        return rows[lo:hi]
+
+    def between(self, start, end, weekday=None):
+        # 回傳 start ~ end（含）之間開課的課程，依日期排序；weekday 0 = 星期一
+        keys, rows, weekday_keys, weekday_rows = self._state
+        if weekday is None:
+            return self._slice(keys, rows, start, end)
+        return self._slice(weekday_keys[weekday], weekday_rows[weekday], start, end)
+
+
+course_schedule_index = CourseScheduleIndex()
+
+
+def parse_course_date_query(text, today=None):
+    # 支援：日期2025-05-01、日期2025-05-01~2025-05-07、日期本週、日期下週、日期週三 / 星期三
+    # 回傳（開始日期, 結束日期, 星期, 顯示文字），格式錯誤時回傳 None
+    today = today or local_today()
+    query = re.sub(r"\s+", "", text[len("日期"):] if text.startswith("日期") else text)
+    dates = [parse_sheet_date(token) for token in re.findall(r"\d{4}[-/.]\d{1,2}[-/.]\d{1,2}", query)]
+    if dates and None not in dates:
+        if len(dates) == 1:
+            return dates[0], dates[0], None, dates[0].isoformat()
+        start, end = sorted(dates[:2])
+        return start, end, None, f"{start.isoformat()} ~ {end.isoformat()}"
+    if query in ("本週", "這週", "本周", "這周"):
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=6), None, "本週"
+    if query in ("下週", "下周"):
+        start = today - timedelta(days=today.weekday()) + timedelta(days=7)
+        return start, start + timedelta(days=6), None, "下週"
+    match = re.fullmatch(r"(?:週|周|星期|禮拜)([一二三四五六日天])", query)
+    if match:
+        return today, today + timedelta(weeks=COURSE_WEEKDAY_WEEKS) - timedelta(days=1), WEEKDAY_NAMES[match.group(1)], f"星期{match.group(1)}"
+    return None
+
+
+VENUE_NEGATIVE_TTL = int(os.getenv("VENUE_NEGATIVE_TTL", "600"))
+VENUE_NEGATIVE_MAX_ENTRIES = int(os.getenv("VENUE_NEGATIVE_MAX_ENTRIES", "5000"))
+
+
+def normalize_text(value):
+    # 全形轉半形、英文轉小寫、去掉所有空白，讓「ＴＲＸ 訓練」與「trx訓練」視為相同
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", str(value))).lower()
+
+
+class VenueIndex(SnapshotIndex):
+    # 場地名稱索引：先比對完整名稱，再比對正規化後的名稱
+    sheet_name = "場地資料"
+
+    def __init__(self, negative_cache=None):
+        super().__init__()
+        self.negative_cache = negative_cache
+
+    # 新的索引建好後一次替換 _state，查詢端不會讀到建到一半的索引
+    def rebuild(self, records):
+        self._publish(self._add({}, {}, records, 0))
+
+    def extend(self, records, start):
+        by_name, by_normalized = self._state
+        self._publish(self._add(dict(by_name), dict(by_normalized), records, start))
+
+    @staticmethod
+    def _add(by_name, by_normalized, records, start):
+        for row in records[start:]:
+            name = str(row.get("名稱", ""))
+            if not name:
+                continue
+            by_name.setdefault(name, row)
+            by_normalized.setdefault(normalize_text(name), row)
+        return by_name, by_normalized
+
+    def _publish(self, state):
+        self._state = state
+        # 場地資料有變動，之前查不到的字串可能已經查得到
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+
+    def find(self, text):
+        by_name, by_normalized = self._state
+        row = by_name.get(text)
+        if row is None:
+            row = by_normalized.get(normalize_text(text))
+        return row
+
+
+class NegativeCache:
+    # 記住最近查不到的字串（有 TTL 與數量上限），同樣的閒聊不用再碰試算表
+    def __init__(self, ttl=VENUE_NEGATIVE_TTL, max_entries=VENUE_NEGATIVE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            expires_at = self._items.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.time():
+                del self._items[key]
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._items[key] = time.time() + self.ttl
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+venue_misses = NegativeCache()
+venue_index = VenueIndex(venue_misses)
+
+
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "5"))
+# 分數低於門檻的結果不當作建議，避免「你好」之類的閒聊也跳出一堆建議
+SEARCH_MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", "0.35"))
+
+
+def char_ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class SearchDoc:
+    __slots__ = ("kind", "title", "key", "row", "unigrams", "bigrams")
+
+    def __init__(self, kind, title, key, row):
+        self.kind = kind
+        self.title = title
+        self.key = key
+        self.row = row
+        self.unigrams = len(set(key))
+        self.bigrams = len(char_ngrams(key, 2))
+
+
+class SearchIndex:
+    # 場地 / 器材、教練、課程名稱的模糊搜尋：名稱以單字與雙字（bigram）建立倒排索引，描述只建單字索引；
+    # 查詢時只讀取查詢字串中各個字的 postings，不掃描資料列，打錯一兩個字也找得到
+    sources = (
+        ("場地資料", "venue", "名稱", "描述"),
+        ("教練資料", "coach", "姓名", "專長"),
+        ("課程資料", "course", "課程名稱", "課程類型"),
+    )
+
+    def __init__(self, negative_cache=None):
+        self.negative_cache = negative_cache
+        self._lock = threading.Lock()
+        self._versions = None
+        self._state = None
+
+    def current(self):
+        snapshots = [get_sheet_snapshot(source[0]) for source in self.sources]
+        versions = tuple(snapshot.version for snapshot in snapshots)
+        if versions != self._versions:
+            with self._lock:
+                if versions != self._versions:
+                    self._state = self._build(snapshots)
+                    self._versions = versions
+                    # 資料有變動，之前查不到的字串可能已經查得到
+                    if self.negative_cache is not None:
+                        self.negative_cache.clear()
+        return self
+
+    def _build(self, snapshots):
+        docs = []
+        by_key = {}
+        title_unigrams = {}
+        title_bigrams = {}
+        description_unigrams = {}
+        for snapshot, (_, kind, title_column, description_column) in zip(snapshots, self.sources):
+            for row in snapshot.records:
+                title = str(row.get(title_column, "")).strip()
+                key = normalize_text(title)
+                # 同名的資料（例如同一門課的多個時段）只收第一筆
+                if not key or key in by_key:
+                    continue
+                doc_id = by_key[key] = len(docs)
+                docs.append(SearchDoc(kind, title, key, row))
+                unigrams = set(key)
+                for gram in unigrams:
+                    title_unigrams.setdefault(gram, []).append(doc_id)
+                for gram in char_ngrams(key, 2):
+                    title_bigrams.setdefault(gram, []).append(doc_id)
+                for gram in set(normalize_text(row.get(description_column, ""))) - unigrams:
+                    description_unigrams.setdefault(gram, []).append(doc_id)
+        return docs, by_key, title_unigrams, title_bigrams, description_unigrams
+
+    def find(self, text):
+        docs, by_key = self._state[:2]
+        doc_id = by_key.get(normalize_text(text))
+        return None if doc_id is None else docs[doc_id]
+
+    def search(self, text, k=SEARCH_TOP_K, min_score=SEARCH_MIN_SCORE):
+        # 回傳 [(SearchDoc, 分數)]，分數高的在前
+        docs, _, title_unigrams, title_bigrams, description_unigrams = self._state
+        query = normalize_text(text)
+        if not query:
+            return []
+        query_unigrams = set(query)
+        query_bigrams = char_ngrams(query, 2)
+        unigram_hits = {}
+        bigram_hits = {}
+        description_hits = {}
+        for gram in query_unigrams:
+            for doc_id in title_unigrams.get(gram, ()):
+                unigram_hits[doc_id] = unigram_hits.get(doc_id, 0) + 1
+            for doc_id in description_unigrams.get(gram, ()):
+                description_hits[doc_id] = description_hits.get(doc_id, 0) + 1
+        for gram in query_bigrams:
+            for doc_id in title_bigrams.get(gram, ()):
+                bigram_hits[doc_id] = bigram_hits.get(doc_id, 0) + 1
+
+        scored = []
+        for doc_id in unigram_hits.keys() | description_hits.keys():
+            doc = docs[doc_id]
+            # 名稱的單字 / 雙字 Dice 係數為主，描述有出現的字只加一點分數；名稱包含整個查詢字串再加分
+            unigram_score = 2 * unigram_hits.get(doc_id, 0) / (len(query_unigrams) + doc.unigrams)
+            if query_bigrams:
+                bigram_score = 2 * bigram_hits.get(doc_id, 0) / (len(query_bigrams) + max(doc.bigrams, 1))
+            else:
+                bigram_score = unigram_score
+            score = 0.6 * unigram_score + 0.4 * bigram_score
+            score += 0.2 * description_hits.get(doc_id, 0) / len(query_unigrams)
+            if query in doc.key:
+                score += 0.5
+            if score >= min_score:
+                scored.append((score, -doc_id))
+        return [(docs[-doc_id], round(score, 3)) for score, doc_id in heapq.nlargest(k, scored)]
+
+
+search_index = SearchIndex(venue_misses)
+
+
+# WEBHOOK_ASYNC=1 時 webhook 驗證簽章後立即回應 LINE，事件交給背景 worker 處理
+# （適用常駐的部署方式，serverless 在回應後可能會凍結 process）
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+
+class EventWorkerPool:
+    # 固定數量的 worker，每個 worker 有自己的有界佇列；
+    # 同一位使用者的事件固定交給同一個 worker，多步驟查詢的順序不會亂掉
+    _STOP = object()
+
+    def __init__(self, dispatch, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.dispatch = dispatch
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = False
+        self._counters = {"submitted": 0, "processed": 0, "failed": 0, "rejected": 0, "in_flight": 0}
+        self._max_depth = 0
+        self._wait_seconds = 0.0
+
+    def start(self):
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._accepting = True
+        return self
+
+    def submit(self, event):
+        # 佇列已滿或已停止接收時回傳 False，由呼叫端改為同步處理
+        source_id = getattr(getattr(event, "source", None), "user_id", None) or ""
+        q = self._queues[zlib.crc32(source_id.encode("utf-8")) % len(self._queues)]
+        # 與 shutdown 共用同一個鎖：停止接收之後不會再有事件排在 _STOP 後面被丟掉
+        with self._lock:
+            if not self._accepting:
+                return False
+            try:
+                q.put_nowait((time.monotonic(), event))
+            except queue.Full:
+                self._counters["rejected"] += 1
+                return False
+            self._counters["submitted"] += 1
+            depth = q.qsize()
+            if depth > self._max_depth:
+                self._max_depth = depth
+        return True
+
+    def stats(self):
+        with self._lock:
+            processed = self._counters["processed"] + self._counters["failed"]
+            return dict(
+                self._counters,
+                workers=len(self._queues),
+                queue_depth=[q.qsize() for q in self._queues],
+                queue_capacity=self._queues[0].maxsize if self._queues else 0,
+                max_queue_depth=self._max_depth,
+                avg_wait_ms=round(self._wait_seconds * 1000 / processed, 2) if processed else 0.0,
+                accepting=self._accepting,
+            )
+
+    def shutdown(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        # 停止接收新事件，等待佇列中的事件處理完（最多 timeout 秒）
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+        deadline = time.monotonic() + timeout
+        for q in self._queues:
+            try:
+                q.put(self._STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                # 佇列一直是滿的：不再等待，worker 是 daemon thread，隨行程結束
+                pass
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        pending = sum(q.qsize() for q in self._queues)
+        if pending:
+            logger.warning(f"webhook worker 關閉時仍有 {pending} 個事件未處理")
+        else:
+            logger.info("webhook worker 已處理完所有事件")
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self._counters[name] += delta
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is self._STOP:
+                break
+            queued_at, event = item
+            with self._lock:
+                self._wait_seconds += time.monotonic() - queued_at
+                self._counters["in_flight"] += 1
+            try:
+                self.dispatch(event)
+                self._count("processed")
+            except Exception as e:
+                self._count("failed")
+                logger.error(f"webhook 事件處理失敗：{e}", exc_info=True)
+            finally:
+                self._count("in_flight", -1)
+
+
+def verify_signature(body, signature):
+    # 直接對原始 bytes 計算 HMAC-SHA256，以固定時間比較，避免 timing attack
+    # 沒有設定 channel secret 時一律驗證失敗，不能用空字串當 HMAC key
+    secret = get_channel_secret()
+    if not signature or not secret:
+        return False
+    digest = hmac.new(secret, body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode("utf-8"))
+
+
+class EventSource:
+    __slots__ = ("type", "user_id", "group_id", "room_id")
+
+    def __init__(self, data):
+        self.type = data.get("type")
+        self.user_id = data.get("userId")
+        self.group_id = data.get("groupId")
+        self.room_id = data.get("roomId")
+
+
+class TextContent:
+    __slots__ = ("id", "text")
+
+    def __init__(self, data):
+        self.id = data.get("id")
+        self.text = data.get("text", "")
+
+
+class TextMessageEvent:
+    # 文字訊息事件只保留處理時用到的欄位，不經過 line-bot-sdk 的 model 轉換；其他類型的事件直接略過
+    __slots__ = ("reply_token", "timestamp", "source", "message", "webhook_event_id", "profile")
+
+    def __init__(self, data):
+        self.reply_token = data.get("replyToken")
+        self.timestamp = data.get("timestamp")
+        self.source = EventSource(data.get("source") or {})
+        self.message = TextContent(data["message"])
+        self.webhook_event_id = data.get("webhookEventId")
+        self.profile = False
+
+
+def parse_webhook_events(body):
+    # 回傳（文字訊息事件, 事件總數）
+    events = json_loads(body).get("events") or []
+    text_events = [
+        TextMessageEvent(event) for event in events
+        if event.get("type") == "message" and (event.get("message") or {}).get("type") == "text"
+    ]
+    return text_events, len(events)
+
+
+# webhook / 訊息日誌只抽樣記錄摘要（一行 JSON），不記錄整個 request body；設為 1 記錄全部
+WEBHOOK_LOG_SAMPLE = float(os.getenv("WEBHOOK_LOG_SAMPLE", "0.1"))
+
+
+def log_sampled(event, **fields):
+    if WEBHOOK_LOG_SAMPLE >= 1 or (WEBHOOK_LOG_SAMPLE > 0 and random.random() < WEBHOOK_LOG_SAMPLE):
+        logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, separators=(",", ":")))
+
+
+# 取樣式 profiler：找出某個指令慢在哪裡（憑證、下載工作表、篩選資料列、組 Flex…）
+#   PROFILE_SAMPLE=0.01        1% 的訊息開啟 profiling（預設 0：關閉，每則訊息只多一次比較）
+#   X-Profile: 1               搭配 X-Admin-Token 送到 /webhook，強制 profile 這個 request 的事件
+#   PROFILE_INTERVAL_MS        取樣間隔
+# 背景執行緒每隔一段時間讀取正在處理這些訊息的執行緒的 stack，依路由指令彙總成 collapsed stack，
+# GET /admin/profile?format=collapsed 的輸出可直接交給 flamegraph.pl / speedscope
+PROFILE_SAMPLE = float(os.getenv("PROFILE_SAMPLE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "64"))
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "5000"))
+
+
+def collapse_stack(frame, max_depth=PROFILE_MAX_DEPTH):
+    names = []
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    def __init__(self, rate=PROFILE_SAMPLE, interval=PROFILE_INTERVAL_MS / 1000):
+        self.rate = rate
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._active = {}
+        self._thread = None
+        self._commands = {}
+
+    def sampled(self):
+        return self.rate > 0 and random.random() < self.rate
+
+    def begin(self):
+        # 回傳這次 profiling 的 stack 計數，處理完後交給 end()
+        samples = {}
+        with self._cond:
+            self._active[threading.get_ident()] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return samples, time.perf_counter()
+
+    def end(self, session, command):
+        samples, started = session
+        with self._cond:
+            self._active.pop(threading.get_ident(), None)
+            entry = self._commands.setdefault(command, {"requests": 0, "seconds": 0.0, "samples": 0, "dropped": 0, "stacks": {}})
+            entry["requests"] += 1
+            entry["seconds"] += time.perf_counter() - started
+            stacks = entry["stacks"]
+            for stack, count in samples.items():
+                entry["samples"] += count
+                if stack in stacks or len(stacks) < PROFILE_MAX_STACKS:
+                    stacks[stack] = stacks.get(stack, 0) + count
+                else:
+                    entry["dropped"] += count
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            for thread_id, samples in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = collapse_stack(frame)
+                    samples[stack] = samples.get(stack, 0) + 1
+            del frames
+            time.sleep(self.interval)
+
+    def collapsed(self, command=None):
+        # 每行「指令;stack 次數」，指令名稱當作最外層的 frame
+        with self._cond:
+            lines = [
+                f"{name};{stack} {count}"
+                for name, entry in self._commands.items() if command in (None, name)
+                for stack, count in entry["stacks"].items()
+            ]
+        return "\n".join(sorted(lines)) + "\n"
+
+    def summary(self, top=10):
+        # 每個指令最常出現在 stack 最上層（self time）的函式
+        with self._cond:
+            commands = {name: dict(entry, stacks=dict(entry["stacks"])) for name, entry in self._commands.items()}
+        result = {}
+        for name, entry in commands.items():
+            leaves = {}
+            for stack, count in entry["stacks"].items():
+                leaf = stack.rsplit(";", 1)[-1]
+                leaves[leaf] = leaves.get(leaf, 0) + count
+            total = entry["samples"] or 1
+            result[name] = {
+                "requests": entry["requests"],
+                "avg_ms": round(entry["seconds"] * 1000 / entry["requests"], 2),
+                "samples": entry["samples"],
+                "dropped": entry["dropped"],
+                "top_self": [
+                    {"frame": leaf, "pct": round(count * 100 / total, 1)}
+                    for leaf, count in heapq.nlargest(top, leaves.items(), key=lambda item: item[1])
+                ],
+            }
+        return {"rate": self.rate, "interval_ms": self.interval * 1000, "commands": result}
+
+    def reset(self):
+        with self._cond:
+            self._commands = {}
+
+
+profiler = SamplingProfiler()
+
+
+@app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+def profile_report():
+    # GET ?format=collapsed[&command=show_member_menu] 下載 collapsed stack；預設回傳各指令摘要
+    # POST ?sample=0.05 調整取樣比例（0 關閉）；DELETE 清除已收集的資料
+    if not is_admin_request():
+        abort(403)
+    if request.method == "POST":
+        try:
+            rate = float(request.args.get("sample", profiler.rate))
+        except ValueError:
+            return {"error": "sample 必須是 0 到 1 之間的數字"}, 400
+        if not 0 <= rate <= 1:
+            return {"error": "sample 必須是 0 到 1 之間的數字"}, 400
+        profiler.rate = rate
+    elif request.method == "DELETE":
+        profiler.reset()
+    if request.args.get("format") == "collapsed":
+        return Response(profiler.collapsed(request.args.get("command")), mimetype="text/plain")
+    return profiler.summary()
+
+
+def dispatch_event(event):
+    if isinstance(event, TextMessageEvent):
+        handle_message(event)
+
+
+webhook_pool = None
+metrics.gauge("linebot_webhook_queue_depth", "webhook 佇列中等待處理的事件數",
+              lambda: sum(webhook_pool.stats()["queue_depth"]) if webhook_pool else 0)
+if WEBHOOK_ASYNC:
+    webhook_pool = EventWorkerPool(dispatch_event).start()
+    atexit.register(webhook_pool.shutdown)
+
+
+# 對話狀態（等待輸入會員資料等）的儲存位置：
+#   memory://                 單一 process 內的 LRU（預設）
+#   sqlite:////tmp/states.db  同一台機器上多個 process 共用
+#   redis://host:6379/0       多台機器共用（任何相容 Redis 協定的服務皆可）
+STATE_STORE_URL = os.getenv("STATE_STORE_URL", "memory://")
+STATE_TTL_SECONDS = int(os.getenv("STATE_TTL_SECONDS", "600"))
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))
+
+
+class StateStore:
+    # 所有後端共用的介面；過期的狀態視為不存在
+    def __init__(self, default_ttl=STATE_TTL_SECONDS):
+        self.default_ttl = default_ttl
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def pop(self, key, default=None):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        # key 不存在（或已過期）時才寫入，回傳是否寫入成功
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        # {key: value}，只包含存在的 key；各後端可改成一次查詢
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, default_ttl=STATE_TTL_SECONDS, max_entries=STATE_MAX_ENTRIES):
+        super().__init__(default_ttl)
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.default_ttl)
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+        if item is None or item[1] <= time.time():
+            return default
+        return item[0]
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > time.time():
+                return False
+        self.set(key, value, ttl)
+        return True
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SqliteStateStore(StateStore):
+    def __init__(self, path, default_ttl=STATE_TTL_SECONDS):
+        super().__init__(default_ttl)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS states (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            "SELECT value FROM states WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO states (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now + (ttl or self.default_ttl))
+        )
+        # 順便清掉過期的狀態，資料表不會無限成長
+        conn.execute("DELETE FROM states WHERE expires_at <= ?", (now,))
+
+    def pop(self, key, default=None):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT value, expires_at FROM states WHERE key = ?", (key,)
+            ).fetchone()
+            conn.execute("DELETE FROM states WHERE key = ?", (key,))
+        if row is None or row[1] <= time.time():
+            return default
+        return json.loads(row[0])
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM states WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO states (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + (ttl or self.default_ttl))
+            )
+        return cursor.rowcount == 1
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = {}
+        conn = self._connection()
+        now = time.time()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = conn.execute(
+                "SELECT key, value FROM states WHERE key IN (%s) AND expires_at > ?" % ",".join("?" * len(chunk)),
+                (*chunk, now)
+            ).fetchall()
+            values.update((key, json.loads(value)) for key, value in rows)
+        return values
+
+
+class RedisStateStore(StateStore):
+    # 只用到 GET / SET / DEL / MGET / MULTI，直接以 RESP 協定溝通，不需要額外套件
+    def __init__(self, host="localhost", port=6379, db=0, password=None,
+                 default_ttl=STATE_TTL_SECONDS, prefix="l16:state:", timeout=2.0):
+        super().__init__(default_ttl)
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._call("AUTH", self.password)
+            if self.db:
+                self._call("SELECT", str(self.db))
+        return conn
+
+    def _call(self, *args):
+        return self._pipeline([args])[0]
+
+    def _pipeline(self, commands):
+        # 多個指令一次送出，依序回傳每個指令的結果
+        try:
+            return self._send(commands)
+        except (OSError, ConnectionError):
+            # 連線中斷時重新連線再試一次
+            self._local.conn = None
+            return self._send(commands)
+
+    def _send(self, commands):
+        sock, reader = self._connection()
+        parts = []
+        for args in commands:
+            parts.append(f"*{len(args)}\r\n".encode())
+            for arg in args:
+                data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+                parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        sock.sendall(b"".join(parts))
+        # 某個指令回傳錯誤時仍讀完其餘的回應，連線才能繼續使用
+        replies, error = [], None
+        for _ in commands:
+            try:
+                replies.append(self._read(reader))
+            except RuntimeError as e:
+                replies.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
 
-import os
-import json
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import tempfile
-import sys
-import logging
-import re
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis 連線已關閉")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis 錯誤：{payload.decode()}")
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            size = int(payload)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            return [self._read(reader) for _ in range(int(payload))]
+        raise RuntimeError(f"無法解析的 Redis 回應：{line!r}")
 
-app = Flask(__name__)
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-logger = logging.getLogger(__name__)
+    def get(self, key, default=None):
+        data = self._call("GET", self.prefix + key)
+        return json.loads(data) if data is not None else default
+
+    def set(self, key, value, ttl=None):
+        self._call("SET", self.prefix + key, json.dumps(value, ensure_ascii=False), "EX", int(ttl or self.default_ttl))
+
+    def pop(self, key, default=None):
+        # GET + DEL 包在 MULTI / EXEC 中一次執行，兩個 instance 不會同時取得同一個狀態
+        # （GETDEL 要 Redis 6.2 以上，MULTI / EXEC 在舊版與相容服務上也能用）
+        data, _ = self._pipeline([("MULTI",), ("GET", self.prefix + key), ("DEL", self.prefix + key), ("EXEC",)])[-1]
+        return json.loads(data) if data is not None else default
+
+    def add(self, key, value, ttl=None):
+        return self._call(
+            "SET", self.prefix + key, json.dumps(value, ensure_ascii=False), "EX", int(ttl or self.default_ttl), "NX"
+        ) is not None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            for key, data in zip(chunk, self._call("MGET", *[self.prefix + key for key in chunk])):
+                if data is not None:
+                    values[key] = json.loads(data)
+        return values
+
+
+def create_state_store(url=STATE_STORE_URL):
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "memory"):
+        return MemoryStateStore()
+    if parsed.scheme == "sqlite":
+        return SqliteStateStore(unquote(parsed.path) or "/tmp/l16_states.db")
+    if parsed.scheme == "redis":
+        return RedisStateStore(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(parsed.path.strip("/") or 0),
+            password=unquote(parsed.password) if parsed.password else None,
+        )
+    raise ValueError(f"不支援的 STATE_STORE_URL：{url}")
+
+
+user_states = create_state_store()
+
+# 會員編號 ↔ LINE userId：會員輸入「訂閱會員提醒」並以姓名 + 電話確認身分後才綁定，提醒通知用來找到會員的 LINE 帳號
+# 綁定必須跨 process / 重新部署保存，只接受 sqlite:// 或 redis://；未設定時不提供訂閱功能
+MEMBER_BINDING_STORE_URL = os.getenv("MEMBER_BINDING_STORE_URL", "")
+MEMBER_BINDING_TTL = int(os.getenv("MEMBER_BINDING_TTL", str(365 * 86400)))
+
+
+def create_persistent_store(url, name):
+    if not url:
+        return None
+    if urlparse(url).scheme in ("", "memory"):
+        logger.error(f"{name} 不能使用 memory://（每個 process 各自一份，重新啟動就消失），已停用")
+        return None
+    return create_state_store(url)
+
+
+member_bindings = create_persistent_store(MEMBER_BINDING_STORE_URL, "MEMBER_BINDING_STORE_URL")
+
+
+def member_binding_key(member_id):
+    return f"member:{normalize_member_id(member_id)}"
+
+
+def line_binding_key(user_id):
+    return f"line:{user_id}"
+
+
+def bind_member(member_id, user_id):
+    # 回傳 "bound"（新綁定）、"already"（已綁定同一個帳號）或 "taken"（已綁定其他帳號，不覆寫）
+    member_id = normalize_member_id(member_id)
+    key = member_binding_key(member_id)
+    if member_bindings.add(key, user_id, ttl=MEMBER_BINDING_TTL):
+        result = "bound"
+    elif member_bindings.get(key) == user_id:
+        # 重新訂閱時延長期限
+        member_bindings.set(key, user_id, ttl=MEMBER_BINDING_TTL)
+        result = "already"
+    else:
+        return "taken"
+    # 反向對應：一個 LINE 帳號可以訂閱多位會員（例如家人），取消時一次解除
+    member_ids = member_bindings.get(line_binding_key(user_id)) or []
+    if member_id not in member_ids:
+        member_ids.append(member_id)
+    member_bindings.set(line_binding_key(user_id), member_ids, ttl=MEMBER_BINDING_TTL)
+    return result
+
+
+def unbind_member(user_id):
+    # 只解除這個 LINE 帳號自己的綁定；回傳原本綁定的會員編號
+    member_ids = member_bindings.pop(line_binding_key(user_id)) or []
+    for member_id in member_ids:
+        if member_bindings.get(member_binding_key(member_id)) == user_id:
+            member_bindings.pop(member_binding_key(member_id))
+    return member_ids
+
+
+BOOKING_FORM_URL = "https://docs.google.com/forms/d/e/1FAIpQLSct_FZcn9et_grMYECeT8xLwxaJg-AFMIUDszNusa2AG2gHMg/viewform"
+MESSAGE_CACHE_MAX_ENTRIES = int(os.getenv("MESSAGE_CACHE_MAX_ENTRIES", "512"))
+
+
+class EncodedMessage:
+    # 已序列化成 JSON 的訊息，回覆時直接組進 request body，不用每次重建物件再 dumps
+    __slots__ = ("message", "payload")
+
+    def __init__(self, message):
+        self.message = message
+        self.payload = json.dumps(message.as_json_dict(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_payload(cls, payload):
+        # 從 StateStore 取回的 JSON 字串：不重建 SDK 物件，只包一層提供 as_json_dict()
+        encoded = cls.__new__(cls)
+        encoded.message = RawMessage(json_loads(payload))
+        encoded.payload = payload.encode("utf-8")
+        return encoded
+
+
+class RawMessage:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def as_json_dict(self):
+        return self.data
+
+
+def encode_message(message):
+    if message is None or isinstance(message, EncodedMessage):
+        return message
+    if isinstance(message, (list, tuple)):
+        return [encode_message(m) for m in message]
+    return EncodedMessage(message)
+
+
+class MessageTemplates:
+    # 靜態選單：第一次使用時建立並序列化一次（或啟動時 preload）
+    # 試算表產生的輪播：以（名稱, 參數）為 key，快照版本不變就重複使用
+    def __init__(self, max_entries=MESSAGE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._builders = {}
+        self._static = {}
+        self._dynamic = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, name):
+        def decorator(builder):
+            self._builders[name] = builder
+            return builder
+        return decorator
+
+    def get(self, name):
+        encoded = self._static.get(name)
+        if encoded is None:
+            with PAYLOAD_SECONDS.time(template=name):
+                encoded = self._static[name] = encode_message(self._builders[name]())
+        return encoded
+
+    def preload(self):
+        for name in self._builders:
+            self.get(name)
+
+    def memoize(self, name, key, snapshot, builder):
+        # builder(records, key) 回傳訊息、訊息 list 或 None
+        cache_key = (name, key)
+        with self._lock:
+            cached = self._dynamic.get(cache_key)
+            if cached is not None and cached[0] == snapshot.version:
+                self._dynamic.move_to_end(cache_key)
+                return cached[1]
+        with PAYLOAD_SECONDS.time(template=name):
+            encoded = encode_message(builder(snapshot.records, key))
+        with self._lock:
+            self._dynamic[cache_key] = (snapshot.version, encoded)
+            self._dynamic.move_to_end(cache_key)
+            while len(self._dynamic) > self.max_entries:
+                self._dynamic.popitem(last=False)
+        return encoded
+
+    def stats(self):
+        return {"static": sorted(self._static), "dynamic": len(self._dynamic)}
+
+
+message_templates = MessageTemplates()
+
+
+def _post_messages(path, field, target, messages, fallback):
+    messages = encode_message(list(messages))
+    line_bot_api = get_line_bot_api()
+    post = getattr(line_bot_api, "_post", None)
+    if post is None:
+        getattr(line_bot_api, fallback)(target, [m.message for m in messages])
+        return
+    body = b'{"%s":%s,"messages":[%s]}' % (
+        field,
+        json.dumps(target).encode("utf-8"),
+        b",".join(m.payload for m in messages),
+    )
+    post(path, data=body)
+
+
+def send_reply(reply_token, messages):
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    with REPLY_SECONDS.time():
+        _post_messages("/v2/bot/message/reply", b"replyToken", reply_token, messages, "reply_message")
+
+
+def send_push(to, messages):
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    with PUSH_SECONDS.time():
+        _post_messages("/v2/bot/message/push", b"to", to, messages, "push_message")
+
+
+def send_multicast(user_ids, messages):
+    # 同樣的訊息一次送給最多 500 位使用者
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    with MULTICAST_SECONDS.time():
+        _post_messages("/v2/bot/message/multicast", b"to", list(user_ids), messages, "multicast")
+
+
+# 一次 reply 最多 5 則訊息，reply token 只能用一次；超過的部分：
+#   REPLY_OVERFLOW=push  用 push API 每 5 則補送一次（預設）
+#   REPLY_OVERFLOW=more  第 5 則換成「顯示更多」，剩下的（已序列化的 JSON）暫存在 STATE_STORE_URL 設定的儲存區，
+#                        使用者點了再回覆下一頁；多台機器 / serverless 時要搭配 sqlite:// 或 redis://，
+#                        否則「顯示更多」可能由沒有暫存資料的 instance 處理
+LINE_MAX_MESSAGES = 5
+REPLY_OVERFLOW = os.getenv("REPLY_OVERFLOW", "push")
+REPLY_MORE_TEXT = "顯示更多"
+REPLY_PENDING_TTL_SECONDS = int(os.getenv("REPLY_PENDING_TTL_SECONDS", "600"))
+pending_replies = user_states
+
+
+def pending_reply_key(chat_id):
+    # 與對話狀態共用儲存區，加上前綴避免與以 userId 為 key 的狀態衝突
+    return f"more:{chat_id}"
+
+
+def event_chat_id(event):
+    # 訊息來源的聊天室：群組 / 多人聊天室的 id，一對一聊天時為 userId；push 與「顯示更多」都以此為對象
+    source = event.source
+    return getattr(source, "group_id", None) or getattr(source, "room_id", None) or source.user_id
+
+
+def build_more_prompt(remaining):
+    return models.TextSendMessage(
+        text=f"還有 {remaining} 則訊息，點「{REPLY_MORE_TEXT}」繼續查看",
+        quick_reply=models.QuickReply(items=[
+            models.QuickReplyButton(action=models.MessageAction(label=REPLY_MORE_TEXT, text=REPLY_MORE_TEXT))
+        ])
+    )
+
+
+class ReplyComposer:
+    # 收集一個事件要送出的所有訊息，處理完才一起送出，每個事件只呼叫一次 reply API
+    __slots__ = ("reply_token", "chat_id", "messages")
+
+    def __init__(self, reply_token, chat_id):
+        self.reply_token = reply_token
+        self.chat_id = chat_id
+        self.messages = []
+
+    def add(self, messages):
+        if isinstance(messages, (list, tuple)):
+            self.messages.extend(messages)
+        else:
+            self.messages.append(messages)
+
+    def flush(self):
+        # 回傳呼叫 LINE API 的次數
+        messages, self.messages = self.messages, []
+        if not messages:
+            return 0
+        if len(messages) <= LINE_MAX_MESSAGES:
+            send_reply(self.reply_token, messages)
+            return 1
+        if not self.chat_id:
+            # 拿不到聊天室 id 就無法 push 或暫存，只能送前 5 則
+            logger.warning(f"回覆共 {len(messages)} 則，超過上限的 {len(messages) - LINE_MAX_MESSAGES} 則未送出")
+            send_reply(self.reply_token, messages[:LINE_MAX_MESSAGES])
+            return 1
+        if REPLY_OVERFLOW == "more":
+            head, rest = messages[:LINE_MAX_MESSAGES - 1], messages[LINE_MAX_MESSAGES - 1:]
+            pending_replies.set(
+                pending_reply_key(self.chat_id),
+                [m.payload.decode("utf-8") for m in encode_message(rest)],
+                ttl=REPLY_PENDING_TTL_SECONDS,
+            )
+            send_reply(self.reply_token, head + [build_more_prompt(len(rest))])
+            return 1
+        send_reply(self.reply_token, messages[:LINE_MAX_MESSAGES])
+        calls = 1
+        for i in range(LINE_MAX_MESSAGES, len(messages), LINE_MAX_MESSAGES):
+            send_push(self.chat_id, messages[i:i + LINE_MAX_MESSAGES])
+            calls += 1
+        return calls
+
+
+class CommandContext:
+    # 一則文字訊息的處理資訊；match 為 prefix / regex 路由的比對結果
+    __slots__ = ("event", "user_id", "text", "state", "match", "route", "outbox")
+
+    def __init__(self, event, user_id, text, state=None):
+        self.event = event
+        self.user_id = user_id
+        self.text = text
+        self.state = state
+        self.match = None
+        self.route = None
+        self.outbox = ReplyComposer(event.reply_token, event_chat_id(event))
+
+    def reply(self, messages):
+        # 先放進 outbox，handler 結束後由 handle_message 一次送出
+        self.outbox.add(messages)
+
+
+class Route:
+    __slots__ = ("name", "kind", "patterns", "handler", "regex")
+
+    def __init__(self, name, kind, patterns, handler, regex=None):
+        self.name = name
+        self.kind = kind
+        self.patterns = patterns
+        self.handler = handler
+        self.regex = regex
+
+
+ROUTE_NAMED_GROUP = re.compile(r"\(\?P<\w+>")
+ROUTE_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class CommandRouter:
+    # 宣告式指令路由，比對順序：對話狀態 → 完全相符（dict）→ 前綴 / 正規表示式（合併成一個 regex）→ fallback
+    def __init__(self):
+        self._routes = []
+        self._by_state = {}
+        self._exact = {}
+        self._patterns = []
+        self._fallback = None
+        self._combined = None
+
+    def state(self, state_name):
+        def decorator(handler):
+            route = Route(handler.__name__, "state", (state_name,), handler)
+            self._by_state[state_name] = route
+            return self._add(route)
+        return decorator
+
+    def command(self, *texts):
+        # 單一指令或一組關鍵字（例如常見問題的分類）共用同一個 handler
+        def decorator(handler):
+            keywords = frozenset(texts)
+            route = Route(handler.__name__, "exact" if len(keywords) == 1 else "keywords", keywords, handler)
+            for text in keywords:
+                if text in self._exact:
+                    raise ValueError(f"指令「{text}」重複註冊：{self._exact[text].name} / {route.name}")
+                self._exact[text] = route
+            return self._add(route)
+        return decorator
+
+    def prefix(self, text):
+        return self._pattern("prefix", text, re.escape(text))
+
+    def regex(self, pattern):
+        return self._pattern("regex", pattern, pattern)
+
+    def fallback(self, handler):
+        self._fallback = Route(handler.__name__, "fallback", (), handler)
+        return self._add(self._fallback)
+
+    def _pattern(self, kind, source, pattern):
+        def decorator(handler):
+            route = Route(handler.__name__, kind, (source,), handler, re.compile(pattern))
+            self._patterns.append(route)
+            self._combined = None
+            return self._add(route)
+        return decorator
+
+    def _add(self, route):
+        self._routes.append(route)
+        return route.handler
+
+    def _compile(self):
+        # 所有前綴 / regex 合併成一個 alternation，一次比對就知道是哪一條路由；
+        # 各路由的具名群組在合併時改成不擷取的群組，避免重複命名（handler 拿到的仍是該路由自己 regex 的比對結果）。
+        # 有 backreference（合併後群組編號會改變）或無法合併時，改為逐條比對（False）
+        self._combined = False
+        patterns = [route.regex.pattern for route in self._patterns]
+        if patterns and not any(ROUTE_BACKREFERENCE.search(pattern) for pattern in patterns):
+            combined = "|".join(f"(?P<r{i}>{ROUTE_NAMED_GROUP.sub('(?:', pattern)})" for i, pattern in enumerate(patterns))
+            try:
+                self._combined = re.compile(combined)
+            except re.error as e:
+                logger.warning(f"路由 regex 無法合併，改為逐條比對：{e}")
+        return self._combined
+
+    def resolve(self, text, state=None):
+        # 回傳（路由, regex 比對結果），不會執行 handler，可用於測量 dispatch 成本
+        if state is not None:
+            route = self._by_state.get(state)
+            if route is not None:
+                return route, None
+        route = self._exact.get(text)
+        if route is not None:
+            return route, None
+        combined = self._combined
+        if combined is None:
+            combined = self._compile()
+        if combined is not False:
+            found = combined.match(text)
+            if found is not None:
+                route = self._patterns[int(found.lastgroup[1:])]
+                return route, route.regex.match(text)
+        else:
+            for route in self._patterns:
+                found = route.regex.match(text)
+                if found is not None:
+                    return route, found
+        return self._fallback, None
+
+    def dispatch(self, ctx):
+        route, ctx.match = self.resolve(ctx.text, ctx.state)
+        if route is None:
+            return None
+        ctx.route = route.name
+        return route.handler(ctx)
+
+    def routes(self):
+        return [
+            {"name": route.name, "kind": route.kind, "patterns": sorted(route.patterns)}
+            for route in self._routes
+        ]
+
+    def benchmark(self, texts, iterations=1000):
+        # 每則訊息平均 dispatch 時間（微秒），只計算路由比對
+        results = {}
+        for text in texts:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                self.resolve(text)
+            route, _ = self.resolve(text)
+            results[text] = {
+                "route": route.name if route else None,
+                "us": round((time.perf_counter() - started) * 1e6 / iterations, 3),
+            }
+        return results
+
+
+router = CommandRouter()
+
+
+def is_admin_request():
+    return bool(ADMIN_TOKEN) and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
 
-line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
-line_handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))
-user_states = {}
 
-def get_gspread_client():
-    credentials_content = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_CONTENT")
-    if not credentials_content:
-        logger.error("缺少 GOOGLE_APPLICATION_CREDENTIALS_CONTENT 環境變數")
-        raise ValueError("環境變數未設定")
-    try:
-        with tempfile.NamedTemporaryFile(mode="w+", delete=True, suffix=".json") as temp_file:
-            temp_file.write(credentials_content)
-            temp_file.flush()
-            scope = [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive"
-            ]
-            creds = ServiceAccountCredentials.from_json_keyfile_name(temp_file.name, scope)
-            client = gspread.authorize(creds)
-            return client
-    except Exception as e:
-        logger.error(f"Google Sheets 授權錯誤：{e}", exc_info=True)
-        sys.exit(1)
 @app.route("/")
 def home():
     return "LINE Bot 正常運作中！"
 
 @app.route("/webhook", methods=["POST"])
 def callback():
-    signature = request.headers["X-Line-Signature"]
-    body = request.get_data(as_text=True)
-    app.logger.info("Request body: " + body)
-    try:
-        line_handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
-    return "OK"
+    with WEBHOOK_SECONDS.time():
+        if not get_channel_secret():
+            logger.error("未設定 LINE_CHANNEL_SECRET，無法驗證 webhook 簽章，拒絕處理")
+            abort(500)
+        signature = request.headers.get("X-Line-Signature", "")
+        body = request.get_data()
+        with SIGNATURE_SECONDS.time():
+            if not verify_signature(body, signature):
+                logger.warning(f"webhook 簽章驗證失敗（{len(body)} bytes）")
+                abort(400)
+            try:
+                events, total = parse_webhook_events(body)
+            except (ValueError, TypeError, AttributeError, KeyError) as e:
+                logger.warning(f"webhook body 格式錯誤：{e}")
+                abort(400)
+        if request.headers.get("X-Profile") == "1" and is_admin_request():
+            for event in events:
+                event.profile = True
+        for event in events:
+            if webhook_pool is None or not webhook_pool.submit(event):
+                # 同步模式，或佇列已滿：在目前的 request 中處理，避免事件遺失
+                dispatch_event(event)
+        log_sampled("webhook", bytes=len(body), events=total, text_events=len(events))
+        return "OK"
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/webhook", methods=["GET"])
+def webhook_stats():
+    if not is_admin_request():
+        abort(403)
+    return {"async": webhook_pool is not None, "pool": webhook_pool.stats() if webhook_pool else None}
+
+@app.route("/admin/fake-line/replies", methods=["GET", "DELETE"])
+def fake_line_replies():
+    # LINE_BACKEND=fake 時查看（GET）或清空（DELETE）記錄下來的回覆
+    line_bot_api = get_line_bot_api()
+    if not is_admin_request() or not isinstance(line_bot_api, FakeLineBotApi):
+        abort(403)
+    if request.method == "DELETE":
+        line_bot_api.records.clear()
+        return {"cleared": True}
+    limit = int(request.args.get("limit", "50"))
+    return {"calls": line_bot_api.calls, "records": list(line_bot_api.records)[-limit:]}
+
+@app.route("/admin/cache/invalidate", methods=["POST"])
+def invalidate_sheet_cache():
+    # 工作人員修改試算表後呼叫；sheet 參數省略時清除全部工作表
+    if not is_admin_request():
+        abort(403)
+    payload = request.get_json(silent=True) or {}
+    sheet_name = payload.get("sheet") or request.args.get("sheet")
+    cleared = sheet_cache.invalidate(SPREADSHEET_ID, sheet_name)
+    spreadsheet_loader.invalidate(sheet_name)
+    venue_misses.clear()
+    return {"invalidated": cleared}
+
+@app.route("/admin/cache/warm", methods=["POST"])
+def warm_sheet_cache():
+    # 一次重新下載所有工作表並同時替換
+    if not is_admin_request():
+        abort(403)
+    version = sheet_cache.publish_many(SPREADSHEET_ID, fetch_all_sheets(SPREADSHEET_ID))
+    venue_misses.clear()
+    return {"version": version, "sheets": sheet_cache.stats()}
+
+@app.route("/admin/cache", methods=["GET"])
+def sheet_cache_stats():
+    if not is_admin_request():
+        abort(403)
+    return {
+        "sheets": sheet_cache.stats(),
+        "singleflight": sheet_cache.flight.stats(),
+        "sheets_guard": sheets_guard.stats(),
+        "delta_sync": spreadsheet_loader.stats(),
+        "snapshot_file": snapshot_file.stats() if snapshot_file else None,
+    }
+
+@app.route("/admin/routes", methods=["GET"])
+def list_routes():
+    # ?text=會員專區&text=日期2025-05-01 可順便測量這些訊息的 dispatch 時間
+    if not is_admin_request():
+        abort(403)
+    texts = request.args.getlist("text")
+    return {"routes": router.routes(), "benchmark": router.benchmark(texts) if texts else {}}
 
-@line_handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     user_id = event.source.user_id
     user_msg = event.message.text.strip()
-    logger.info(f"使用者 {user_id} 傳送訊息：{user_msg}")
-    # 會員專區選單
-    if user_msg == "會員專區":
-        template = TemplateSendMessage(
-            alt_text="會員功能選單",
-            template=ButtonsTemplate(
-                title="會員專區",
-                text="請選擇功能",
-                actions=[
-                    MessageAction(label="查詢會員資料", text="查詢會員資料"),
-                    MessageAction(label="健身紀錄", text="健身紀錄"),
-                ]
-            )
-        )
-        line_bot_api.reply_message(event.reply_token, template)
+    log_sampled("message", user=user_id, text=user_msg[:50])
+    ctx = CommandContext(event, user_id, user_msg, user_states.get(user_id))
+    profiling = profiler.begin() if getattr(event, "profile", False) or profiler.sampled() else None
+    started = time.perf_counter()
+    try:
+        router.dispatch(ctx)
+    finally:
+        try:
+            ctx.outbox.flush()
+        finally:
+            # 計時包含 reply / push API 的來回時間
+            DISPATCH_SECONDS.observe(time.perf_counter() - started, command=ctx.route or "none")
+            if profiling is not None:
+                profiler.end(profiling, ctx.route or "none")
 
-    elif user_msg == "查詢會員資料":
-        user_states[user_id] = "awaiting_member_info"
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="🆔 請輸入您的會員編號：\n\n⚠️忘記會員編號⚠️\n請輸入名字與電話號碼\n（例如：熊享瘦0912345678）")
-        )
 
-    elif user_states.get(user_id) == "awaiting_member_info":
-        keyword = user_msg.strip()
+# REPLY_OVERFLOW=more 時，送出上次沒送完的訊息
+@router.command(REPLY_MORE_TEXT)
+def show_pending_replies(ctx):
+    payloads = pending_replies.pop(pending_reply_key(ctx.outbox.chat_id), None)
+    if not payloads:
+        ctx.reply(models.TextSendMessage(text="沒有更多內容了"))
+        return
+    ctx.reply([EncodedMessage.from_payload(payload) for payload in payloads])
 
-        try:
-            import re
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("會員資料")
-            records = sheet.get_all_records()
-
-            member_data = None
-
-            # 1️⃣ 判斷是否為會員編號（如 A00001）
-            if re.match(r"^[A-Z]\d{5}$", keyword.upper()):
-                member_data = next(
-                    (row for row in records if str(row["會員編號"]).strip().upper() == keyword.upper()),
-                    None
-                )
-            else:
-                # 2️⃣ 嘗試拆解姓名 + 電話（如 王小明0912345678）
-                match = re.search(r"(.+?)(09\d{8})", keyword)
-                if match:
-                    name, phone = match.groups()
-                    phone_no_zero = phone[1:]  # 移除開頭 0：0912345678 -> 912345678
-
-                    # Debug log 可加上這行：
-                    # print(f"查詢姓名: {name}，電話: {phone_no_zero}")
-
-                    member_data = next(
-                        (row for row in records
-                         if row.get("姓名", "").replace(" ", "") == name
-                         and str(row.get("電話", "")).strip() == phone_no_zero),
-                        None
-                    )
-                else:
-                    raise ValueError("輸入格式錯誤！\n請輸入正確的會員編號或姓名+手機號碼(例如：熊享瘦0912345678)")
-
-            if member_data:
-                reply_text = (
-                    f"✅ 查詢成功\n\n"
-                    f"👤 姓名：{member_data['姓名']}\n\n"
-                    f"📱 電話：0{member_data['電話']}\n\n"
-                    f"🧾 會員類型：{member_data['會員類型']}\n\n"
-                    f"📌 狀態：{member_data['會員狀態']}\n\n"
-                    f"🎯 點數：{member_data['會員點數']}\n\n"
-                    f"⏳ 到期日：{member_data['會員到期日']}"
-                )
-            else:
-                reply_text = "❌ 查無此會員資料，請確認姓名與電話或會員編號是否正確。"
 
-        except Exception as e:
-            reply_text = f"❌ 查詢失敗：{str(e)}"
-            logger.error(f"會員查詢錯誤：{e}", exc_info=True)
-        user_states.pop(user_id)
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-
-    elif user_msg == "健身紀錄":
-        liff_url = "https://liff.line.me/2007341042-bzeprj3R"  # 這是新專案上線的網址
-        flex_message = FlexSendMessage(
-            alt_text="健身紀錄",
-            contents={
-                "type": "carousel",
-                "contents": [
-                    {
-                        "type": "bubble",
-                        "hero": {
-                            "type": "image",
-                            "url": "https://i.imgur.com/sevvXcU.jpeg",  # 替換為場地圖片
-                            "size": "full",
-                            "aspectRatio": "20:13",
-                            "aspectMode": "cover"
-                        },
-                        "body": {
-                            "type": "box",
-                            "layout": "vertical",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": "📚 健身紀錄日誌",
-                                    "weight": "bold",
-                                    "size": "xl"
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "紀錄你的健身事項",
-                                    "size": "sm",
-                                    "wrap": True,
-                                    "color": "#666666"
-                                }
-                            ]
-                        },
-                        "footer": {
-                            "type": "box",
-                            "layout": "vertical",
-                            "spacing": "sm",
-                            "contents": [
-                                {
-                                    "type": "button",
-                                    "action": {
-                                        "type": "uri",
-                                        "label": "開始記錄今日健身！",
-                                        "uri": liff_url
-                                    },
-                                    "style": "primary"
-                                },
-                                {
-                                    "type": "button",
-                                    "action": {
-                                        "type": "message",
-                                        "label": "查詢健身紀錄",
-                                        "text": "查詢健身紀錄"
-                                    }
-                                }
-                            ]
-                        }
-                    }
-                ]
-            }
+# 會員專區選單
+@message_templates.register("會員專區")
+def build_member_menu():
+    template = models.TemplateSendMessage(
+        alt_text="會員功能選單",
+        template=models.ButtonsTemplate(
+            title="會員專區",
+            text="請選擇功能",
+            actions=[
+                models.MessageAction(label="查詢會員資料", text="查詢會員資料"),
+                models.MessageAction(label="健身紀錄", text="健身紀錄"),
+            ] + ([models.MessageAction(label="訂閱會員提醒", text="訂閱會員提醒")] if member_bindings is not None else [])
         )
-        line_bot_api.reply_message(event.reply_token, flex_message)
+    )
+    return template
 
-    elif user_msg == "查詢健身紀錄":
-        user_states[user_id] = "awaiting_fitness_name"  # 新增狀態
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="請輸入名字與電話號碼以查詢健身紀錄（例如：熊享瘦0912345678)")
-        )
+@router.command("會員專區")
+def show_member_menu(ctx):
+    ctx.reply(message_templates.get("會員專區"))
 
-    elif user_states.get(user_id) == "awaiting_fitness_name":
-        name_phone_input = user_msg.strip()
-    
-        try:
-            import re
-            match = re.search(r"(.+?)(09\d{8})", name_phone_input)
-            if not match:
-                raise ValueError("輸入格式錯誤！\n請輸入正確的姓名+手機號碼\n（例如：熊享瘦0912345678）")
-    
-            user_name, user_phone = match.groups()
-            phone_no_zero = user_phone[1:]  # 去除開頭 0：0912345678 -> 912345678
-    
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("會員健身紀錄")
-            records = sheet.get_all_records()
-    
-            matched_records = [
-                record for record in records
-                if record.get("紀錄姓名", "").replace(" ", "") == user_name
-                and str(record.get("紀錄電話", "")).strip() == phone_no_zero
-            ]
-    
-            if matched_records:
-                reply_text = "📋 查詢到以下健身紀錄：\n"
-                for record in matched_records:
-                    reply_text += (
-                        f"📅 日期：{record.get('日期', '無資料')}\n"
-                        f"🏋️ 運動項目：{record.get('運動項目', '無資料')}\n"
-                        f"⏱️ 時長：{record.get('時長', '無資料')} 分鐘\n"
-                        f"📝 備註：{record.get('備註', '無資料')}\n"
-                        f"---\n"
-                    )
+@message_templates.register("查詢會員資料")
+def build_member_info_prompt():
+    return models.TextSendMessage(text="🆔 請輸入您的會員編號：\n\n⚠️忘記會員編號⚠️\n請輸入名字與電話號碼\n（例如：熊享瘦0912345678）")
+
+@router.command("查詢會員資料")
+def ask_member_info(ctx):
+    user_states.set(ctx.user_id, "awaiting_member_info")
+    ctx.reply(message_templates.get("查詢會員資料"))
+
+@router.state("awaiting_member_info")
+def lookup_member_info(ctx):
+    keyword = ctx.text.strip()
+
+    try:
+        members = member_index.current()
+
+        member_data = None
+
+        # 1️⃣ 判斷是否為會員編號（如 A00001）
+        if re.match(r"^[A-Z]\d{5}$", keyword.upper()):
+            member_data = members.find_by_id(keyword)
+        else:
+            # 2️⃣ 嘗試拆解姓名 + 電話（如 王小明0912345678）
+            match = re.search(r"(.+?)(09\d{8})", keyword)
+            if match:
+                name, phone = match.groups()
+                member_data = members.find_by_name_phone(name, phone)
             else:
-                reply_text = "❌ 查無此姓名與電話號碼的健身紀錄，請確認輸入是否正確。"
-    
-        except Exception as e:
-            reply_text = f"❌ 查詢失敗：{str(e)}"
-        user_states.pop(user_id)
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-            
-    elif user_msg == "常見問題":
-        faq_categories = ["準備運動", "會員方案", "課程", "其他"]
-        buttons = [
-            MessageAction(label=cat, text=cat)
-            for cat in faq_categories
-        ]
-        template = TemplateSendMessage(
-            alt_text="常見問題分類",
-            template=ButtonsTemplate(
-                title="常見問題",
-                text="請選擇分類",
-                actions=buttons[:4]  # ButtonsTemplate 最多只能放 4 個按鈕
-            )
-        )
-        line_bot_api.reply_message(event.reply_token, template)
-
-    elif user_msg in ["課程"]:
-        confirm_template = TemplateSendMessage(
-            alt_text = 'confirm template',
-            template = ConfirmTemplate(
-                title="常見問題課程分類",
-                text="請選擇分類",
-                actions = [
-                    MessageAction(
-                        label = '個人教練',
-                        text = '個人教練課程'),
-                    MessageAction(
-                        label = '團體',
-                        text = '團體課程')]
-                )
+                raise ValueError("輸入格式錯誤！\n請輸入正確的會員編號或姓名+手機號碼(例如：熊享瘦0912345678)")
+
+        if member_data:
+            reply_text = (
+                f"✅ 查詢成功\n\n"
+                f"👤 姓名：{member_data['姓名']}\n\n"
+                f"📱 電話：0{member_data['電話']}\n\n"
+                f"🧾 會員類型：{member_data['會員類型']}\n\n"
+                f"📌 狀態：{member_data['會員狀態']}\n\n"
+                f"🎯 點數：{member_data['會員點數']}\n\n"
+                f"⏳ 到期日：{member_data['會員到期日']}"
             )
-        line_bot_api.reply_message(event.reply_token, confirm_template)
+        else:
+            reply_text = "❌ 查無此會員資料，請確認姓名與電話或會員編號是否正確。"
 
-    elif user_msg in ["準備運動", "會員方案", "個人教練課程", "團體課程", "其他"]:
-        try:
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("常見問題")
-            records = sheet.get_all_records()
-            matched = [row for row in records if row["分類"] == user_msg]
+    except Exception as e:
+        reply_text = f"❌ 查詢失敗：{str(e)}"
+        logger.error(f"會員查詢錯誤：{e}", exc_info=True)
+    user_states.pop(ctx.user_id, None)
+    ctx.reply(models.TextSendMessage(text=reply_text))
 
-            if not matched:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="找不到相關問題。"))
-                return
+@message_templates.register("訂閱會員提醒")
+def build_member_binding_prompt():
+    return models.TextSendMessage(text="🔔 訂閱會員到期與點數提醒\n\n請輸入會員姓名與電話號碼確認身分\n（例如：熊享瘦0912345678）")
+
+@router.command("訂閱會員提醒")
+def ask_member_binding(ctx):
+    if member_bindings is None or not ctx.user_id:
+        ctx.reply(models.TextSendMessage(text="⚠ 目前無法訂閱會員提醒，請洽櫃台。"))
+        return
+    user_states.set(ctx.user_id, "awaiting_member_binding")
+    ctx.reply(message_templates.get("訂閱會員提醒"))
+
+@router.state("awaiting_member_binding")
+def confirm_member_binding(ctx):
+    user_states.pop(ctx.user_id, None)
+    # 只接受姓名 + 電話確認身分；會員編號容易猜到，不能用來綁定
+    match = re.search(r"(.+?)(09\d{8})", ctx.text.strip())
+    try:
+        member_data = member_index.current().find_by_name_phone(*match.groups()) if match else None
+        if member_data is None:
+            reply_text = "❌ 姓名與電話不符，請重新輸入「訂閱會員提醒」再試一次。"
+        else:
+            reply_text = {
+                "bound": f"✅ 已訂閱 {member_data['姓名']} 的會員到期與點數提醒\n\n輸入「取消會員提醒」可取消訂閱",
+                "already": f"✅ 您已訂閱 {member_data['姓名']} 的會員提醒",
+                "taken": "⚠ 此會員已由其他 LINE 帳號訂閱提醒，如需變更請洽櫃台。",
+            }[bind_member(member_data.get("會員編號"), ctx.user_id)]
+    except Exception as e:
+        reply_text = "❌ 訂閱失敗，請稍後再試。"
+        logger.error(f"訂閱會員提醒錯誤：{e}", exc_info=True)
+    ctx.reply(models.TextSendMessage(text=reply_text))
+
+@router.command("取消會員提醒")
+def cancel_member_binding(ctx):
+    if member_bindings is None or not ctx.user_id:
+        ctx.reply(models.TextSendMessage(text="⚠ 目前無法取消會員提醒，請洽櫃台。"))
+        return
+    try:
+        member_ids = unbind_member(ctx.user_id)
+        reply_text = "✅ 已取消會員提醒" if member_ids else "您目前沒有訂閱會員提醒"
+    except Exception as e:
+        reply_text = "❌ 取消失敗，請稍後再試。"
+        logger.error(f"取消會員提醒錯誤：{e}", exc_info=True)
+    ctx.reply(models.TextSendMessage(text=reply_text))
 
-            bubbles = []
-            for item in matched:
-                bubble = {
+@message_templates.register("健身紀錄")
+def build_fitness_menu():
+    liff_url = "https://liff.line.me/2007341042-bzeprj3R"  # 這是新專案上線的網址
+    flex_message = models.FlexSendMessage(
+        alt_text="健身紀錄",
+        contents={
+            "type": "carousel",
+            "contents": [
+                {
                     "type": "bubble",
-                    "size": "mega",
+                    "hero": {
+                        "type": "image",
+                        "url": "https://i.imgur.com/sevvXcU.jpeg",  # 替換為場地圖片
+                        "size": "full",
+                        "aspectRatio": "20:13",
+                        "aspectMode": "cover"
+                    },
                     "body": {
                         "type": "box",
                         "layout": "vertical",
-                        "spacing": "sm",
                         "contents": [
                             {
                                 "type": "text",
-                                "text": f"❓ {item['問題']}",
-                                "wrap": True,
+                                "text": "📚 健身紀錄日誌",
                                 "weight": "bold",
-                                "size": "md",
-                                "color": "#333333"
+                                "size": "xl"
                             },
                             {
                                 "type": "text",
-                                "text": f"💡 {item['答覆']}",
-                                "wrap": True,
+                                "text": "紀錄你的健身事項",
                                 "size": "sm",
+                                "wrap": True,
                                 "color": "#666666"
                             }
                         ]
-                    }
-                }
-                bubbles.append(bubble)
-
-            flex_message = FlexSendMessage(
-                alt_text=f"{user_msg} 的常見問題",
-                contents={
-                    "type": "carousel",
-                    "contents": bubbles[:10]  # 最多 10 筆
-                }
-            )
-            line_bot_api.reply_message(event.reply_token, flex_message)
-
-        except Exception as e:
-            logger.error(f"常見問題查詢錯誤：{e}", exc_info=True)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠ 查詢失敗，請稍後再試。"))
-            
-    elif user_msg == "更多功能":
-        flex_message = FlexSendMessage(
-            alt_text="更多功能選單",
-            contents={
-                "type": "carousel",
-                "contents": [
-                    {
-                        "type": "bubble",
-                        "hero": {
-                            "type": "image",
-                            "url": "https://i.imgur.com/d3v7RxR.png",  # 替換為場地圖片
-                            "size": "full",
-                            "aspectRatio": "20:13",
-                            "aspectMode": "cover"
-                        },
-                        "body": {
-                            "type": "box",
-                            "layout": "vertical",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": "🏟️ 場地介紹",
-                                    "weight": "bold",
-                                    "size": "xl"
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "探索我們的健身空間",
-                                    "size": "sm",
-                                    "wrap": True,
-                                    "color": "#666666"
-                                }
-                            ]
-                        },
-                        "footer": {
-                            "type": "box",
-                            "layout": "horizontal",
-                            "spacing": "sm",
-                            "contents": [
-                                {
-                                    "type": "button",
-                                    "action": {
-                                        "type": "message",
-                                        "label": "健身/重訓",
-                                        "text": "健身/重訓"
-                                    },
-                                    "style": "primary"
-                                },
-                                {
-                                    "type": "button",
-                                    "action": {
-                                        "type": "message",
-                                        "label": "上課教室",
-                                        "text": "上課教室"
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    {
-                        "type": "bubble",
-                        "hero": {
-                            "type": "image",
-                            "url": "https://i.imgur.com/HrtfSdH.png",  # 替換為課程圖片
-                            "size": "full",
-                            "aspectRatio": "20:13",
-                            "aspectMode": "cover"
-                        },
-                        "body": {
-                            "type": "box",
-                            "layout": "vertical",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": "📚 課程介紹",
-                                    "weight": "bold",
-                                    "size": "xl"
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "了解我們提供的課程類型",
-                                    "size": "sm",
-                                    "wrap": True,
-                                    "color": "#666666"
-                                }
-                            ]
-                        },
-                        "footer": {
-                            "type": "box",
-                            "layout": "vertical",
-                            "contents": [
-                                {
-                                    "type": "button",
-                                    "action": {
-                                        "type": "message",
-                                        "label": "查看課程內容",
-                                        "text": "課程內容"
-                                    },
-                                    "style": "primary"
-                                }
-                            ]
-                        }
                     },
-                    {
-                        "type": "bubble",
-                        "hero": {
-                            "type": "image",
-                            "url": "https://i.imgur.com/izThqNv.png",  # 替換為團隊圖片
-                            "size": "full",
-                            "aspectRatio": "20:13",
-                            "aspectMode": "cover"
-                        },
-                        "body": {
-                            "type": "box",
-                            "layout": "vertical",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": "👥 團隊介紹",
-                                    "weight": "bold",
-                                    "size": "xl"
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "認識我們的教練與團隊",
-                                    "size": "sm",
-                                    "wrap": True,
-                                    "color": "#666666"
-                                }
-                            ]
-                        },
-                        "footer": {
-                            "type": "box",
-                            "layout": "horizontal",
-                            "spacing": "sm",
-                            "contents": [
-                                {
-                                    "type": "button",
-                                    "action": {
-                                        "type": "message",
-                                        "label": "健身教練",
-                                        "text": "健身教練"
-                                    },
-                                    "style": "primary"
+                    "footer": {
+                        "type": "box",
+                        "layout": "vertical",
+                        "spacing": "sm",
+                        "contents": [
+                            {
+                                "type": "button",
+                                "action": {
+                                    "type": "uri",
+                                    "label": "開始記錄今日健身！",
+                                    "uri": liff_url
                                 },
-                                {
-                                    "type": "button",
-                                    "action": {
-                                        "type": "message",
-                                        "label": "課程教練",
-                                        "text": "課程教練"
-                                    }
+                                "style": "primary"
+                            },
+                            {
+                                "type": "button",
+                                "action": {
+                                    "type": "message",
+                                    "label": "查詢健身紀錄",
+                                    "text": "查詢健身紀錄"
                                 }
-                            ]
-                        }
+                            }
+                        ]
                     }
-                ]
-            }
-        )
-        line_bot_api.reply_message(event.reply_token, flex_message)
-        
-    elif user_msg == "健身/重訓":
-        # 顯示分類選單（按鈕）
-        subcategories = ["心肺訓練", "背部訓練", "腿部訓練", "自由重量器材"]
-        buttons = [
-            MessageAction(label=sub, text=sub)
-            for sub in subcategories[:4]  # 先顯示前4個
-        ]
-        # 第二個 bubble 可加更多分類
-        template = TemplateSendMessage(
-            alt_text="健身/重訓 器材分類",
-            template=ButtonsTemplate(
-                title="健身/重訓 器材分類",
-                text="請選擇器材分類",
-                actions=buttons
-            )
-        )
-        line_bot_api.reply_message(event.reply_token, template)
-        
-    elif user_msg in ["心肺訓練", "背部訓練", "腿部訓練", "自由重量器材"]:
-        try:
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("場地資料")
-            records = sheet.get_all_records()
-
-            matched = [
-                row for row in records
-                if row.get("分類", "").strip() == user_msg and row.get("圖片1", "").startswith("https")
+                }
             ]
+        }
+    )
+    return flex_message
 
-            if not matched:
-                line_bot_api.reply_message(
-                    event.reply_token, TextSendMessage(text=f"⚠ 查無『{user_msg}』分類的器材圖片")
-                )
-                return
+@router.command("健身紀錄")
+def show_fitness_menu(ctx):
+    ctx.reply(message_templates.get("健身紀錄"))
 
-            # 每 10 筆一組發送
-            for i in range(0, len(matched), 10):
-                chunk = matched[i:i + 10]
-                image_columns = [
-                    ImageCarouselColumn(
-                        image_url=row["圖片1"],
-                        action=MessageAction(label=row.get("名稱", "查看詳情"), text=row.get("名稱", "查看詳情"))
-                    ) for row in chunk
-                ]
+@message_templates.register("查詢健身紀錄")
+def build_fitness_name_prompt():
+    return models.TextSendMessage(text="請輸入名字與電話號碼以查詢健身紀錄（例如：熊享瘦0912345678)")
 
-                carousel = TemplateSendMessage(
-                    alt_text=f"{user_msg} 器材圖片",
-                    template=ImageCarouselTemplate(columns=image_columns)
-                )
-                line_bot_api.reply_message(event.reply_token, carousel)
+@router.command("查詢健身紀錄")
+def ask_fitness_name(ctx):
+    user_states.set(ctx.user_id, "awaiting_fitness_name")  # 新增狀態
+    ctx.reply(message_templates.get("查詢健身紀錄"))
 
-        except Exception as e:
-            logger.error(f"{user_msg} 分類查詢錯誤：{e}", exc_info=True)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠ 發生錯誤，請稍後再試。"))
-            
-    elif user_msg == "上課教室":
-        try:
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("場地資料")
-            records = sheet.get_all_records()
+@router.state("awaiting_fitness_name")
+def lookup_fitness_log(ctx):
+    name_phone_input = ctx.text.strip()
 
-            matched = [
-                row for row in records
-                if row.get("類型", "").strip() == "上課教室" and row.get("圖片1", "").startswith("https")
-            ]
+    try:
+        match = re.search(r"(.+?)(09\d{8})", name_phone_input)
+        if not match:
+            raise ValueError("輸入格式錯誤！\n請輸入正確的姓名+手機號碼\n（例如：熊享瘦0912345678）")
 
-            if not matched:
-                line_bot_api.reply_message(
-                    event.reply_token, TextSendMessage(text="⚠ 查無『上課教室』的場地資料")
-                )
-                return
+        user_name, user_phone = match.groups()
+        reply_message = build_fitness_reply(user_name, user_phone)
 
-            image_columns = [
-                ImageCarouselColumn(
-                    image_url=row["圖片1"],
-                    action=MessageAction(label=row.get("名稱", "查看詳情"), text=row.get("名稱", "查看詳情"))
-                ) for row in matched
-            ]
+    except Exception as e:
+        reply_message = models.TextSendMessage(text=f"❌ 查詢失敗：{str(e)}")
+    user_states.pop(ctx.user_id, None)
+    ctx.reply(reply_message)
+
+@router.prefix(FITNESS_MORE_PREFIX)
+def more_fitness_log(ctx):
+    # 健身紀錄分頁：更多健身紀錄:熊享瘦0912345678:2
+    match = re.match(rf"^{FITNESS_MORE_PREFIX}:(.+?)(09\d{{8}}):(\d+)$", ctx.text)
+    try:
+        if not match:
+            raise ValueError("分頁資訊錯誤，請重新查詢健身紀錄")
+        user_name, user_phone, page = match.groups()
+        reply_message = build_fitness_reply(user_name, user_phone, max(1, int(page)))
+    except Exception as e:
+        reply_message = models.TextSendMessage(text=f"❌ 查詢失敗：{str(e)}")
+    ctx.reply(reply_message)
 
-            carousel = TemplateSendMessage(
-                alt_text="上課教室場地列表",
-                template=ImageCarouselTemplate(columns=image_columns[:10])
+@message_templates.register("常見問題")
+def build_faq_menu():
+    faq_categories = ["準備運動", "會員方案", "課程", "其他"]
+    buttons = [
+        models.MessageAction(label=cat, text=cat)
+        for cat in faq_categories
+    ]
+    template = models.TemplateSendMessage(
+        alt_text="常見問題分類",
+        template=models.ButtonsTemplate(
+            title="常見問題",
+            text="請選擇分類",
+            actions=buttons[:4]  # ButtonsTemplate 最多只能放 4 個按鈕
+        )
+    )
+    return template
+
+@router.command("常見問題")
+def show_faq_menu(ctx):
+    ctx.reply(message_templates.get("常見問題"))
+
+@message_templates.register("課程")
+def build_faq_course_menu():
+    confirm_template = models.TemplateSendMessage(
+        alt_text = 'confirm template',
+        template = models.ConfirmTemplate(
+            title="常見問題課程分類",
+            text="請選擇分類",
+            actions = [
+                models.MessageAction(
+                    label = '個人教練',
+                    text = '個人教練課程'),
+                models.MessageAction(
+                    label = '團體',
+                    text = '團體課程')]
             )
-            line_bot_api.reply_message(event.reply_token, carousel)
+        )
+    return confirm_template
 
-        except Exception as e:
-            logger.error(f"上課教室查詢失敗：{e}", exc_info=True)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"⚠ 發生錯誤：{e}"))
+@router.command("課程")
+def show_faq_course_menu(ctx):
+    ctx.reply(message_templates.get("課程"))
 
-    elif user_msg == "健身教練":
-        try:
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("教練資料")
-            records = sheet.get_all_records()
-    
-            matched = [
-                row for row in records
-                if row.get("教練類型", "").strip() == "健身教練" and row.get("圖片", "").startswith("https")
-            ]
-    
-            if not matched:
-                line_bot_api.reply_message(
-                    event.reply_token, TextSendMessage(text="⚠ 查無『健身教練』的資料")
-                )
-                return
-    
-            bubbles = []
-            for row in matched:
-                bubble = {
+def build_faq_carousel(records, category):
+    matched = [row for row in records if row["分類"] == category]
+
+    if not matched:
+        return models.TextSendMessage(text="找不到相關問題。")
+
+    bubbles = []
+    for item in matched:
+        bubble = {
+            "type": "bubble",
+            "size": "mega",
+            "body": {
+                "type": "box",
+                "layout": "vertical",
+                "spacing": "sm",
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": f"❓ {item['問題']}",
+                        "wrap": True,
+                        "weight": "bold",
+                        "size": "md",
+                        "color": "#333333"
+                    },
+                    {
+                        "type": "text",
+                        "text": f"💡 {item['答覆']}",
+                        "wrap": True,
+                        "size": "sm",
+                        "color": "#666666"
+                    }
+                ]
+            }
+        }
+        bubbles.append(bubble)
+
+    return models.FlexSendMessage(
+        alt_text=f"{category} 的常見問題",
+        contents={
+            "type": "carousel",
+            "contents": bubbles[:10]  # 最多 10 筆
+        }
+    )
+
+@router.command("準備運動", "會員方案", "個人教練課程", "團體課程", "其他")
+def reply_faq(ctx):
+    try:
+        snapshot = get_sheet_snapshot("常見問題")
+        ctx.reply(message_templates.memoize("faq", ctx.text, snapshot, build_faq_carousel))
+
+    except Exception as e:
+        logger.error(f"常見問題查詢錯誤：{e}", exc_info=True)
+        ctx.reply(models.TextSendMessage(text="⚠ 查詢失敗，請稍後再試。"))
+
+@message_templates.register("更多功能")
+def build_more_features():
+    flex_message = models.FlexSendMessage(
+        alt_text="更多功能選單",
+        contents={
+            "type": "carousel",
+            "contents": [
+                {
                     "type": "bubble",
                     "hero": {
                         "type": "image",
-                        "url": row["圖片"],
+                        "url": "https://i.imgur.com/d3v7RxR.png",  # 替換為場地圖片
                         "size": "full",
                         "aspectRatio": "20:13",
                         "aspectMode": "cover"
@@ -620,18 +3398,16 @@ def handle_message(event):
                     "body": {
                         "type": "box",
                         "layout": "vertical",
-                        "spacing": "sm",
                         "contents": [
                             {
                                 "type": "text",
-                                "text": f"{row['姓名']}（{row['教練類別']}）",
+                                "text": "🏟️ 場地介紹",
                                 "weight": "bold",
-                                "size": "lg",
-                                "wrap": True
+                                "size": "xl"
                             },
                             {
                                 "type": "text",
-                                "text": f"專長：{row.get('專長', '未提供')}",
+                                "text": "探索我們的健身空間",
                                 "size": "sm",
                                 "wrap": True,
                                 "color": "#666666"
@@ -640,423 +3416,925 @@ def handle_message(event):
                     },
                     "footer": {
                         "type": "box",
-                        "layout": "vertical",
+                        "layout": "horizontal",
                         "spacing": "sm",
                         "contents": [
                             {
                                 "type": "button",
-                                "style": "primary",
                                 "action": {
-                                    "type": "uri",  # 將 action 的類型改為 uri
-                                    "label": "立即預約",
-                                    "uri": "https://docs.google.com/forms/d/e/1FAIpQLSct_FZcn9et_grMYECeT8xLwxaJg-AFMIUDszNusa2AG2gHMg/viewform"  # 設定要導向的網址
+                                    "type": "message",
+                                    "label": "健身/重訓",
+                                    "text": "健身/重訓"
+                                },
+                                "style": "primary"
+                            },
+                            {
+                                "type": "button",
+                                "action": {
+                                    "type": "message",
+                                    "label": "上課教室",
+                                    "text": "上課教室"
                                 }
                             }
                         ]
                     }
-                }
-                bubbles.append(bubble)
-    
-            flex_message = FlexSendMessage(
-                alt_text="健身教練清單",
-                contents={
-                    "type": "carousel",
-                    "contents": bubbles[:10]
-                }
-            )
-            line_bot_api.reply_message(event.reply_token, flex_message)
-        except Exception as e:
-            print(f"發生錯誤：{e}")
-            line_bot_api.reply_message(
-                event.reply_token, TextSendMessage(text="⚠ 查詢健身教練資料時發生錯誤")
-            )
-
-    elif user_msg == "課程教練":
-        # 顯示分類選單（按鈕）
-        subcategories = ["有氧教練", "瑜珈老師", "游泳教練"]
-        buttons = [
-            MessageAction(label=sub, text=sub)
-            for sub in subcategories[:4]  # 先顯示前4個
-        ]
-        # 第二個 bubble 可加更多分類
-        template = TemplateSendMessage(
-            alt_text="課程教練分類",
-            template=ButtonsTemplate(
-                title="課程教練分類",
-                text="請選擇課程教練",
-                actions=buttons
-            )
-        )
-        line_bot_api.reply_message(event.reply_token, template)
-
-    elif user_msg in ["有氧教練", "瑜珈老師", "游泳教練"]:
-         try:
-             client = get_gspread_client()
-             sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("教練資料")
-             records = sheet.get_all_records()
- 
-             matched = [
-                 row for row in records
-                 if row.get("教練類別", "").strip() == user_msg and row.get("圖片", "").startswith("https")
-             ]
- 
-             if not matched:
-                 line_bot_api.reply_message(
-                     event.reply_token, TextSendMessage(text="⚠ 查無『{user_msg}』的資料")
-                 )
-                 return
- 
-             bubbles = []
-             for row in matched:
-                 bubble = {
-                     "type": "bubble",
-                     "hero": {
-                         "type": "image",
-                         "url": row["圖片"],
-                         "size": "full",
-                         "aspectRatio": "20:13",
-                         "aspectMode": "cover"
-                     },
-                     "body": {
-                         "type": "box",
-                         "layout": "vertical",
-                         "spacing": "sm",
-                         "contents": [
-                             {
-                                 "type": "text",
-                                 "text": f"{row['姓名']}（{row['教練類別']}）",
-                                 "weight": "bold",
-                                 "size": "lg",
-                                 "wrap": True
-                             },
-                             {
-                                 "type": "text",
-                                 "text": f"專長：{row.get('專長', '未提供')}",
-                                 "size": "sm",
-                                 "wrap": True,
-                                 "color": "#666666"
-                             }
-                         ]
-                     },
-                     "footer": {
-                         "type": "box",
-                         "layout": "vertical",
-                         "spacing": "sm",
-                         "contents": [
-                             {
-                                 "type": "button",
-                                 "style": "primary",
-                                 "action": {
-                                     "type": "uri",
-                                     "label": "立即預約",
-                                     "uri": "https://docs.google.com/forms/d/e/1FAIpQLSct_FZcn9et_grMYECeT8xLwxaJg-AFMIUDszNusa2AG2gHMg/viewform"
-                                 }
-                             }
-                         ]
-                     }
-                 }
-                 bubbles.append(bubble)
- 
-             flex_message = FlexSendMessage(
-                 alt_text="課程教練清單",
-                 contents={
-                     "type": "carousel",
-                     "contents": bubbles[:10]
-                 }
-             )
-             line_bot_api.reply_message(event.reply_token, flex_message)
- 
-         except Exception as e:
-             logger.error(f"課程教練查詢失敗：{e}", exc_info=True)
-             line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"⚠ 發生錯誤：{e}"))
-
-    elif user_msg == "課程內容":
-        try:
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("課程資料")
-            records = sheet.get_all_records()
-
-            # 提取唯一課程類型
-            course_types = list({row["課程類型"].strip() for row in records if row.get("課程類型")})
-            course_types = [t for t in course_types if t]
-
-            # 建立按鈕
-            buttons = [
+                },
                 {
-                    "type": "button",
-                    "style": "secondary",
-                    "action": {
-                        "type": "message",
-                        "label": t,
-                        "text": t
-                    }
-                } for t in course_types[:6]
-            ]
-
-            bubble = {
-                "type": "bubble",
-                "body": {
-                    "type": "box",
-                    "layout": "vertical",
-                    "contents": [
-                        {
-                            "type": "text",
-                            "text": "📚 課程內容查詢",
-                            "weight": "bold",
-                            "size": "lg",
-                            "margin": "md"
-                        },
-                        {
-                            "type": "box",
-                            "layout": "vertical",
-                            "spacing": "sm",
-                            "margin": "lg",
-                            "contents": buttons
-                        }
-                    ]
-                }
-            }
-
-            flex_msg = FlexSendMessage(
-                alt_text="課程類型查詢",
-                contents=bubble
-            )
-
-            line_bot_api.reply_message(
-                event.reply_token,
-                [
-                    flex_msg,
-                    TextSendMessage(text="📅 你也可以輸入日期（例如：日期2025-05-01）查詢當天開課課程。")
-                ]
-            )
-
-        except Exception as e:
-            logger.error(f"課程內容查詢錯誤：{e}", exc_info=True)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠ 無法讀取課程資料"))
-
-    elif user_msg in ["有氧課程", "瑜珈課程", "游泳課程"]:
-        try:
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("課程資料")
-            records = sheet.get_all_records()
-
-            matched = [row for row in records if row.get("課程類型", "").strip() == user_msg]
-
-            if not matched:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"❌ 查無『{user_msg}』相關課程"))
-                return
-
-            bubbles = []
-            for row in matched[:10]:
-                bubble_contents = {
                     "type": "bubble",
+                    "hero": {
+                        "type": "image",
+                        "url": "https://i.imgur.com/HrtfSdH.png",  # 替換為課程圖片
+                        "size": "full",
+                        "aspectRatio": "20:13",
+                        "aspectMode": "cover"
+                    },
                     "body": {
                         "type": "box",
                         "layout": "vertical",
-                        "spacing": "sm",
                         "contents": [
-                            {"type": "text", "text": row.get("課程名稱", "（未提供課程名稱）"), "weight": "bold", "size": "lg", "wrap": True},
-                            {"type": "text", "text": f"👨‍🏫 教練：{row.get('教練姓名', '未知')}", "size": "sm", "wrap": True},
-                            {"type": "text", "text": f"📅 開課日期：{row.get('開始日期', '未提供')}", "size": "sm"},
-                            {"type": "text", "text": f"🕒 上課時間：{row.get('上課時間', '未提供')}", "size": "sm"},
-                            {"type": "text", "text": f"⏱️ 時間：{row.get('時間', '未提供')}", "size": "sm"},
-                            {"type": "text", "text": f"💲 價格：{row.get('課程價格', '未定')}", "size": "sm"}
+                            {
+                                "type": "text",
+                                "text": "📚 課程介紹",
+                                "weight": "bold",
+                                "size": "xl"
+                            },
+                            {
+                                "type": "text",
+                                "text": "了解我們提供的課程類型",
+                                "size": "sm",
+                                "wrap": True,
+                                "color": "#666666"
+                            }
                         ]
                     },
                     "footer": {
                         "type": "box",
                         "layout": "vertical",
-                        "spacing": "sm",
                         "contents": [
                             {
                                 "type": "button",
-                                "style": "primary",
                                 "action": {
-                                    "type": "uri",
-                                    "label": "立即預約",
-                                    "uri": "https://docs.google.com/forms/d/e/1FAIpQLSct_FZcn9et_grMYECeT8xLwxaJg-AFMIUDszNusa2AG2gHMg/viewform"
-                                }
+                                    "type": "message",
+                                    "label": "查看課程內容",
+                                    "text": "課程內容"
+                                },
+                                "style": "primary"
                             }
                         ]
                     }
-                }
-                bubbles.append(bubble_contents)
-
-            line_bot_api.reply_message(
-                event.reply_token,
-                FlexSendMessage(
-                    alt_text=f"{user_msg} 課程內容",
-                    contents={"type": "carousel", "contents": bubbles}
-                )
-            )
-
-        except Exception as e:
-            logger.error(f"課程類型查詢錯誤：{e}", exc_info=True)
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=f"⚠ 無法查詢課程內容（錯誤：{str(e)}）")
-            )
-
-    elif user_msg.startswith("日期"):
-        try:
-            import re
-            # 從使用者訊息提取日期（支援 YYYY-MM-DD 或 YYYY/MM/DD）
-            match = re.search(r"\d{4}[-/]\d{2}[-/]\d{2}", user_msg)
-            if not match:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠ 請輸入正確格式的日期（例如：日期2025-05-01）"))
-                return
-            
-            input_date = match.group(0).replace("/", "-")  # 統一成 YYYY-MM-DD 格式
-    
-            # 讀取 Google Sheet 資料
-            client = get_gspread_client()
-            sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("課程資料")
-            records = sheet.get_all_records()
-            print(f"[Debug] 讀取到 {len(records)} 筆資料")  # 除錯印出
-    
-            # 過濾符合日期的課程
-            matched_courses = [
-                row for row in records
-                if row.get("開始日期", "").strip() == input_date
-            ]
-            print(f"[Debug] 符合日期 {input_date} 的課程有 {len(matched_courses)} 筆")  # 除錯印出
-    
-            if not matched_courses:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"❌ {input_date} 沒有開課資訊"))
-                return
-    
-            # 建立 Flex Message 回覆
-            bubbles = []
-            for row in matched_courses[:10]:
-                bubble_contents = {
+                },
+                {
                     "type": "bubble",
-                    "size": "kilo",
+                    "hero": {
+                        "type": "image",
+                        "url": "https://i.imgur.com/izThqNv.png",  # 替換為團隊圖片
+                        "size": "full",
+                        "aspectRatio": "20:13",
+                        "aspectMode": "cover"
+                    },
                     "body": {
                         "type": "box",
                         "layout": "vertical",
-                        "spacing": "sm",
                         "contents": [
-                            {"type": "text", "text": row.get("課程名稱", "（未提供課程名稱）"), "weight": "bold", "size": "lg", "wrap": True},
-                            {"type": "text", "text": f"👨‍🏫 教練：{row.get('教練姓名', '未知')}", "size": "sm", "wrap": True},
-                            {"type": "text", "text": f"📅 開課日期：{row.get('開始日期', '未提供')}", "size": "sm"},
-                            {"type": "text", "text": f"🕒 上課時間：{row.get('上課時間', '未提供')}", "size": "sm"},
-                            {"type": "text", "text": f"⏱️ 時間：{row.get('時間', '未提供')}", "size": "sm"},
-                            {"type": "text", "text": f"💲 價格：{row.get('課程價格', '未定')}", "size": "sm"}
+                            {
+                                "type": "text",
+                                "text": "👥 團隊介紹",
+                                "weight": "bold",
+                                "size": "xl"
+                            },
+                            {
+                                "type": "text",
+                                "text": "認識我們的教練與團隊",
+                                "size": "sm",
+                                "wrap": True,
+                                "color": "#666666"
+                            }
                         ]
                     },
                     "footer": {
                         "type": "box",
-                        "layout": "vertical",
+                        "layout": "horizontal",
                         "spacing": "sm",
                         "contents": [
                             {
                                 "type": "button",
-                                "style": "primary",
                                 "action": {
-                                    "type": "uri",
-                                    "label": "立即預約",
-                                    "uri": "https://docs.google.com/forms/d/e/1FAIpQLSct_FZcn9et_grMYECeT8xLwxaJg-AFMIUDszNusa2AG2gHMg/viewform"
+                                    "type": "message",
+                                    "label": "健身教練",
+                                    "text": "健身教練"
+                                },
+                                "style": "primary"
+                            },
+                            {
+                                "type": "button",
+                                "action": {
+                                    "type": "message",
+                                    "label": "課程教練",
+                                    "text": "課程教練"
                                 }
                             }
                         ]
                     }
                 }
-                bubbles.append(bubble_contents)
+            ]
+        }
+    )
+    return flex_message
+
+@router.command("更多功能")
+def show_more_features(ctx):
+    ctx.reply(message_templates.get("更多功能"))
+
+@message_templates.register("健身/重訓")
+def build_equipment_menu():
+    # 顯示分類選單（按鈕）
+    subcategories = ["心肺訓練", "背部訓練", "腿部訓練", "自由重量器材"]
+    buttons = [
+        models.MessageAction(label=sub, text=sub)
+        for sub in subcategories[:4]  # 先顯示前4個
+    ]
+    # 第二個 bubble 可加更多分類
+    template = models.TemplateSendMessage(
+        alt_text="健身/重訓 器材分類",
+        template=models.ButtonsTemplate(
+            title="健身/重訓 器材分類",
+            text="請選擇器材分類",
+            actions=buttons
+        )
+    )
+    return template
+
+@router.command("健身/重訓")
+def show_equipment_menu(ctx):
+    ctx.reply(message_templates.get("健身/重訓"))
+
+def build_equipment_carousels(records, category):
+    matched = [
+        row for row in records
+        if row.get("分類", "").strip() == category and row.get("圖片1", "").startswith("https")
+    ]
+
+    if not matched:
+        return [models.TextSendMessage(text=f"⚠ 查無『{category}』分類的器材圖片")]
+
+    # 每 10 筆一組
+    carousels = []
+    for i in range(0, len(matched), 10):
+        chunk = matched[i:i + 10]
+        image_columns = [
+            models.ImageCarouselColumn(
+                image_url=row["圖片1"],
+                action=models.MessageAction(label=row.get("名稱", "查看詳情"), text=row.get("名稱", "查看詳情"))
+            ) for row in chunk
+        ]
+
+        carousels.append(models.TemplateSendMessage(
+            alt_text=f"{category} 器材圖片",
+            template=models.ImageCarouselTemplate(columns=image_columns)
+        ))
+    return carousels
+
+@router.command("心肺訓練", "背部訓練", "腿部訓練", "自由重量器材")
+def reply_equipment(ctx):
+    try:
+        snapshot = get_sheet_snapshot("場地資料")
+        ctx.reply(message_templates.memoize("equipment", ctx.text, snapshot, build_equipment_carousels))
+
+    except Exception as e:
+        logger.error(f"{ctx.text} 分類查詢錯誤：{e}", exc_info=True)
+        ctx.reply(models.TextSendMessage(text="⚠ 發生錯誤，請稍後再試。"))
+
+def build_classroom_carousel(records, room_type):
+    matched = [
+        row for row in records
+        if row.get("類型", "").strip() == room_type and row.get("圖片1", "").startswith("https")
+    ]
+
+    if not matched:
+        return models.TextSendMessage(text=f"⚠ 查無『{room_type}』的場地資料")
+
+    image_columns = [
+        models.ImageCarouselColumn(
+            image_url=row["圖片1"],
+            action=models.MessageAction(label=row.get("名稱", "查看詳情"), text=row.get("名稱", "查看詳情"))
+        ) for row in matched
+    ]
+
+    return models.TemplateSendMessage(
+        alt_text=f"{room_type}場地列表",
+        template=models.ImageCarouselTemplate(columns=image_columns[:10])
+    )
+
+@router.command("上課教室")
+def reply_classrooms(ctx):
+    try:
+        snapshot = get_sheet_snapshot("場地資料")
+        ctx.reply(message_templates.memoize("classrooms", "上課教室", snapshot, build_classroom_carousel))
+
+    except Exception as e:
+        logger.error(f"上課教室查詢失敗：{e}", exc_info=True)
+        ctx.reply(models.TextSendMessage(text=f"⚠ 發生錯誤：{e}"))
+
+def build_coach_bubble(row):
+    return {
+        "type": "bubble",
+        "hero": {
+            "type": "image",
+            "url": row["圖片"],
+            "size": "full",
+            "aspectRatio": "20:13",
+            "aspectMode": "cover"
+        },
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": [
+                {
+                    "type": "text",
+                    "text": f"{row['姓名']}（{row['教練類別']}）",
+                    "weight": "bold",
+                    "size": "lg",
+                    "wrap": True
+                },
+                {
+                    "type": "text",
+                    "text": f"專長：{row.get('專長', '未提供')}",
+                    "size": "sm",
+                    "wrap": True,
+                    "color": "#666666"
+                }
+            ]
+        },
+        "footer": {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": [
+                {
+                    "type": "button",
+                    "style": "primary",
+                    "action": {
+                        "type": "uri",
+                        "label": "立即預約",
+                        "uri": BOOKING_FORM_URL
+                    }
+                }
+            ]
+        }
+    }
+
+def build_coach_carousel(records, key):
+    # key 為（比對欄位, 值），健身教練看「教練類型」，課程教練看「教練類別」
+    column, value = key
+    matched = [
+        row for row in records
+        if row.get(column, "").strip() == value and row.get("圖片", "").startswith("https")
+    ]
+
+    if not matched:
+        return models.TextSendMessage(text=f"⚠ 查無『{value}』的資料")
+
+    return models.FlexSendMessage(
+        alt_text="健身教練清單" if column == "教練類型" else "課程教練清單",
+        contents={
+            "type": "carousel",
+            "contents": [build_coach_bubble(row) for row in matched[:10]]
+        }
+    )
+
+@router.command("健身教練")
+def reply_fitness_coaches(ctx):
+    try:
+        snapshot = get_sheet_snapshot("教練資料")
+        ctx.reply(message_templates.memoize("coaches", ("教練類型", "健身教練"), snapshot, build_coach_carousel))
+    except Exception as e:
+        logger.error(f"健身教練查詢失敗：{e}", exc_info=True)
+        ctx.reply(models.TextSendMessage(text="⚠ 查詢健身教練資料時發生錯誤"))
+
+@message_templates.register("課程教練")
+def build_course_coach_menu():
+    # 顯示分類選單（按鈕）
+    subcategories = ["有氧教練", "瑜珈老師", "游泳教練"]
+    buttons = [
+        models.MessageAction(label=sub, text=sub)
+        for sub in subcategories[:4]  # 先顯示前4個
+    ]
+    # 第二個 bubble 可加更多分類
+    template = models.TemplateSendMessage(
+        alt_text="課程教練分類",
+        template=models.ButtonsTemplate(
+            title="課程教練分類",
+            text="請選擇課程教練",
+            actions=buttons
+        )
+    )
+    return template
+
+@router.command("課程教練")
+def show_course_coach_menu(ctx):
+    ctx.reply(message_templates.get("課程教練"))
+
+@router.command("有氧教練", "瑜珈老師", "游泳教練")
+def reply_course_coaches(ctx):
+    try:
+        snapshot = get_sheet_snapshot("教練資料")
+        ctx.reply(message_templates.memoize("coaches", ("教練類別", ctx.text), snapshot, build_coach_carousel))
+
+    except Exception as e:
+        logger.error(f"課程教練查詢失敗：{e}", exc_info=True)
+        ctx.reply(models.TextSendMessage(text=f"⚠ 發生錯誤：{e}"))
+
+def build_course_type_menu(records, _):
+    # 提取唯一課程類型（依試算表中出現的順序）
+    course_types = list(dict.fromkeys(
+        row["課程類型"].strip() for row in records if row.get("課程類型")
+    ))
+    course_types = [t for t in course_types if t]
 
-            carousel = {
-                "type": "carousel",
-                "contents": bubbles
+    # 建立按鈕
+    buttons = [
+        {
+            "type": "button",
+            "style": "secondary",
+            "action": {
+                "type": "message",
+                "label": t,
+                "text": t
             }
-    
-            flex_msg = FlexSendMessage(
-                alt_text=f"{input_date} 課程查詢結果",
-                contents=carousel
-            )
-    
-            line_bot_api.reply_message(event.reply_token, flex_msg)
-    
-        except Exception as e:
-            import traceback
-            error_detail = traceback.format_exc()
-            print(f"[錯誤] 日期課程查詢錯誤：{e}\n{error_detail}")
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=f"⚠ 查詢日期課程時發生錯誤：\n{e}")
-            )
+        } for t in course_types[:6]
+    ]
 
-    else:
-            try:
-                client = get_gspread_client()
-                sheet = client.open_by_key("1jVhpPNfB6UrRaYZjCjyDR4GZApjYLL4KZXQ1Si63Zyg").worksheet("場地資料")
-                records = sheet.get_all_records()
-    
-                matched = next((row for row in records if row.get("名稱") == user_msg), None)
-    
-                if matched and matched.get("圖片1", "").startswith("https"):
-                    # (之前的 bubble 訊息程式碼)
-                    bubble = {
-                        "type": "bubble",
-                        "hero": {
-                            "type": "image",
-                            "url": matched["圖片1"],
-                            "size": "full",
-                            "aspectRatio": "20:13",
-                            "aspectMode": "cover"
-                        },
-                        "body": {
-                            "type": "box",
-                            "layout": "vertical",
-                            "spacing": "sm",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": matched["名稱"],
-                                    "weight": "bold",
-                                    "size": "xl",
-                                    "wrap": True
-                                },
-                                {
-                                    "type": "text",
-                                    "text": matched["描述"],
-                                    "size": "sm",
-                                    "wrap": True,
-                                    "color": "#666666"
-                                }
-                            ]
-                        }
+    bubble = {
+        "type": "bubble",
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {
+                    "type": "text",
+                    "text": "📚 課程內容查詢",
+                    "weight": "bold",
+                    "size": "lg",
+                    "margin": "md"
+                },
+                {
+                    "type": "box",
+                    "layout": "vertical",
+                    "spacing": "sm",
+                    "margin": "lg",
+                    "contents": buttons
+                }
+            ]
+        }
+    }
+
+    return [
+        models.FlexSendMessage(
+            alt_text="課程類型查詢",
+            contents=bubble
+        ),
+        models.TextSendMessage(text="📅 你也可以輸入日期查詢開課課程（例如：日期2025-05-01、日期2025-05-01~2025-05-07、日期本週、日期週三）。")
+    ]
+
+@router.command("課程內容")
+def show_course_types(ctx):
+    try:
+        snapshot = get_sheet_snapshot("課程資料")
+        ctx.reply(message_templates.memoize("course_types", None, snapshot, build_course_type_menu))
+
+    except Exception as e:
+        logger.error(f"課程內容查詢錯誤：{e}", exc_info=True)
+        ctx.reply(models.TextSendMessage(text="⚠ 無法讀取課程資料"))
+
+def build_course_bubble(row, size=None):
+    bubble = {
+        "type": "bubble",
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": [
+                {"type": "text", "text": row.get("課程名稱", "（未提供課程名稱）"), "weight": "bold", "size": "lg", "wrap": True},
+                {"type": "text", "text": f"👨‍🏫 教練：{row.get('教練姓名', '未知')}", "size": "sm", "wrap": True},
+                {"type": "text", "text": f"📅 開課日期：{row.get('開始日期', '未提供')}", "size": "sm"},
+                {"type": "text", "text": f"🕒 上課時間：{row.get('上課時間', '未提供')}", "size": "sm"},
+                {"type": "text", "text": f"⏱️ 時間：{row.get('時間', '未提供')}", "size": "sm"},
+                {"type": "text", "text": f"💲 價格：{row.get('課程價格', '未定')}", "size": "sm"}
+            ]
+        },
+        "footer": {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": [
+                {
+                    "type": "button",
+                    "style": "primary",
+                    "action": {
+                        "type": "uri",
+                        "label": "立即預約",
+                        "uri": BOOKING_FORM_URL
                     }
-    
-                    # 如果類型為「上課教室」，加上 footer 的立即預約按鈕
-                    if matched.get("類型") == "上課教室":
-                        bubble["footer"] = {
-                            "type": "box",
-                            "layout": "vertical",
-                            "spacing": "sm",
-                            "contents": [
-                                {
-                                    "type": "button",
-                                    "style": "primary",
-                                    "action": {
-                                        "type": "uri",
-                                        "label": "立即預約",
-                                        "uri": "https://docs.google.com/forms/d/e/1FAIpQLSct_FZcn9et_grMYECeT8xLwxaJg-AFMIUDszNusa2AG2gHMg/viewform"
-                                    }
-                                }
-                            ]
-                        }
-    
-                    flex_msg = FlexSendMessage(
-                        alt_text=f"{matched['名稱']} 詳細資訊",
-                        contents=bubble
-                    )
-                    line_bot_api.reply_message(event.reply_token, flex_msg)
-    
-                else:
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage())
-    
-            except Exception as e:
-                logger.error(f"場地詳情查詢失敗：{e}", exc_info=True)
-                pass
+                }
+            ]
+        }
+    }
+    if size:
+        bubble["size"] = size
+    return bubble
+
+def build_course_carousel(records, course_type):
+    matched = [row for row in records if row.get("課程類型", "").strip() == course_type]
+
+    if not matched:
+        return models.TextSendMessage(text=f"❌ 查無『{course_type}』相關課程")
+
+    return models.FlexSendMessage(
+        alt_text=f"{course_type} 課程內容",
+        contents={"type": "carousel", "contents": [build_course_bubble(row) for row in matched[:10]]}
+    )
+
+@router.command("有氧課程", "瑜珈課程", "游泳課程")
+def reply_courses(ctx):
+    try:
+        snapshot = get_sheet_snapshot("課程資料")
+        ctx.reply(message_templates.memoize("courses", ctx.text, snapshot, build_course_carousel))
+
+    except Exception as e:
+        logger.error(f"課程類型查詢錯誤：{e}", exc_info=True)
+        ctx.reply(
+            models.TextSendMessage(text=f"⚠ 無法查詢課程內容（錯誤：{str(e)}）")
+        )
+
+def build_date_carousel(records, query):
+    start, end, weekday, label = query
+    matched_courses = course_schedule_index.current().between(start, end, weekday)
+
+    if not matched_courses:
+        return models.TextSendMessage(text=f"❌ {label} 沒有開課資訊")
+
+    messages = [models.FlexSendMessage(
+        alt_text=f"{label} 課程查詢結果",
+        contents={
+            "type": "carousel",
+            "contents": [build_course_bubble(row, size="kilo") for row in matched_courses[:10]]
+        }
+    )]
+    if len(matched_courses) > 10:
+        messages.append(models.TextSendMessage(text=f"📅 {label} 共有 {len(matched_courses)} 堂課，以上為最早的 10 堂，可縮小日期範圍查詢。"))
+    return messages
+
+@router.prefix("日期")
+def reply_courses_by_date(ctx):
+    try:
+        query = parse_course_date_query(ctx.text)
+        if query is None:
+            ctx.reply(models.TextSendMessage(text="⚠ 請輸入正確格式的日期（例如：日期2025-05-01、日期2025-05-01~2025-05-07、日期本週、日期週三）"))
+            return
+
+        snapshot = get_sheet_snapshot("課程資料")
+        ctx.reply(message_templates.memoize("courses_by_date", query, snapshot, build_date_carousel))
+
+    except Exception as e:
+        logger.error(f"日期課程查詢錯誤：{e}", exc_info=True)
+        ctx.reply(
+            models.TextSendMessage(text=f"⚠ 查詢日期課程時發生錯誤：\n{e}")
+        )
+
+def build_venue_detail(records, name):
+    matched = venue_index.current().find(name)
+    if not matched or not matched.get("圖片1", "").startswith("https"):
+        return None
+
+    bubble = {
+        "type": "bubble",
+        "hero": {
+            "type": "image",
+            "url": matched["圖片1"],
+            "size": "full",
+            "aspectRatio": "20:13",
+            "aspectMode": "cover"
+        },
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": [
+                {
+                    "type": "text",
+                    "text": matched["名稱"],
+                    "weight": "bold",
+                    "size": "xl",
+                    "wrap": True
+                },
+                {
+                    "type": "text",
+                    "text": matched["描述"],
+                    "size": "sm",
+                    "wrap": True,
+                    "color": "#666666"
+                }
+            ]
+        }
+    }
+
+    # 如果類型為「上課教室」，加上 footer 的立即預約按鈕
+    if matched.get("類型") == "上課教室":
+        bubble["footer"] = {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": [
+                {
+                    "type": "button",
+                    "style": "primary",
+                    "action": {
+                        "type": "uri",
+                        "label": "立即預約",
+                        "uri": BOOKING_FORM_URL
+                    }
+                }
+            ]
+        }
+
+    return models.FlexSendMessage(
+        alt_text=f"{matched['名稱']} 詳細資訊",
+        contents=bubble
+    )
+
+def build_coach_detail(records, key):
+    doc = search_index.find(key)
+    if doc is None or not str(doc.row.get("圖片", "")).startswith("https"):
+        return models.TextSendMessage(text=f"⚠ 查無『{key}』的教練照片")
+    return models.FlexSendMessage(alt_text=f"{doc.title} 教練介紹", contents=build_coach_bubble(doc.row))
+
+
+def build_course_detail(records, key):
+    # 同一門課可能有多個時段，全部列出（最多 10 個）
+    matched = [row for row in records if normalize_text(row.get("課程名稱", "")) == key]
+    if not matched:
+        return models.TextSendMessage(text=f"❌ 查無『{key}』相關課程")
+    return models.FlexSendMessage(
+        alt_text=f"{matched[0].get('課程名稱', key)} 課程資訊",
+        contents={"type": "carousel", "contents": [build_course_bubble(row) for row in matched[:10]]}
+    )
+
+
+def build_search_suggestions(text, results):
+    return models.TextSendMessage(
+        text=f"🔍 找不到「{text}」，你是不是要找：",
+        quick_reply=models.QuickReply(items=[
+            # quick reply 按鈕文字最多 20 字
+            models.QuickReplyButton(action=models.MessageAction(label=doc.title[:20], text=doc.title))
+            for doc, _ in results
+        ])
+    )
+
+
+@router.fallback
+def reply_venue_detail(ctx):
+    # 依序比對：場地 / 器材名稱 → 教練、課程名稱 → 模糊搜尋建議；都找不到時不回覆
+    key = normalize_text(ctx.text)
+    if key in venue_misses:
+        # 最近查過且查不到：不讀取試算表，也不回覆
+        return
+    try:
+        snapshot = get_sheet_snapshot("場地資料")
+        if venue_index.current().find(ctx.text) is not None:
+            flex_msg = message_templates.memoize("venue", key, snapshot, build_venue_detail)
+            if flex_msg is not None:
+                ctx.reply(flex_msg)
+            return
+
+        index = search_index.current()
+        doc = index.find(ctx.text)
+        if doc is not None and doc.kind == "coach":
+            ctx.reply(message_templates.memoize("coach_detail", key, get_sheet_snapshot("教練資料"), build_coach_detail))
+            return
+        if doc is not None and doc.kind == "course":
+            ctx.reply(message_templates.memoize("course_detail", key, get_sheet_snapshot("課程資料"), build_course_detail))
+            return
+
+        results = index.search(ctx.text)
+        if not results:
+            venue_misses.add(key)
+            return
+        ctx.reply(build_search_suggestions(ctx.text.strip(), results))
+
+    except Exception as e:
+        logger.error(f"場地詳情查詢失敗：{e}", exc_info=True)
+
+
+@app.route("/admin/search", methods=["GET"])
+def search_debug():
+    # ?q=跑部機 查看模糊搜尋的排序與耗時
+    if not is_admin_request():
+        abort(403)
+    index = search_index.current()
+    query = request.args.get("q", "")
+    started = time.perf_counter()
+    results = index.search(query, k=int(request.args.get("k", SEARCH_TOP_K)), min_score=0)
+    return {
+        "query": query,
+        "us": round((time.perf_counter() - started) * 1e6, 1),
+        "results": [{"kind": doc.kind, "title": doc.title, "score": score} for doc, score in results],
+    }
+
+
+# 會員到期 / 點數提醒：由排程呼叫 POST /admin/notify/members（?dry_run=1 只列出名單）
+# 或執行 python api/linebot.py --notify-members [--dry-run]
+#   MEMBER_NOTIFY_EXPIRY_DAYS    到期前幾天內提醒（每個到期日只提醒一次）
+#   MEMBER_NOTIFY_POINTS_STEP    點數每跨過一個級距（100、200…）提醒一次
+#   MEMBER_NOTIFY_PER_MINUTE     每分鐘最多幾次 multicast
+#   MEMBER_NOTIFY_PROGRESS_PATH  已送出的提醒與點數級距，中斷後重跑不會重複送出；未設定時存在 MEMBER_BINDING_STORE_URL，
+#                                兩者都沒有設定時只能 dry run（否則每次都會重送，點數提醒也永遠不會觸發）
+#   MEMBER_LINE_ID_COLUMN        會員資料中存放 LINE userId 的欄位；沒有這欄時使用會員訂閱提醒時綁定的帳號
+LINE_MULTICAST_MAX = 500
+MEMBER_NOTIFY_EXPIRY_DAYS = int(os.getenv("MEMBER_NOTIFY_EXPIRY_DAYS", "7"))
+MEMBER_NOTIFY_POINTS_STEP = int(os.getenv("MEMBER_NOTIFY_POINTS_STEP", "100"))
+MEMBER_NOTIFY_BATCH_SIZE = min(LINE_MULTICAST_MAX, int(os.getenv("MEMBER_NOTIFY_BATCH_SIZE", "500")))
+MEMBER_NOTIFY_PER_MINUTE = float(os.getenv("MEMBER_NOTIFY_PER_MINUTE", "60"))
+MEMBER_NOTIFY_PROGRESS_PATH = os.getenv("MEMBER_NOTIFY_PROGRESS_PATH", "")
+MEMBER_LINE_ID_COLUMN = os.getenv("MEMBER_LINE_ID_COLUMN", "LINE使用者ID")
+
+
+class NotifyProgress:
+    # sent：已送出的提醒 key；tiers：每位會員上次掃描時的點數級距（用來判斷是否「跨過」門檻）
+    # 存在檔案（path）或 StateStore（store）；兩者都沒有時不保存
+    store_key = "notify:progress"
+
+    def __init__(self, path=MEMBER_NOTIFY_PROGRESS_PATH, store=None):
+        self.path = path
+        self.store = store
+        self.sent = set()
+        self.tiers = {}
+        data = None
+        if path:
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+        elif store is not None:
+            data = store.get(self.store_key)
+        if data:
+            self.sent = set(data.get("sent", []))
+            self.tiers = data.get("tiers", {})
+
+    @property
+    def persistent(self):
+        return bool(self.path) or self.store is not None
+
+    def save(self):
+        data = {"sent": sorted(self.sent), "tiers": self.tiers, "updated_at": time.time()}
+        if self.path:
+            encoded = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            atomic_write(self.path, lambda f: f.write(encoded))
+        elif self.store is not None:
+            self.store.set(self.store_key, data, ttl=MEMBER_BINDING_TTL)
+
+
+def build_member_notice(kind, value, today):
+    if kind == "expiry":
+        expiry = today + timedelta(days=value)
+        when = "今天" if value == 0 else f"{value} 天後（{expiry.isoformat()}）"
+        text = f"⏳ 提醒您：您的會員資格將於{when}到期，續約請洽櫃台，或預約專人協助：\n{BOOKING_FORM_URL}"
+    else:
+        text = f"🎯 恭喜！您的會員點數已累積超過 {value * MEMBER_NOTIFY_POINTS_STEP} 點，歡迎到櫃台兌換好禮。"
+    return models.TextSendMessage(text=text)
+
+
+def plan_member_notifications(records, progress, today):
+    # 掃描會員表一次，依訊息內容分組：{(kind, 值): [(會員編號, LINE userId, 提醒 key), ...]}
+    # 同一組的訊息完全相同，才能用 multicast 一次送給多人
+    today_ordinal = today.toordinal()
+    groups = {}
+    seen = set()
+    tiers = {}
+    for member_id, line_id, expiry, points in zip(
+        records.column("會員編號"),
+        records.column(MEMBER_LINE_ID_COLUMN),
+        records.column("會員到期日", "date"),
+        records.column("會員點數", "int"),
+    ):
+        member_id = normalize_member_id(member_id)
+        if not member_id:
+            continue
+        line_id = str(line_id).strip()
+        if expiry and 0 <= expiry - today_ordinal <= MEMBER_NOTIFY_EXPIRY_DAYS:
+            key = f"expiry:{member_id}:{expiry}"
+            seen.add(key)
+            groups.setdefault(("expiry", expiry - today_ordinal), []).append((member_id, line_id, key))
+        if points != INT_MISSING and MEMBER_NOTIFY_POINTS_STEP > 0:
+            tier = max(points, 0) // MEMBER_NOTIFY_POINTS_STEP
+            previous = progress.tiers.get(member_id)
+            tiers[member_id] = tier
+            # 第一次看到的會員只記錄目前級距，不提醒
+            if previous is not None and tier > previous:
+                key = f"points:{member_id}:{tier}"
+                seen.add(key)
+                groups.setdefault(("points", tier), []).append((member_id, line_id, key))
+    return groups, seen, tiers
+
+
+class MemberNotifier:
+    def __init__(self, per_minute=MEMBER_NOTIFY_PER_MINUTE, batch_size=MEMBER_NOTIFY_BATCH_SIZE,
+                 progress_path=MEMBER_NOTIFY_PROGRESS_PATH):
+        self.limiter = TokenBucket(per_minute, burst=1)
+        self.batch_size = batch_size
+        self.progress_path = progress_path
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def run(self, dry_run=False, today=None):
+        # 同一時間只允許一個執行；回傳 None 表示已有執行中的工作
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            summary = self._run(dry_run, today or local_today())
+            self.last_run = summary
+            return summary
+        finally:
+            self._lock.release()
+
+    def _run(self, dry_run, today):
+        started = time.perf_counter()
+        progress = NotifyProgress(self.progress_path, member_bindings)
+        if not dry_run and not progress.persistent:
+            logger.error("會員提醒：未設定 MEMBER_NOTIFY_PROGRESS_PATH 或 MEMBER_BINDING_STORE_URL，無法保存進度，不送出")
+            return {"dry_run": dry_run, "error": "not_configured"}
+        records = get_sheet_snapshot("會員資料").records
+        groups, seen, tiers = plan_member_notifications(records, progress, today)
+        summary = {
+            "dry_run": dry_run, "today": today.isoformat(), "scanned": len(records),
+            "groups": [], "batches": 0, "sent": 0, "already_sent": 0, "unreachable": 0, "error": None,
+        }
+        # 試算表沒有 LINE userId 的會員，一次查出訂閱提醒時綁定的帳號
+        unbound = {member_id for members in groups.values() for member_id, line_id, _ in members if not line_id}
+        bindings = {}
+        if unbound and member_bindings is not None:
+            bindings = member_bindings.get_many(member_binding_key(member_id) for member_id in unbound)
+
+        for (kind, value), members in sorted(groups.items()):
+            targets = {}
+            for member_id, line_id, key in members:
+                if key in progress.sent:
+                    summary["already_sent"] += 1
+                    continue
+                user_id = line_id or bindings.get(member_binding_key(member_id))
+                if not user_id:
+                    summary["unreachable"] += 1
+                    continue
+                # 同一個 LINE 帳號綁定多位會員時只送一次
+                targets.setdefault(user_id, []).append(key)
+            summary["groups"].append({"kind": kind, "value": value, "members": len(members), "recipients": len(targets)})
+            if dry_run or not targets:
+                continue
+            message = encode_message(build_member_notice(kind, value, today))
+            user_ids = list(targets)
+            for i in range(0, len(user_ids), self.batch_size):
+                batch = user_ids[i:i + self.batch_size]
+                self.limiter.acquire(timeout=3600)
+                try:
+                    send_multicast(batch, message)
+                except Exception as e:
+                    # 已送出的批次都記錄在進度檔，修正後重跑會從這裡繼續
+                    logger.error(f"會員提醒 multicast 失敗：{e}", exc_info=True)
+                    summary["error"] = str(e)
+                    break
+                for user_id in batch:
+                    progress.sent.update(targets[user_id])
+                progress.save()
+                summary["batches"] += 1
+                summary["sent"] += len(batch)
+            if summary["error"]:
+                break
+
+        if not dry_run and not summary["error"]:
+            # 完整跑完才更新點數級距；進度檔只保留這次仍在提醒範圍內的 key
+            progress.sent &= seen
+            progress.tiers = tiers
+            progress.save()
+        summary["ms"] = round((time.perf_counter() - started) * 1000, 2)
+        logger.info(f"會員提醒：{json.dumps(summary, ensure_ascii=False)}")
+        return summary
+
+
+member_notifier = MemberNotifier()
+
+
+@app.route("/admin/notify/members", methods=["GET", "POST"])
+def notify_members():
+    # GET 查看上次執行結果；POST 執行（?dry_run=1 只計算名單不送出）
+    if not is_admin_request():
+        abort(403)
+    if request.method == "GET":
+        return {"last_run": member_notifier.last_run}
+    summary = member_notifier.run(dry_run=request.args.get("dry_run") == "1")
+    if summary is None:
+        return {"error": "已有會員提醒正在執行"}, 409
+    if summary["error"] == "not_configured":
+        return {"error": "未設定 MEMBER_NOTIFY_PROGRESS_PATH 或 MEMBER_BINDING_STORE_URL，只能 dry run"}, 503
+    return summary
+
+
+# 冷啟動：
+#   SHEETS_PRELOAD=1             背景執行緒先下載所有工作表、建立索引，第一個使用者不必等 Google Sheets
+#   MESSAGE_TEMPLATES_PRELOAD=1  啟動就先建立所有靜態選單，否則在第一次使用時才建立
+#   有本地快照檔時先載入快照，背景再重新下載一次（不論 SHEETS_PRELOAD）
+SHEETS_PRELOAD = os.getenv("SHEETS_PRELOAD", "0") == "1"
+startup_status = {"preload": "disabled" if not SHEETS_PRELOAD else "pending", "preload_ms": None}
+
+
+def preload_sheets(revalidate=False):
+    started = time.perf_counter()
+    startup_status["preload"] = "running"
+    try:
+        if revalidate:
+            sheet_cache.publish_many(SPREADSHEET_ID, fetch_all_sheets(SPREADSHEET_ID))
+        else:
+            sheet_cache.warm(SPREADSHEET_ID)
+        member_index.current()
+        fitness_log_index.current()
+        course_schedule_index.current()
+        venue_index.current()
+        message_templates.preload()
+        startup_status["preload"] = "done"
+    except Exception as e:
+        startup_status["preload"] = "failed"
+        logger.error(f"背景預先載入工作表失敗：{e}", exc_info=True)
+    startup_status["preload_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def import_time_report(limit=20):
+    # 用 python -X importtime 在子行程重新載入本模組，列出累計耗時最多的 import
+    env = dict(os.environ, SHEETS_PRELOAD="0", MESSAGE_TEMPLATES_PRELOAD="0", WEBHOOK_ASYNC="0", SHEETS_SNAPSHOT_PATH="")
+    code = (
+        "import importlib.util; "
+        f"spec = importlib.util.spec_from_file_location('linebot_cold_start', {os.path.abspath(__file__)!r}); "
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True, timeout=120
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        name = parts[2][1:].rstrip()
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_ms": round(int(parts[0]) / 1000, 2),
+            "cumulative_ms": round(int(parts[1]) / 1000, 2),
+        })
+    # 只看最外層的 import，累計時間已包含它底下的子模組
+    top_level = [m for m in modules if m["depth"] == 0]
+    top_level.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return {
+        "returncode": result.returncode,
+        "total_ms": round(sum(m["cumulative_ms"] for m in top_level), 2),
+        "modules": top_level[:limit],
+    }
+
+
+@app.route("/admin/startup", methods=["GET"])
+def startup_stats():
+    # ?importtime=1 另外跑一次 python -X importtime（需要數秒）
+    if not is_admin_request():
+        abort(403)
+    stats = {
+        "module_load_ms": MODULE_LOAD_MS,
+        "lazy_imports": IMPORT_TIMINGS,
+        "snapshot_restored": snapshot_file.restored if snapshot_file else None,
+        **startup_status,
+    }
+    if request.args.get("importtime") == "1":
+        stats["import_report"] = import_time_report(int(request.args.get("limit", "20")))
+    return stats
+
+
+if os.getenv("MESSAGE_TEMPLATES_PRELOAD", "0") == "1":
+    message_templates.preload()
+
+sheets_restored = snapshot_file is not None and snapshot_file.restore()
+if SHEETS_PRELOAD or sheets_restored:
+    threading.Thread(target=preload_sheets, args=(sheets_restored,), name="sheets-preload", daemon=True).start()
+
+MODULE_LOAD_MS = round((time.perf_counter() - _module_started) * 1000, 2)
 
 if __name__ == "__main__":
-    app.run()
+    if "--notify-members" in sys.argv:
+        # python api/linebot.py --notify-members [--dry-run]
+        print(json.dumps(member_notifier.run(dry_run="--dry-run" in sys.argv), ensure_ascii=False, indent=2))
+    elif "--import-report" in sys.argv:
+        # python api/linebot.py --import-report：列出冷啟動時最花時間的模組
+        report = import_time_report()
+        print(f"本模組載入 {MODULE_LOAD_MS} ms，子行程 import 合計 {report['total_ms']} ms")
+        for m in report["modules"]:
+            print(f"{m['cumulative_ms']:>10.2f} ms  {m['self_ms']:>9.2f} ms  {m['module']}")
+    else:
+        app.run()
@@ -0,0 +1,304 @@
+# webhook 壓力測試：產生帶正確 X-Line-Signature 的事件，依指定並行數重播，
+# 統計各指令的吞吐量與延遲百分位數，結果存成 JSON 方便不同版本比較
+#
+#   # 在同一個 process 內直接呼叫 Flask app（自動使用 fake Sheets / LINE）
+#   python scripts/bench_webhook.py --inprocess --concurrency 8 --rounds 50 --output bench.json
+#
+#   # 對執行中的服務送 HTTP request（服務端需設定相同的 LINE_CHANNEL_SECRET）
+#   python scripts/bench_webhook.py --url http://127.0.0.1:5000/webhook --secret xxx --duration 30
+#
+#   # 與之前的結果比較，p99 變慢超過 20% 時回傳非 0
+#   python scripts/bench_webhook.py --inprocess --compare bench.json --max-regression 0.2
+import argparse
+import base64
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_FIXTURES = os.path.join(ROOT, "fixtures", "sheets")
+
+
+def load_table(fixtures_dir, name, limit=50):
+    path = os.path.join(fixtures_dir, f"{name}.json")
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        values = json.load(f)
+    if values and isinstance(values[0], dict):
+        return values[:limit]
+    header = values[0]
+    return [dict(zip(header, row)) for row in values[1:limit + 1]]
+
+
+def build_scenarios(fixtures_dir):
+    # 每個情境是同一位使用者依序送出的訊息；最後一則訊息的延遲記在該情境名稱下
+    members = load_table(fixtures_dir, "會員資料") or [{"會員編號": "A00001", "姓名": "熊享瘦", "電話": "0912345678"}]
+    venues = [row["名稱"] for row in load_table(fixtures_dir, "場地資料") if row.get("名稱")] or ["跑步機"]
+    courses = load_table(fixtures_dir, "課程資料")
+    dates = sorted({row["開始日期"] for row in courses if row.get("開始日期")}) or ["2025-05-01"]
+
+    def phone(row):
+        value = str(row["電話"])
+        return value if value.startswith("0") else "0" + value
+
+    scenarios = {
+        "會員專區": lambda: ["會員專區"],
+        "會員編號查詢": lambda: (lambda m: ["查詢會員資料", m["會員編號"]])(random.choice(members)),
+        "姓名電話查詢": lambda: (lambda m: ["查詢會員資料", f"{m['姓名']}{phone(m)}"])(random.choice(members)),
+        "查詢健身紀錄": lambda: (lambda m: ["查詢健身紀錄", f"{m['姓名']}{phone(m)}"])(random.choice(members)),
+        "健身紀錄選單": lambda: ["健身紀錄"],
+        "常見問題": lambda: ["常見問題"],
+        "常見問題分類": lambda: [random.choice(["準備運動", "會員方案", "個人教練課程", "團體課程", "其他"])],
+        "更多功能": lambda: ["更多功能"],
+        "器材分類": lambda: [random.choice(["心肺訓練", "背部訓練", "腿部訓練", "自由重量器材"])],
+        "上課教室": lambda: ["上課教室"],
+        "健身教練": lambda: ["健身教練"],
+        "課程教練": lambda: [random.choice(["有氧教練", "瑜珈老師", "游泳教練"])],
+        "課程內容": lambda: ["課程內容"],
+        "課程類型": lambda: [random.choice(["有氧課程", "瑜珈課程", "游泳課程"])],
+        "日期查詢": lambda: [f"日期{random.choice(dates)}"],
+        "場地名稱": lambda: [random.choice(venues)],
+        "閒聊": lambda: [random.choice(["你好", "謝謝", "哈哈", "請問營業時間", "👍"])],
+    }
+    return scenarios
+
+
+def make_body(user_id, texts):
+    now = int(time.time() * 1000)
+    events = [
+        {
+            "type": "message",
+            "mode": "active",
+            "timestamp": now,
+            "source": {"type": "user", "userId": user_id},
+            "webhookEventId": uuid.uuid4().hex.upper(),
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": uuid.uuid4().hex,
+            "message": {"id": str(random.randint(10 ** 13, 10 ** 14)), "type": "text", "quoteToken": uuid.uuid4().hex, "text": text},
+        }
+        for text in texts
+    ]
+    return json.dumps({"destination": "U" + "0" * 32, "events": events}, ensure_ascii=False).encode("utf-8")
+
+
+def sign(secret, body):
+    return base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode("ascii")
+
+
+class HttpTarget:
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+
+    def post(self, body, signature):
+        req = urllib.request.Request(
+            self.url, data=body, method="POST",
+            headers={"Content-Type": "application/json", "X-Line-Signature": signature},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class InProcessTarget:
+    # 直接載入 api/linebot.py，用 Flask test client 呼叫，不經過網路
+    def __init__(self):
+        spec = importlib.util.spec_from_file_location("linebot_app", os.path.join(ROOT, "api", "linebot.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.module = module
+        self.local = threading.local()
+
+    def post(self, body, signature):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.module.app.test_client()
+        resp = client.post(
+            "/webhook", data=body,
+            headers={"Content-Type": "application/json", "X-Line-Signature": signature},
+        )
+        return resp.status_code
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(samples, errors, elapsed):
+    commands = {}
+    for name in sorted(set(samples) | set(errors)):
+        values = sorted(samples.get(name, []))
+        commands[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "throughput": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p90_ms": round(percentile(values, 0.90) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        }
+    everything = sorted(v for values in samples.values() for v in values)
+    total = {
+        "count": len(everything),
+        "errors": sum(errors.values()),
+        "throughput": round(len(everything) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(everything, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 3),
+        "max_ms": round(everything[-1] * 1000, 3) if everything else 0.0,
+    }
+    return commands, total
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(result, baseline_path, max_regression):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\n與 {baseline_path}（{baseline.get('commit') or '未知版本'}）比較 p99：")
+    for name, current in sorted(result["commands"].items()):
+        before = baseline.get("commands", {}).get(name)
+        if not before or not before["p99_ms"]:
+            continue
+        change = (current["p99_ms"] - before["p99_ms"]) / before["p99_ms"]
+        flag = " ⚠" if change > max_regression else ""
+        print(f"  {name:<10} {before['p99_ms']:>9.2f} → {current['p99_ms']:>9.2f} ms ({change:+.0%}){flag}")
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE webhook 壓力測試")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="webhook 網址，例如 http://127.0.0.1:5000/webhook")
+    target.add_argument("--inprocess", action="store_true", help="在同一個 process 內呼叫 Flask app")
+    parser.add_argument("--secret", default=os.getenv("LINE_CHANNEL_SECRET", "bench-secret"))
+    parser.add_argument("--fixtures", default=os.getenv("SHEETS_FIXTURES_DIR", DEFAULT_FIXTURES))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=20, help="每個情境重播的次數（未指定 --duration 時）")
+    parser.add_argument("--duration", type=float, help="持續送出的秒數，取代 --rounds")
+    parser.add_argument("--commands", help="只測試這些情境，以逗號分隔")
+    parser.add_argument("--events-per-body", type=int, default=1, help="一個 webhook body 內放幾個事件（模擬尖峰）")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="結果輸出的 JSON 檔")
+    parser.add_argument("--compare", help="要比較的舊結果 JSON 檔")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.inprocess:
+        # 在載入 app 前設定好環境：本地替身，不連外
+        os.environ.setdefault("SHEETS_BACKEND", "fake")
+        os.environ.setdefault("LINE_BACKEND", "fake")
+        os.environ.setdefault("SHEETS_FIXTURES_DIR", args.fixtures)
+        os.environ["LINE_CHANNEL_SECRET"] = args.secret
+        client = InProcessTarget()
+    else:
+        client = HttpTarget(args.url, args.timeout)
+
+    scenarios = build_scenarios(args.fixtures)
+    if args.commands:
+        wanted = [name.strip() for name in args.commands.split(",")]
+        scenarios = {name: scenarios[name] for name in wanted}
+
+    samples = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def run(name, worker_id):
+        user_id = f"U{worker_id:08x}{uuid.uuid4().hex[:24]}"
+        texts = scenarios[name]()
+        elapsed = 0.0
+        ok = True
+        # 多步驟情境需依序送出；最後一步的延遲最能代表該指令
+        for text in texts:
+            body = make_body(user_id, [text] * args.events_per_body)
+            started = time.perf_counter()
+            status = client.post(body, sign(args.secret, body))
+            elapsed = time.perf_counter() - started
+            ok = ok and status == 200
+        with lock:
+            if ok:
+                samples.setdefault(name, []).append(elapsed)
+            else:
+                errors[name] = errors.get(name, 0) + 1
+
+    names = list(scenarios)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        if args.duration:
+            deadline = started + args.duration
+
+            def loop(worker_id):
+                while time.perf_counter() < deadline:
+                    run(random.choice(names), worker_id)
+
+            list(pool.map(loop, range(args.concurrency)))
+        else:
+            jobs = [name for name in names for _ in range(args.rounds)]
+            random.shuffle(jobs)
+            list(pool.map(lambda item: run(item[1], item[0] % args.concurrency), enumerate(jobs)))
+    elapsed = time.perf_counter() - started
+
+    commands, total = summarize(samples, errors, elapsed)
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "target": args.url or "inprocess",
+        "concurrency": args.concurrency,
+        "events_per_body": args.events_per_body,
+        "elapsed_s": round(elapsed, 3),
+        "total": total,
+        "commands": commands,
+    }
+
+    print(f"{'指令':<10} {'次數':>6} {'錯誤':>4} {'req/s':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, row in commands.items():
+        print(f"{name:<10} {row['count']:>6} {row['errors']:>4} {row['throughput']:>8.1f} "
+              f"{row['p50_ms']:>9.2f} {row['p90_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['max_ms']:>9.2f}")
+    print(f"{'全部':<10} {total['count']:>6} {total['errors']:>4} {total['throughput']:>8.1f} "
+          f"{total['p50_ms']:>9.2f} {total['p90_ms']:>9.2f} {total['p99_ms']:>9.2f} {total['max_ms']:>9.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入 {args.output}")
+
+    if args.compare:
+        regressions = compare(result, args.compare, args.max_regression)
+        if regressions:
+            print(f"\n以下指令 p99 變慢超過 {args.max_regression:.0%}：{', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# 產生大量的本地試算表資料，讓 SHEETS_BACKEND=fake 可以模擬正式環境的資料量
+#
+#   python scripts/make_fixtures.py --members 30000 --workouts 300000 --out /tmp/l16_fixtures
+#   SHEETS_BACKEND=fake SHEETS_FIXTURES_DIR=/tmp/l16_fixtures LINE_BACKEND=fake python api/linebot.py
+import argparse
+import json
+import os
+import random
+import shutil
+from datetime import date, timedelta
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fixtures", "sheets")
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾"
+GIVEN = "小明美玲志豪怡君家豪淑芬俊傑雅婷冠宇佳穎"
+EXERCISES = ["跑步機", "飛輪", "深蹲", "臥推", "硬舉", "游泳", "瑜珈", "划船機"]
+MEMBER_TYPES = ["月費會員", "季費會員", "年費會員"]
+
+
+def member_name(i):
+    return SURNAMES[i % len(SURNAMES)] + GIVEN[(i // 3) % len(GIVEN)] + GIVEN[(i // 7) % len(GIVEN)]
+
+
+def member_phone(i):
+    return f"09{i:08d}"
+
+
+def write_table(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="產生壓力測試用的試算表資料")
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--workouts", type=int, default=100000)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--seed", type=int, default=16)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    # 靜態工作表（常見問題、場地、教練、課程）直接沿用內建的 fixtures
+    for name in ("常見問題", "場地資料", "教練資料", "課程資料"):
+        shutil.copy(os.path.join(FIXTURES_DIR, f"{name}.json"), os.path.join(args.out, f"{name}.json"))
+
+    today = date.today()
+    members = [["會員編號", "姓名", "電話", "會員類型", "會員狀態", "會員點數", "會員到期日"]]
+    for i in range(1, args.members + 1):
+        expiry = today + timedelta(days=rng.randint(-60, 365))
+        members.append([
+            f"A{i:05d}" if i < 100000 else f"B{i % 100000:05d}",
+            member_name(i),
+            member_phone(i),
+            rng.choice(MEMBER_TYPES),
+            "有效" if expiry >= today else "已過期",
+            str(rng.randint(0, 500)),
+            expiry.isoformat(),
+        ])
+    write_table(os.path.join(args.out, "會員資料.json"), members)
+
+    workouts = [["日期", "紀錄姓名", "紀錄電話", "運動項目", "時長", "備註"]]
+    start = today - timedelta(days=365)
+    for _ in range(args.workouts):
+        i = rng.randint(1, max(1, args.members))
+        workouts.append([
+            (start + timedelta(days=rng.randint(0, 365))).isoformat(),
+            member_name(i),
+            member_phone(i),
+            rng.choice(EXERCISES),
+            str(rng.choice([20, 30, 45, 60, 90])),
+            "",
+        ])
+    write_table(os.path.join(args.out, "會員健身紀錄.json"), workouts)
+    print(f"已產生 {args.members} 位會員、{args.workouts} 筆健身紀錄到 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# api/linebot.py 與 line-bot-sdk 的套件同名，以檔案路徑載入成 linebot_app，並改用本地資料，不連線到 Google / LINE
+import importlib.util
+import os
+
+import pytest
+
+API_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "linebot.py")
+TEST_ENV = {
+    "SHEETS_BACKEND": "fake",
+    "LINE_BACKEND": "fake",
+    "SHEETS_SNAPSHOT_PATH": "",
+    "SHEETS_PRELOAD": "0",
+    "MESSAGE_TEMPLATES_PRELOAD": "0",
+    "WEBHOOK_ASYNC": "0",
+    "WEBHOOK_LOG_SAMPLE": "0",
+    "STATE_STORE_URL": "memory://",
+    "MEMBER_BINDING_STORE_URL": "",
+    # 共用的 Google Sheets 限流器不要拖慢測試
+    "SHEETS_RATE_PER_MINUTE": "60000",
+    "SHEETS_RATE_BURST": "1000",
+}
+
+
+@pytest.fixture(scope="session")
+def app():
+    pytest.importorskip("flask")
+    pytest.importorskip("gspread")
+    os.environ.update(TEST_ENV)
+    spec = importlib.util.spec_from_file_location("linebot_app", API_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
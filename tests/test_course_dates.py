@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+# 2025-05-07 是星期三
+TODAY = date(2025, 5, 7)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("日期2025-05-01", (date(2025, 5, 1), date(2025, 5, 1), None, "2025-05-01")),
+    ("日期2025/5/1", (date(2025, 5, 1), date(2025, 5, 1), None, "2025-05-01")),
+    ("日期2025-05-01~2025-05-07", (date(2025, 5, 1), date(2025, 5, 7), None, "2025-05-01 ~ 2025-05-07")),
+    ("日期 2025-05-07 ~ 2025-05-01", (date(2025, 5, 1), date(2025, 5, 7), None, "2025-05-01 ~ 2025-05-07")),
+    ("日期本週", (date(2025, 5, 5), date(2025, 5, 11), None, "本週")),
+    ("日期這周", (date(2025, 5, 5), date(2025, 5, 11), None, "本週")),
+    ("日期下週", (date(2025, 5, 12), date(2025, 5, 18), None, "下週")),
+])
+def test_dates_and_ranges(app, text, expected):
+    assert app.parse_course_date_query(text, TODAY) == expected
+
+
+@pytest.mark.parametrize("text, weekday, label", [
+    ("日期週三", 2, "星期三"),
+    ("日期周一", 0, "星期一"),
+    ("日期星期日", 6, "星期日"),
+    ("日期禮拜天", 6, "星期天"),
+])
+def test_weekdays_cover_the_next_weeks(app, text, weekday, label):
+    start, end, parsed_weekday, parsed_label = app.parse_course_date_query(text, TODAY)
+
+    assert (start, parsed_weekday, parsed_label) == (TODAY, weekday, label)
+    assert (end - start).days == app.COURSE_WEEKDAY_WEEKS * 7 - 1
+
+
+@pytest.mark.parametrize("text", ["日期", "日期明天", "日期2025-02-30", "日期週八"])
+def test_invalid_queries(app, text):
+    assert app.parse_course_date_query(text, TODAY) is None
+
+
+def test_week_on_sunday_starts_on_monday(app):
+    start, end, _, _ = app.parse_course_date_query("日期本週", date(2025, 5, 11))
+
+    assert (start, end) == (date(2025, 5, 5), date(2025, 5, 11))
+
+
+def course_table(app, dates):
+    return app.SheetTable.from_rows(
+        ["課程名稱", "開始日期"], [[f"課{i}", d] for i, d in enumerate(dates)], {"開始日期": "date"}
+    )
+
+
+def names(rows):
+    return [row["課程名稱"] for row in rows]
+
+
+def test_schedule_rebuild_and_extend_agree(app):
+    dates = ["2025-05-07", "2025-05-01", "", "2025-05-14", "2025-05-07", "2025-05-03"]
+    table = course_table(app, dates)
+    rebuilt = app.CourseScheduleIndex()
+    rebuilt.rebuild(table)
+    extended = app.CourseScheduleIndex()
+    extended.rebuild(course_table(app, dates[:3]))
+    extended.extend(table, 3)
+
+    for index in (rebuilt, extended):
+        assert names(index.between(date(2025, 5, 1), date(2025, 5, 31))) == ["課1", "課5", "課0", "課4", "課3"]
+        assert names(index.between(date(2025, 5, 1), date(2025, 5, 31), weekday=2)) == ["課0", "課4", "課3"]
+        assert names(index.between(date(2025, 5, 2), date(2025, 5, 6))) == ["課5"]
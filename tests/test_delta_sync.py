@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+HEADER = ["日期", "紀錄姓名", "時長"]
+
+
+@pytest.fixture
+def loader(app, tmp_path):
+    with open(tmp_path / "紀錄.json", "w", encoding="utf-8") as f:
+        json.dump([HEADER, ["2025-05-01", "王", "30"], ["2025-05-02", "李", "45"]], f, ensure_ascii=False)
+    loader = app.SpreadsheetLoader("test", sheet_names=("紀錄",), append_only=("紀錄",))
+    loader._spreadsheet = app.FakeSpreadsheet(str(tmp_path))
+    return loader
+
+
+def rows(records):
+    return [[row["日期"], row["紀錄姓名"], row["時長"]] for row in records]
+
+
+def test_appended_rows_are_fetched_as_delta(loader):
+    first = loader.fetch("紀錄")
+    loader._spreadsheet.sheets["紀錄"].append(["2025-05-03", "陳", "60"])
+
+    second = loader.fetch("紀錄")
+
+    assert loader.delta_counts == {"full": 1, "delta": 1, "delta_rows": 1, "mismatch": 0}
+    assert rows(second) == [["2025-05-01", "王", 30], ["2025-05-02", "李", 45], ["2025-05-03", "陳", 60]]
+    assert second.startswith(first)
+    assert len(first) == 2
+
+
+def test_no_new_rows_returns_the_same_table(loader):
+    first = loader.fetch("紀錄")
+
+    assert loader.fetch("紀錄") is first
+    assert loader.delta_counts["delta"] == 1
+
+
+def test_edited_last_row_falls_back_to_full_reload(loader):
+    loader.fetch("紀錄")
+    loader._spreadsheet.sheets["紀錄"][2] = ["2025-05-02", "李", "50"]
+    loader._spreadsheet.sheets["紀錄"].append(["2025-05-03", "陳", "60"])
+
+    records = loader.fetch("紀錄")
+
+    assert loader.delta_counts["mismatch"] == 1
+    assert loader.delta_counts["full"] == 2
+    assert rows(records) == [["2025-05-01", "王", 30], ["2025-05-02", "李", 50], ["2025-05-03", "陳", 60]]
+
+
+def test_deleted_rows_fall_back_to_full_reload(loader):
+    loader.fetch("紀錄")
+    del loader._spreadsheet.sheets["紀錄"][1]
+
+    records = loader.fetch("紀錄")
+
+    assert loader.delta_counts["mismatch"] == 1
+    assert rows(records) == [["2025-05-02", "李", 45]]
+
+
+def test_changed_header_falls_back_to_full_reload(loader):
+    loader.fetch("紀錄")
+    loader._spreadsheet.sheets["紀錄"][0] = ["日期", "姓名", "時長"]
+
+    records = loader.fetch("紀錄")
+
+    assert loader.delta_counts["mismatch"] == 1
+    assert records[0]["姓名"] == "王"
+
+
+def test_invalidate_forces_full_reload_after_middle_row_edit(loader):
+    loader.fetch("紀錄")
+    loader._spreadsheet.sheets["紀錄"][1] = ["2025-05-01", "王", "35"]
+
+    assert rows(loader.fetch("紀錄"))[0] == ["2025-05-01", "王", 30]
+    loader.invalidate("紀錄")
+
+    assert rows(loader.fetch("紀錄"))[0] == ["2025-05-01", "王", 35]
+    assert loader.delta_counts["full"] == 2
+
+
+def test_empty_sheet_is_not_fetched_as_delta(loader, monkeypatch):
+    loader._spreadsheet.sheets["紀錄"] = []
+    assert list(loader.fetch("紀錄")) == []
+    monkeypatch.setattr(loader, "fetch_delta", lambda *args: pytest.fail("空表不應走增量讀取"))
+    loader._spreadsheet.sheets["紀錄"] = [HEADER, ["2025-05-01", "王", "30"]]
+
+    assert rows(loader.fetch("紀錄")) == [["2025-05-01", "王", 30]]
+
+
+class RangeError(Exception):
+    code = 400
+
+
+def test_range_error_falls_back_to_full_reload(loader, monkeypatch):
+    loader.fetch("紀錄")
+    loader._spreadsheet.sheets["紀錄"].append(["2025-05-03", "陳", "60"])
+
+    def values_batch_get(ranges, params=None):
+        raise RangeError("Unable to parse range")
+
+    monkeypatch.setattr(loader._spreadsheet, "values_batch_get", values_batch_get)
+
+    assert len(loader.fetch("紀錄")) == 3
+    assert loader.delta_counts["mismatch"] == 1
+    assert loader.delta_counts["full"] == 2
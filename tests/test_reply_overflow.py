@@ -0,0 +1,63 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def sent(app, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app, "send_reply", lambda token, messages: sent.append(("reply", token, messages)))
+    monkeypatch.setattr(app, "send_push", lambda to, messages: sent.append(("push", to, messages)))
+    return sent
+
+
+def group_event(text, reply_token="tok"):
+    source = SimpleNamespace(type="group", user_id="U1", group_id="G1", room_id=None)
+    return SimpleNamespace(source=source, message=SimpleNamespace(text=text), reply_token=reply_token)
+
+
+def texts(app, count):
+    return [app.models.TextSendMessage(text=f"m{i}") for i in range(count)]
+
+
+def test_chat_id_prefers_group_then_room(app):
+    assert app.event_chat_id(group_event("")) == "G1"
+    room = SimpleNamespace(source=SimpleNamespace(user_id="U1", room_id="R1"))
+    assert app.event_chat_id(room) == "R1"
+    assert app.event_chat_id(SimpleNamespace(source=SimpleNamespace(user_id="U1"))) == "U1"
+
+
+def test_overflow_is_pushed_to_the_group(app, sent, monkeypatch):
+    monkeypatch.setattr(app, "REPLY_OVERFLOW", "push")
+    composer = app.ReplyComposer("tok", app.event_chat_id(group_event("")))
+    composer.add(texts(app, 7))
+
+    assert composer.flush() == 2
+    assert [(kind, target, len(messages)) for kind, target, messages in sent] == [("reply", "tok", 5), ("push", "G1", 2)]
+
+
+def test_more_pages_are_kept_per_chat(app, sent, monkeypatch):
+    monkeypatch.setattr(app, "REPLY_OVERFLOW", "more")
+    composer = app.ReplyComposer("tok", "G1")
+    composer.add(texts(app, 7))
+    composer.flush()
+
+    assert app.pending_replies.get(app.pending_reply_key("U1")) is None
+    app.handle_message(group_event(app.REPLY_MORE_TEXT, "tok2"))
+
+    assert sent[-1][1] == "tok2"
+    assert len(sent[-1][2]) == 3
+    assert app.pending_replies.get(app.pending_reply_key("G1")) is None
+
+
+def test_dispatch_time_includes_the_reply_call(app, monkeypatch):
+    def total():
+        return sum(series[1] for series in app.DISPATCH_SECONDS._series.values())
+
+    monkeypatch.setattr(app, "send_reply", lambda token, messages: time.sleep(0.05))
+    before = total()
+
+    app.handle_message(group_event("常見問題"))
+
+    assert total() - before >= 0.05
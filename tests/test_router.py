@@ -0,0 +1,89 @@
+import types
+
+import pytest
+
+
+def ctx(text, state=None):
+    return types.SimpleNamespace(text=text, state=state, match=None, route=None)
+
+
+@pytest.fixture
+def router(app):
+    router = app.CommandRouter()
+
+    @router.state("awaiting_name")
+    def on_name(ctx):
+        return "state"
+
+    @router.command("會員專區")
+    def on_menu(ctx):
+        return "exact"
+
+    @router.command("健身教練", "課程教練")
+    def on_coach(ctx):
+        return "keywords"
+
+    @router.prefix("日期")
+    def on_date(ctx):
+        return "prefix"
+
+    @router.regex(r"^(?P<id>[A-Z])(?P<number>\d{5})$")
+    def on_member_id(ctx):
+        return ctx.match.group("number")
+
+    @router.fallback
+    def on_other(ctx):
+        return "fallback"
+
+    return router
+
+
+@pytest.mark.parametrize("text, state, expected", [
+    ("會員專區", "awaiting_name", "state"),
+    ("會員專區", "unknown_state", "exact"),
+    ("會員專區", None, "exact"),
+    ("課程教練", None, "keywords"),
+    ("日期本週", None, "prefix"),
+    ("A00001", None, "00001"),
+    ("A0001", None, "fallback"),
+    ("你好", None, "fallback"),
+])
+def test_dispatch_order(router, text, state, expected):
+    context = ctx(text, state)
+
+    assert router.dispatch(context) == expected
+    assert context.route is not None
+
+
+def test_regex_match_is_from_the_route_itself(router):
+    route, match = router.resolve("B12345")
+
+    assert route.name == "on_member_id"
+    assert match.groupdict() == {"id": "B", "number": "12345"}
+
+
+def test_same_group_name_in_two_routes(app):
+    router = app.CommandRouter()
+    router.regex(r"^更多(?P<page>\d+)$")(lambda ctx: ("more", ctx.match.group("page")))
+    router.regex(r"^第(?P<page>\d+)頁$")(lambda ctx: ("page", ctx.match.group("page")))
+
+    assert router.dispatch(ctx("更多2")) == ("more", "2")
+    assert router.dispatch(ctx("第3頁")) == ("page", "3")
+
+
+def test_backreference_routes_fall_back_to_sequential_matching(app):
+    router = app.CommandRouter()
+    router.regex(r"^(\w)\1$")(lambda ctx: "double")
+    router.regex(r"^(?P<x>\d)-(?P=x)$")(lambda ctx: "same digit")
+
+    assert router.dispatch(ctx("aa")) == "double"
+    assert router.dispatch(ctx("7-7")) == "same digit"
+    assert router.resolve("ab") == (None, None)
+
+
+def test_duplicate_command_is_rejected(app):
+    router = app.CommandRouter()
+    router.command("課程")(lambda ctx: None)
+
+    with pytest.raises(ValueError):
+        router.command("課程", "課表")(lambda ctx: None)
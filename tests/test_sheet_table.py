@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+HEADER = ["日期", "姓名", "時長"]
+
+
+def make_table(app, rows):
+    return app.SheetTable.from_rows(HEADER, rows, {"日期": "date", "時長": "int"})
+
+
+def snapshot(table):
+    return [row.to_dict() for row in table], table.column("日期", "date"), table.column("時長", "int")
+
+
+def test_appended_keeps_old_table_intact(app):
+    base = make_table(app, [["2025-05-01", "王", 30], ["2025-05-02", "李", 45]])
+    before = snapshot(base)
+
+    longer = base.appended([["2025-05-03", "陳", 60]])
+
+    assert snapshot(base) == before
+    assert len(longer) == 3
+    assert longer[2].to_dict() == {"日期": "2025-05-03", "姓名": "陳", "時長": 60}
+    assert longer.startswith(base)
+
+
+def test_appended_from_an_older_version_does_not_overwrite_the_newer_one(app):
+    # 兩個版本從同一張表延伸：共用的欄位尾端已被第一次 appended 使用，第二次必須複製
+    base = make_table(app, [["2025-05-01", "王", 30]])
+    first = base.appended([["2025-05-02", "李", 45]])
+    first_before = snapshot(first)
+
+    second = base.appended([["2025-06-01", "陳", 90]])
+
+    assert snapshot(first) == first_before
+    assert second[1].to_dict() == {"日期": "2025-06-01", "姓名": "陳", "時長": 90}
+    assert len(base) == 1
+    assert not second.startswith(first)
+
+
+def test_appended_non_int_value_into_int_column(app):
+    base = make_table(app, [["2025-05-01", "王", 30]])
+    longer = base.appended([["2025-05-02", "李", "未填"]])
+
+    assert list(base.column("時長")) == [30]
+    assert list(longer.column("時長")) == [30, "未填"]
+    assert longer[1].int("時長") is None
+
+
+def test_startswith_detects_edited_rows(app):
+    base = make_table(app, [["2025-05-01", "王", 30], ["2025-05-02", "李", 45]])
+    edited = make_table(app, [["2025-05-01", "王", 30], ["2025-05-02", "李", 50], ["2025-05-03", "陳", 60]])
+
+    assert not edited.startswith(base)
+    assert not base.startswith(edited)
+
+
+def test_state_round_trips_through_json(app):
+    table = make_table(app, [["2025-05-01", "王", 30], ["", "李", ""]])
+
+    restored = app.SheetTable.from_state(json.loads(json.dumps(table.to_state())))
+
+    assert snapshot(restored) == snapshot(table)
+    assert restored[0].date("日期").isoformat() == "2025-05-01"
+    assert restored[1].date("日期") is None
+
+
+def test_from_state_rejects_unknown_array_type(app):
+    state = make_table(app, [["2025-05-01", "王", 30]]).to_state()
+    state["columns"][2] = {"array": "O", "data": ""}
+
+    with pytest.raises(ValueError):
+        app.SheetTable.from_state(state)
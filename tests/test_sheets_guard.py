@@ -0,0 +1,62 @@
+import pytest
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def failing(code):
+    def call():
+        raise ApiError(code)
+    return call
+
+
+def test_unauthorized_resets_the_client(app):
+    resets = []
+    guard = app.SheetsGuard(attempts=1, on_unauthorized=lambda: resets.append(True))
+
+    with pytest.raises(ApiError):
+        guard.call(failing(404))
+    assert resets == []
+
+    with pytest.raises(ApiError):
+        guard.call(failing(401))
+    assert resets == [True]
+    assert guard.breaker.state == "closed"
+
+
+def test_reset_drops_the_cached_client(app):
+    manager = app.GspreadClientManager()
+    manager._client = object()
+
+    manager.reset()
+
+    assert manager._client is None
+
+
+class DeferredThread:
+    # 不真的啟動執行緒，由測試決定何時執行背景工作
+    started = []
+
+    def __init__(self, target, **kwargs):
+        self.target = target
+
+    def start(self):
+        self.started.append(self.target)
+
+
+def test_only_one_background_refresh_at_a_time(app, monkeypatch):
+    manager = app.GspreadClientManager()
+    monkeypatch.setattr(DeferredThread, "started", [])
+    monkeypatch.setattr(app.threading, "Thread", DeferredThread)
+    monkeypatch.setattr(manager, "_refresh_token", lambda client: None)
+
+    manager._refresh_in_background(object())
+    manager._refresh_in_background(object())
+    assert len(DeferredThread.started) == 1
+
+    DeferredThread.started[0]()
+    manager._refresh_in_background(object())
+    assert len(DeferredThread.started) == 2
@@ -0,0 +1,55 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def snapshot_file(app, tmp_path):
+    cache = app.WorksheetCache(fetcher=lambda spreadsheet_id, sheet_name: None)
+    tmp_path.chmod(0o700)
+    return app.SnapshotFile(str(tmp_path / "sheets.snapshot"), cache, "test")
+
+
+def save_table(app, snapshot_file):
+    table = app.SheetTable.from_rows(["日期", "時長"], [["2025-05-01", 30]], {"日期": "date", "時長": "int"})
+    snapshot_file.cache.publish_many("test", {"紀錄": table}, notify=False)
+    assert snapshot_file.save()
+
+
+def write_payload(app, snapshot_file, payload):
+    with open(snapshot_file.path, "wb") as f:
+        f.write(app.SNAPSHOT_MAGIC + json.dumps(payload).encode())
+
+
+def test_restore_round_trip(app, snapshot_file):
+    save_table(app, snapshot_file)
+    snapshot_file.cache.invalidate()
+
+    assert snapshot_file.restore()
+    assert snapshot_file.restored["sheets"] == 1
+    assert snapshot_file.cache.export("test")["紀錄"][0][0].int("時長") == 30
+
+
+def test_truncated_file_falls_back_to_live_fetch(app, snapshot_file):
+    save_table(app, snapshot_file)
+    with open(snapshot_file.path, "r+b") as f:
+        f.truncate(len(app.SNAPSHOT_MAGIC) + 10)
+    snapshot_file.cache.invalidate()
+
+    assert not snapshot_file.restore()
+    assert snapshot_file.cache.export("test") == {}
+
+
+@pytest.mark.parametrize("payload", [
+    {"spreadsheet_id": "test", "saved_at": 0},
+    {"spreadsheet_id": "test", "sheets": {}},
+    {"spreadsheet_id": "test", "saved_at": 0, "sheets": {"紀錄": [{"length": 1, "header": ["日期"], "columns": [], "typed": {}}, 0]}},
+    {"spreadsheet_id": "test", "saved_at": 0, "sheets": {"紀錄": "舊版格式"}},
+])
+def test_bad_payload_is_removed(app, snapshot_file, payload):
+    write_payload(app, snapshot_file, payload)
+
+    assert not snapshot_file.restore()
+    assert snapshot_file.restored is None
+    assert not os.path.exists(snapshot_file.path)
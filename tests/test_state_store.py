@@ -0,0 +1,117 @@
+import socketserver
+import threading
+
+import pytest
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    # 只實作 RedisStateStore 用到的指令，MULTI 之後的指令排隊到 EXEC 才執行
+    def handle(self):
+        queued = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            self.server.commands.append(args[0].upper())
+            command = args[0].upper()
+            if command == b"MULTI":
+                queued = []
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"EXEC":
+                replies = [self.run(queued_args) for queued_args in queued]
+                queued = None
+                self.wfile.write(b"*%d\r\n" % len(replies) + b"".join(replies))
+            elif queued is not None:
+                queued.append(args)
+                self.wfile.write(b"+QUEUED\r\n")
+            else:
+                self.wfile.write(self.run(args))
+
+    def run(self, args):
+        data = self.server.data
+        command = args[0].upper()
+        if command == b"SET":
+            if b"NX" in args[3:] and args[1] in data:
+                return b"$-1\r\n"
+            data[args[1]] = args[2]
+            return b"+OK\r\n"
+        if command == b"GET":
+            return self.bulk(data.get(args[1]))
+        if command == b"DEL":
+            return b":%d\r\n" % int(data.pop(args[1], None) is not None)
+        if command == b"MGET":
+            return b"*%d\r\n" % (len(args) - 1) + b"".join(self.bulk(data.get(key)) for key in args[1:])
+        if command in (b"AUTH", b"SELECT"):
+            return b"+OK\r\n"
+        return b"-ERR unknown command\r\n"
+
+    @staticmethod
+    def bulk(value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+@pytest.fixture
+def redis_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = {}
+    server.commands = []
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, app, tmp_path):
+    if request.param == "memory":
+        return app.create_state_store("memory://")
+    if request.param == "sqlite":
+        return app.create_state_store(f"sqlite:///{tmp_path}/states.db")
+    server = request.getfixturevalue("redis_server")
+    return app.create_state_store(f"redis://:secret@127.0.0.1:{server.server_address[1]}/1")
+
+
+def test_set_get_pop(store):
+    store.set("U1", {"state": "awaiting_member_info", "page": 2})
+
+    assert store.get("U1") == {"state": "awaiting_member_info", "page": 2}
+    assert store.pop("U1") == {"state": "awaiting_member_info", "page": 2}
+    assert store.get("U1") is None
+    assert store.pop("U1", "gone") == "gone"
+
+
+def test_add_does_not_overwrite(store):
+    assert store.add("member:A00001", "U1")
+    assert not store.add("member:A00001", "U2")
+    assert store.get("member:A00001") == "U1"
+
+
+def test_get_many_skips_missing_keys(store):
+    store.set("a", 1)
+    store.set("c", "三")
+
+    assert store.get_many(["a", "b", "c"]) == {"a": 1, "c": "三"}
+
+
+def test_redis_pop_is_a_single_transaction(app, redis_server):
+    store = app.create_state_store(f"redis://127.0.0.1:{redis_server.server_address[1]}/0")
+    store.set("U1", "awaiting_fitness_name")
+    redis_server.commands.clear()
+
+    assert store.pop("U1") == "awaiting_fitness_name"
+    assert redis_server.commands == [b"MULTI", b"GET", b"DEL", b"EXEC"]
+
+
+def test_redis_error_reply_keeps_the_connection_usable(app, redis_server):
+    store = app.create_state_store(f"redis://127.0.0.1:{redis_server.server_address[1]}/0")
+    store.set("U1", "ok")
+
+    with pytest.raises(RuntimeError):
+        store._pipeline([("BOGUS",), ("GET", store.prefix + "U1")])
+
+    assert store.get("U1") == "ok"